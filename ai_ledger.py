@@ -0,0 +1,111 @@
+# ai_ledger.py
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+INSERT_CALL_SQL = '''
+    INSERT INTO ai_calls (created_at, feature, provider, model, prompt_tokens,
+                          completion_tokens, latency_ms, status, cache_hit)
+    VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
+'''
+
+DAILY_REPORT_SQL = '''
+    SELECT created_at::date AS day,
+           feature,
+           provider,
+           model,
+           COUNT(*) AS calls,
+           COUNT(*) FILTER (WHERE status <> 'ok') AS errors,
+           COUNT(*) FILTER (WHERE cache_hit) AS cache_hits,
+           COALESCE(SUM(prompt_tokens), 0) AS prompt_tokens,
+           COALESCE(SUM(completion_tokens), 0) AS completion_tokens,
+           AVG(latency_ms) AS avg_latency_ms,
+           percentile_cont(0.95) WITHIN GROUP (ORDER BY latency_ms) AS p95_latency_ms
+    FROM ai_calls
+    WHERE created_at >= CURRENT_DATE - $1::int
+    GROUP BY day, feature, provider, model
+    ORDER BY day DESC, calls DESC
+'''
+
+# Пауза перед повторной записью после ошибки БД
+FLUSH_RETRY_DELAY = 5
+
+class AICallLedger:
+    """Журнал вызовов ИИ с пакетной записью в таблицу ai_calls.
+    
+    record() не ждет БД: вызовы копятся в памяти и записываются одним
+    executemany раз в flush_interval секунд или при накоплении max_batch.
+    Если БД долго недоступна, в памяти хранится не больше max_pending
+    записей, самые старые отбрасываются.
+    """
+    
+    def __init__(self, db, *,
+                 flush_interval: float = 5,
+                 max_batch: int = 500,
+                 max_pending: int = 10000):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self._pending: List[Tuple] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        self.dropped = 0
+    
+    def record(self, *, feature: str, provider: str, model: Optional[str],
+               prompt_tokens: Optional[int], completion_tokens: Optional[int],
+               latency_ms: float, status: str, cache_hit: bool = False):
+        """Добавить вызов в очередь записи"""
+        self._pending.append((
+            datetime.now(), feature, provider, model, prompt_tokens,
+            completion_tokens, int(latency_ms), status, cache_hit
+        ))
+        
+        if len(self._pending) > self.max_pending:
+            overflow = len(self._pending) - self.max_pending
+            del self._pending[:overflow]
+            self.dropped += overflow
+        
+        self._schedule_flush(0 if len(self._pending) >= self.max_batch else self.flush_interval)
+    
+    def _schedule_flush(self, delay: float):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush(delay))
+    
+    async def _delayed_flush(self, delay: float):
+        await asyncio.sleep(delay)
+        self._flush_task = None
+        await self.flush()
+    
+    async def flush(self):
+        """Записать накопленные вызовы"""
+        while self._pending:
+            batch = self._pending[:self.max_batch]
+            del self._pending[:len(batch)]
+            
+            try:
+                async with self.db.acquire('ai_ledger.flush') as conn:
+                    await conn.executemany(INSERT_CALL_SQL, batch)
+            except asyncio.CancelledError:
+                self._pending[:0] = batch
+                raise
+            except Exception as e:
+                logger.error("Error writing AI call ledger: %s", e)
+                self._pending[:0] = batch
+                self._schedule_flush(FLUSH_RETRY_DELAY)
+                return
+    
+    async def close(self):
+        """Дописать очередь при остановке бота"""
+        if self._flush_task and not self._flush_task.done():
+            self._flush_task.cancel()
+        await self.flush()
+    
+    async def get_daily_report(self, days: int = 7) -> List[Dict[str, Any]]:
+        """Вызовы по дням, функциям, провайдерам и моделям за последние days дней"""
+        await self.flush()
+        async with self.db.acquire('ai_ledger.get_daily_report', replica=True) as conn:
+            rows = await conn.fetch(DAILY_REPORT_SQL, days - 1)
+        return [dict(row) for row in rows]
@@ -1,26 +1,61 @@
 # ai_service.py
 import aiohttp
+import contextvars
 import json
 import logging
-from typing import Optional
+import time
+from typing import Any, Dict, Optional
 from abc import ABC, abstractmethod
 
+from models import Marathon
+
 logger = logging.getLogger(__name__)
 
+# Функция бота, для которой идет запрос (метка в журнале ai_calls).
+# Выставляется в начале каждого метода AIService
+current_feature: contextvars.ContextVar = contextvars.ContextVar("ai_feature", default="feedback")
+
 class AIProvider(ABC):
     """Абстрактный класс для провайдеров ИИ"""
     
+    name = "unknown"
+    model: Optional[str] = None
+    # Журнал вызовов (AICallLedger), подставляется AIService
+    ledger = None
+    
     @abstractmethod
     async def generate_feedback(self, comment: str, duration: int, rating: int) -> str:
         pass
+    
+    def _record_call(self, started: float, status: str, data: Optional[Dict[str, Any]] = None):
+        """Записать вызов API в журнал: usage в формате OpenAI или Anthropic"""
+        if self.ledger is None:
+            return
+        
+        data = data or {}
+        usage = data.get('usage') or {}
+        cached = (usage.get('cache_read_input_tokens')
+                  or (usage.get('prompt_tokens_details') or {}).get('cached_tokens'))
+        self.ledger.record(
+            feature=current_feature.get(),
+            provider=self.name,
+            model=data.get('model') or self.model,
+            prompt_tokens=usage.get('prompt_tokens', usage.get('input_tokens')),
+            completion_tokens=usage.get('completion_tokens', usage.get('output_tokens')),
+            latency_ms=(time.perf_counter() - started) * 1000,
+            status=status,
+            cache_hit=bool(cached)
+        )
 
 class OpenRouterProvider(AIProvider):
     """Провайдер для OpenRouter API"""
     
-    def __init__(self, api_key: str, model: str = "anthropic/claude-3-haiku"):
+    name = "openrouter"
+    
+    def __init__(self, api_key: str, model: str = "anthropic/claude-3-haiku", base_url: Optional[str] = None):
         self.api_key = api_key
         self.model = model
-        self.base_url = "https://openrouter.ai/api/v1/chat/completions"
+        self.base_url = f"{(base_url or 'https://openrouter.ai/api/v1').rstrip('/')}/chat/completions"
     
     async def generate_feedback(self, comment: str, duration: int, rating: int) -> str:
         prompt = f"""Ты - опытный инструктор медитации. Пользователь завершил медитацию:
@@ -54,6 +89,7 @@ class OpenRouterProvider(AIProvider):
             "temperature": 0.7
         }
         
+        started = time.perf_counter()
         try:
             async with aiohttp.ClientSession() as session:
                 async with session.post(
@@ -63,13 +99,17 @@ class OpenRouterProvider(AIProvider):
                 ) as response:
                     if response.status == 200:
                         data = await response.json()
-                        return data['choices'][0]['message']['content']
+                        content = data['choices'][0]['message']['content']
+                        self._record_call(started, "ok", data)
+                        return content
                     else:
                         error_data = await response.text()
-                        logger.error(f"OpenRouter API error: {response.status} - {error_data}")
+                        self._record_call(started, f"http_{response.status}")
+                        logger.error("OpenRouter API error: %s - %s", response.status, error_data)
                         return self._get_fallback_feedback(rating)
         except Exception as e:
-            logger.error(f"Error calling OpenRouter API: {e}")
+            self._record_call(started, "error")
+            logger.error("Error calling OpenRouter API: %s", e)
             return self._get_fallback_feedback(rating)
     
     def _get_fallback_feedback(self, rating: int) -> str:
@@ -83,9 +123,12 @@ class OpenRouterProvider(AIProvider):
 class ClaudeProvider(AIProvider):
     """Провайдер для Claude API"""
     
-    def __init__(self, api_key: str):
+    name = "claude"
+    
+    def __init__(self, api_key: str, base_url: Optional[str] = None):
         self.api_key = api_key
-        self.base_url = "https://api.anthropic.com/v1/messages"
+        self.model = "claude-3-haiku-20240307"
+        self.base_url = f"{(base_url or 'https://api.anthropic.com/v1').rstrip('/')}/messages"
     
     async def generate_feedback(self, comment: str, duration: int, rating: int) -> str:
         prompt = f"""Ты - опытный инструктор медитации. Пользователь завершил медитацию:
@@ -103,12 +146,13 @@ class ClaudeProvider(AIProvider):
         }
         
         payload = {
-            "model": "claude-3-haiku-20240307",
+            "model": self.model,
             "messages": [{"role": "user", "content": prompt}],
             "max_tokens": 300,
             "temperature": 0.7
         }
         
+        started = time.perf_counter()
         try:
             async with aiohttp.ClientSession() as session:
                 async with session.post(
@@ -118,12 +162,16 @@ class ClaudeProvider(AIProvider):
                 ) as response:
                     if response.status == 200:
                         data = await response.json()
-                        return data['content'][0]['text']
+                        content = data['content'][0]['text']
+                        self._record_call(started, "ok", data)
+                        return content
                     else:
-                        logger.error(f"Claude API error: {response.status}")
+                        self._record_call(started, f"http_{response.status}")
+                        logger.error("Claude API error: %s", response.status)
                         return self._get_fallback_feedback(rating)
         except Exception as e:
-            logger.error(f"Error calling Claude API: {e}")
+            self._record_call(started, "error")
+            logger.error("Error calling Claude API: %s", e)
             return self._get_fallback_feedback(rating)
     
     def _get_fallback_feedback(self, rating: int) -> str:
@@ -137,9 +185,12 @@ class ClaudeProvider(AIProvider):
 class OpenAIProvider(AIProvider):
     """Провайдер для OpenAI API"""
     
-    def __init__(self, api_key: str):
+    name = "openai"
+    
+    def __init__(self, api_key: str, base_url: Optional[str] = None):
         self.api_key = api_key
-        self.base_url = "https://api.openai.com/v1/chat/completions"
+        self.model = "gpt-3.5-turbo"
+        self.base_url = f"{(base_url or 'https://api.openai.com/v1').rstrip('/')}/chat/completions"
     
     async def generate_feedback(self, comment: str, duration: int, rating: int) -> str:
         prompt = f"""Ты - опытный инструктор медитации. Пользователь завершил медитацию:
@@ -156,7 +207,7 @@ class OpenAIProvider(AIProvider):
         }
         
         payload = {
-            "model": "gpt-3.5-turbo",
+            "model": self.model,
             "messages": [
                 {"role": "system", "content": "Ты опытный и заботливый инструктор медитации."},
                 {"role": "user", "content": prompt}
@@ -165,6 +216,7 @@ class OpenAIProvider(AIProvider):
             "temperature": 0.7
         }
         
+        started = time.perf_counter()
         try:
             async with aiohttp.ClientSession() as session:
                 async with session.post(
@@ -174,12 +226,16 @@ class OpenAIProvider(AIProvider):
                 ) as response:
                     if response.status == 200:
                         data = await response.json()
-                        return data['choices'][0]['message']['content']
+                        content = data['choices'][0]['message']['content']
+                        self._record_call(started, "ok", data)
+                        return content
                     else:
-                        logger.error(f"OpenAI API error: {response.status}")
+                        self._record_call(started, f"http_{response.status}")
+                        logger.error("OpenAI API error: %s", response.status)
                         return self._get_fallback_feedback(rating)
         except Exception as e:
-            logger.error(f"Error calling OpenAI API: {e}")
+            self._record_call(started, "error")
+            logger.error("Error calling OpenAI API: %s", e)
             return self._get_fallback_feedback(rating)
     
     def _get_fallback_feedback(self, rating: int) -> str:
@@ -193,10 +249,15 @@ class OpenAIProvider(AIProvider):
 class AIService:
     """Сервис для работы с ИИ"""
     
-    def __init__(self, api_key: str, provider: str = "openrouter", model: str = None):
-        self.provider = self._get_provider(api_key, provider, model)
+    def __init__(self, api_key: str, provider: str = "openrouter", model: str = None,
+                 base_url: Optional[str] = None, ledger=None):
+        # base_url заменяет адрес API провайдера (например, на loadtest/mock_llm.py)
+        self.provider = self._get_provider(api_key, provider, model, base_url)
+        # Журнал вызовов ИИ (AICallLedger), необязателен
+        self.provider.ledger = ledger
     
-    def _get_provider(self, api_key: str, provider: str, model: str = None) -> AIProvider:
+    def _get_provider(self, api_key: str, provider: str, model: str = None,
+                      base_url: Optional[str] = None) -> AIProvider:
         if provider.lower() == "openrouter":
             # Рекомендуемые модели для OpenRouter:
             # - anthropic/claude-3-haiku (быстрый и дешевый)
@@ -206,37 +267,41 @@ class AIService:
             # - google/gemini-pro (бесплатный лимит)
             # - meta-llama/llama-3-8b-instruct (дешевый)
             default_model = model or "anthropic/claude-3-haiku"
-            return OpenRouterProvider(api_key, default_model)
+            return OpenRouterProvider(api_key, default_model, base_url)
         elif provider.lower() == "claude":
-            return ClaudeProvider(api_key)
+            return ClaudeProvider(api_key, base_url)
         elif provider.lower() == "openai":
-            return OpenAIProvider(api_key)
+            return OpenAIProvider(api_key, base_url)
         else:
             raise ValueError(f"Unknown AI provider: {provider}")
     
     async def generate_feedback(self, comment: str, duration: int, rating: int) -> str:
         """Генерация персональной обратной связи"""
+        current_feature.set("feedback")
         return await self.provider.generate_feedback(comment, duration, rating)
     
-    async def generate_marathon_summary(self, user_stats: dict, marathon_info: dict) -> str:
+    async def generate_marathon_summary(self, user_stats: dict, marathon_info: Marathon) -> str:
         """Генерация итогового отчета по марафону"""
+        current_feature.set("marathon_summary")
+        total_days = (marathon_info.end_date - marathon_info.start_date).days + 1
         prompt = f"""Создай мотивирующий итоговый отчет по марафону медитаций:
-- Название марафона: {marathon_info['title']}
-- Продолжительность: {marathon_info['total_days']} дней
-- Цель: {marathon_info['daily_goal']} медитаций в день
+- Название марафона: {marathon_info.title}
+- Продолжительность: {total_days} дней
+- Цель: {marathon_info.daily_goal} медитаций в день
 - Выполнено дней: {user_stats['completed_days']}
 - Всего медитаций: {user_stats['sessions_count']}
 - Общее время: {user_stats['total_duration']} минут
 - Средняя оценка: {user_stats['avg_rating']}/10
 
 Отчет должен быть позитивным, отмечать достижения и мотивировать на дальнейшую практику."""
-        
+
         # Используем generate_feedback с модифицированным промптом
         return await self.provider.generate_feedback(prompt, 0, 10)
     
     async def generate_dialogue_response(self, message: str, history: str, 
                                        system_prompt: str, dialogue_prompt: str) -> str:
         """Генерация ответа в диалоге с учетом истории"""
+        current_feature.set("dialogue")
         if isinstance(self.provider, OpenRouterProvider):
             formatted_prompt = dialogue_prompt.format(
                 history=history,
@@ -260,6 +325,7 @@ class AIService:
                 "temperature": 0.8
             }
             
+            started = time.perf_counter()
             try:
                 async with aiohttp.ClientSession() as session:
                     async with session.post(
@@ -269,11 +335,15 @@ class AIService:
                     ) as response:
                         if response.status == 200:
                             data = await response.json()
-                            return data['choices'][0]['message']['content']
+                            content = data['choices'][0]['message']['content']
+                            self.provider._record_call(started, "ok", data)
+                            return content
                         else:
+                            self.provider._record_call(started, f"http_{response.status}")
                             return "Извините, не могу ответить сейчас. Попробуйте позже."
             except Exception as e:
-                logger.error(f"Error in dialogue: {e}")
+                self.provider._record_call(started, "error")
+                logger.error("Error in dialogue: %s", e)
                 return "Произошла ошибка. Попробуйте позже."
         else:
             # Для других провайдеров используем базовый метод
@@ -281,6 +351,7 @@ class AIService:
     
     async def parse_meditation_entry(self, message: str) -> str:
         """Парсинг свободной формы записи медитации"""
+        current_feature.set("parse_entry")
         from prompts import PARSE_MEDITATION_PROMPT
         
         prompt = PARSE_MEDITATION_PROMPT.format(message=message)
@@ -303,6 +374,7 @@ class AIService:
                 "temperature": 0.3
             }
             
+            started = time.perf_counter()
             try:
                 async with aiohttp.ClientSession() as session:
                     async with session.post(
@@ -312,41 +384,32 @@ class AIService:
                     ) as response:
                         if response.status == 200:
                             data = await response.json()
-                            return data['choices'][0]['message']['content']
+                            content = data['choices'][0]['message']['content']
+                            self.provider._record_call(started, "ok", data)
+                            return content
                         else:
+                            self.provider._record_call(started, f"http_{response.status}")
                             return '{"confidence": false, "clarification_needed": "информацию о медитации"}'
             except Exception as e:
-                logger.error(f"Error parsing meditation: {e}")
+                self.provider._record_call(started, "error")
+                logger.error("Error parsing meditation: %s", e)
                 return '{"confidence": false, "clarification_needed": "информацию о медитации"}'
         else:
             return '{"confidence": false, "clarification_needed": "информацию о медитации"}'
-
+    
     async def get_progress_analysis(self, data: dict) -> str:
-        """Генерирует текстовый анализ прогресса пользователя."""
+        """Генерирует текстовый анализ прогресса пользователя.
+        
+        data['report'] - ProgressReport по всей истории (analytics.py).
+        """
+        current_feature.set("progress_analysis")
+        from analytics import prompt_fields
         from prompts import PROGRESS_ANALYSIS_PROMPT
-
-        # Тренд вычисляем по средним оценкам первой и второй половины
-        ratings = [s.get("rating") for s in data.get("recent_sessions", []) if s.get("rating") is not None]
-        trend = "недостаточно данных"
-        if len(ratings) >= 2:
-            half = len(ratings) // 2
-            first_avg = sum(ratings[:half]) / half
-            last_avg = sum(ratings[half:]) / len(ratings[half:])
-            delta = last_avg - first_avg
-            if delta > 0.5:
-                trend = "растущий"
-            elif delta < -0.5:
-                trend = "падающий"
-            else:
-                trend = "стабильный"
-
+        
         prompt = PROGRESS_ANALYSIS_PROMPT.format(
-            total_sessions=data.get('total_sessions', 0),
-            total_duration=data.get('total_duration', 0),
-            avg_rating=data.get('avg_rating', 0),
             month_sessions=data.get('monthly_sessions', 0),
-            rating_trend=trend
+            **prompt_fields(data['report'])
         )
-
+        
         # Используем провайдера, как и в генерации отчетов
         return await self.provider.generate_feedback(prompt, 0, 10)
@@ -0,0 +1,258 @@
+# analytics.py
+"""Аналитика прогресса пользователя на NumPy.
+
+Вся история (горячие сессии и архивные сводки по дням) загружается одним
+запросом в колоночном виде и обрабатывается векторно: скользящие средние,
+связь длительности и оценки, эффективность по времени суток и дням недели,
+наклон тренда. Архивная строка - это день целиком, поэтому она участвует
+с весом sessions_count и не учитывается там, где важно время начала или
+длительность одной сессии. Результат кэшируется по пользователю и
+пересчитывается, когда меняется его сводная статистика.
+"""
+import logging
+import time
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+
+from cache import TTLCache
+from models import SessionHistory, UserStats
+
+logger = logging.getLogger(__name__)
+
+SECONDS_PER_DAY = 86400
+
+# Окна скользящего среднего оценки (в медитациях)
+SHORT_WINDOW = 7
+LONG_WINDOW = 30
+
+# Тренд считается по последним дням практики (от последней медитации)
+TREND_DAYS = 90
+
+# Меньше точек - корреляция и тренд не считаются
+MIN_POINTS = 5
+
+# Наклон тренда, меньше которого (по модулю) тренд считается стабильным
+STABLE_RATING_SLOPE = 0.1  # баллов в неделю
+STABLE_DURATION_SLOPE = 0.5  # минут в неделю
+
+TIME_OF_DAY_EDGES = [5, 12, 17, 23]
+TIME_OF_DAY_LABELS = ("ночью", "утром", "днем", "вечером", "ночью")
+
+DURATION_EDGES = [10, 20, 30]
+DURATION_LABELS = ("до 10 мин", "10-20 мин", "20-30 мин", "30+ мин")
+
+WEEKDAY_LABELS = ("пн", "вт", "ср", "чт", "пт", "сб", "вс")
+
+class BucketStat(NamedTuple):
+    """Медитации одной группы (время суток, день недели, длительность)"""
+    label: str
+    sessions: int
+    avg_rating: Optional[float]
+
+class ProgressReport(NamedTuple):
+    total_sessions: int
+    total_duration: int
+    active_days: int
+    avg_rating: Optional[float]
+    rolling_short: Optional[float]
+    previous_short: Optional[float]
+    rolling_long: Optional[float]
+    rating_slope: Optional[float]  # баллов в неделю
+    duration_slope: Optional[float]  # минут в неделю
+    duration_correlation: Optional[float]
+    time_of_day: List[BucketStat]
+    weekdays: List[BucketStat]
+    durations: List[BucketStat]
+    
+    def best(self, buckets: Sequence[BucketStat]) -> Optional[BucketStat]:
+        """Группа с лучшей средней оценкой (не меньше MIN_POINTS медитаций)"""
+        rated = [b for b in buckets if b.avg_rating is not None and b.sessions >= MIN_POINTS]
+        return max(rated, key=lambda b: b.avg_rating) if rated else None
+
+def _mean(values: np.ndarray, weights: np.ndarray) -> Optional[float]:
+    total = weights.sum()
+    return float(values @ weights / total) if total else None
+
+def _buckets(labels: Sequence[str], index: np.ndarray, ratings: np.ndarray,
+             weights: np.ndarray, merge: Optional[Dict[int, int]] = None) -> List[BucketStat]:
+    """Число медитаций и средняя оценка по группам.
+    
+    index - номер группы для каждой строки, merge склеивает группы с
+    одинаковой подписью (ночь до 5 утра и после 23 часов).
+    """
+    if merge:
+        index = index.copy()
+        for source, target in merge.items():
+            index[index == source] = target
+    
+    size = len(labels)
+    rated = ~np.isnan(ratings)
+    sessions = np.bincount(index, weights=weights, minlength=size)
+    rated_weights = np.bincount(index[rated], weights=weights[rated], minlength=size)
+    rating_sums = np.bincount(index[rated], weights=ratings[rated] * weights[rated], minlength=size)
+    
+    merged = set(merge or ())
+    return [
+        BucketStat(
+            label=labels[i],
+            sessions=int(sessions[i]),
+            avg_rating=float(rating_sums[i] / rated_weights[i]) if rated_weights[i] else None
+        )
+        for i in range(size) if i not in merged
+    ]
+
+def _slope(days: np.ndarray, values: np.ndarray, weights: np.ndarray) -> Optional[float]:
+    """Наклон линейного тренда в единицах за неделю"""
+    if days.size < MIN_POINTS or np.ptp(days) == 0:
+        return None
+    slope, _ = np.polyfit(days, values, 1, w=np.sqrt(weights))
+    return float(slope * 7)
+
+def compute_report(history: SessionHistory) -> ProgressReport:
+    """Аналитика по всей истории пользователя"""
+    start_ts = np.asarray(history.start_ts, dtype=np.float64)
+    durations = np.asarray(history.durations, dtype=np.float64)
+    ratings = np.asarray(history.ratings, dtype=np.float64)
+    counts = np.asarray(history.counts, dtype=np.float64)
+    archived = np.asarray(history.archived, dtype=bool)
+    durations = np.nan_to_num(durations)
+    
+    days = np.floor_divide(start_ts, SECONDS_PER_DAY)
+    rated = ~np.isnan(ratings)
+    hot = ~archived
+    
+    # Скользящие средние по последним оценкам (архивный день - sessions_count оценок)
+    rated_ratings = ratings[rated]
+    rated_counts = counts[rated]
+    cum_weights = np.concatenate(([0.0], np.cumsum(rated_counts)))
+    cum_sums = np.concatenate(([0.0], np.cumsum(rated_ratings * rated_counts)))
+    
+    def window_mean(end: int, size: int) -> Optional[float]:
+        start = max(0, end - size)
+        weight = cum_weights[end] - cum_weights[start]
+        return float((cum_sums[end] - cum_sums[start]) / weight) if end > 0 and weight else None
+    
+    last = rated_ratings.size
+    previous_short = window_mean(last - SHORT_WINDOW, SHORT_WINDOW) if last > SHORT_WINDOW else None
+    
+    # Тренды за последние TREND_DAYS дней практики
+    recent = days >= (days.max() - TREND_DAYS if days.size else 0)
+    trend_rated = recent & rated
+    rating_slope = _slope(days[trend_rated], ratings[trend_rated], counts[trend_rated])
+    trend_hot = recent & hot
+    duration_slope = _slope(days[trend_hot], durations[trend_hot], counts[trend_hot])
+    
+    # Связь длительности и оценки - только по отдельным сессиям
+    paired = hot & rated
+    correlation = None
+    if paired.sum() >= MIN_POINTS and durations[paired].std() > 0 and ratings[paired].std() > 0:
+        correlation = float(np.corrcoef(durations[paired], ratings[paired])[0, 1])
+    
+    # Время суток и длительность известны только у горячих сессий
+    hours = (start_ts[hot] % SECONDS_PER_DAY) // 3600
+    time_of_day = _buckets(
+        TIME_OF_DAY_LABELS, np.digitize(hours, TIME_OF_DAY_EDGES),
+        ratings[hot], counts[hot], merge={4: 0}
+    )
+    duration_buckets = _buckets(
+        DURATION_LABELS, np.digitize(durations[hot], DURATION_EDGES),
+        ratings[hot], counts[hot]
+    )
+    
+    # 1 января 1970 - четверг
+    weekdays = _buckets(WEEKDAY_LABELS, ((days.astype(np.int64) + 3) % 7), ratings, counts)
+    
+    return ProgressReport(
+        total_sessions=int(counts.sum()),
+        total_duration=int(durations.sum()),
+        active_days=int(np.unique(days).size),
+        avg_rating=_mean(rated_ratings, rated_counts),
+        rolling_short=window_mean(last, SHORT_WINDOW),
+        previous_short=previous_short,
+        rolling_long=window_mean(last, LONG_WINDOW),
+        rating_slope=rating_slope,
+        duration_slope=duration_slope,
+        duration_correlation=correlation,
+        time_of_day=time_of_day,
+        weekdays=weekdays,
+        durations=duration_buckets
+    )
+
+def _number(value: Optional[float], fmt: str = ".1f") -> str:
+    return format(value, fmt) if value is not None else "нет данных"
+
+def _trend(slope: Optional[float], stable: float, unit: str) -> str:
+    if slope is None:
+        return "недостаточно данных"
+    if slope > stable:
+        word = "растущий"
+    elif slope < -stable:
+        word = "падающий"
+    else:
+        word = "стабильный"
+    return f"{word} ({slope:+.2f} {unit} в неделю)"
+
+def _correlation(value: Optional[float]) -> str:
+    if value is None:
+        return "недостаточно данных"
+    strength = abs(value)
+    if strength < 0.2:
+        return f"практически нет (r = {value:+.2f})"
+    word = "сильная" if strength >= 0.5 else "умеренная"
+    direction = "длиннее - выше оценка" if value > 0 else "длиннее - ниже оценка"
+    return f"{word}, {direction} (r = {value:+.2f})"
+
+def _bucket_list(buckets: Sequence[BucketStat]) -> str:
+    parts = [
+        f"{b.label}: {b.sessions} медитаций, оценка {_number(b.avg_rating)}"
+        for b in buckets if b.sessions
+    ]
+    return "; ".join(parts) or "нет данных"
+
+def prompt_fields(report: ProgressReport) -> Dict[str, str]:
+    """Поля PROGRESS_ANALYSIS_PROMPT из отчета"""
+    return {
+        'total_sessions': str(report.total_sessions),
+        'active_days': str(report.active_days),
+        'total_duration': str(report.total_duration),
+        'avg_rating': _number(report.avg_rating),
+        'rolling_short': _number(report.rolling_short),
+        'previous_short': _number(report.previous_short),
+        'rolling_long': _number(report.rolling_long),
+        'rating_trend': _trend(report.rating_slope, STABLE_RATING_SLOPE, "балла"),
+        'duration_trend': _trend(report.duration_slope, STABLE_DURATION_SLOPE, "мин"),
+        'duration_correlation': _correlation(report.duration_correlation),
+        'time_of_day': _bucket_list(report.time_of_day),
+        'weekdays': _bucket_list(report.weekdays),
+        'duration_buckets': _bucket_list(report.durations),
+    }
+
+class ProgressAnalyzer:
+    """Отчеты ProgressReport с кэшем по пользователю.
+    
+    Отчет пересчитывается, если изменилась сводная статистика пользователя
+    (число медитаций, общее время, средняя оценка) - она меняется при любом
+    добавлении, удалении или оценке сессии.
+    """
+    
+    def __init__(self, db, cache_size: int = 10000, cache_ttl: float = 3600):
+        self.db = db
+        self._cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+    
+    async def get_report(self, user_id: int, stats: UserStats) -> ProgressReport:
+        fingerprint = tuple(stats)
+        cached = self._cache.get(user_id)
+        if cached and cached[0] == fingerprint:
+            return cached[1]
+        
+        history = await self.db.get_session_history(user_id)
+        started = time.perf_counter()
+        report = compute_report(history)
+        logger.debug(
+            "Progress analytics for user %s: %d rows in %.1f ms",
+            user_id, len(history.start_ts), (time.perf_counter() - started) * 1000
+        )
+        
+        self._cache.set(user_id, (fingerprint, report))
+        return report
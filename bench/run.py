@@ -0,0 +1,219 @@
+# bench/run.py
+"""Бенчмарк методов Database на данных из bench.seed.
+
+Каждый метод вызывается для случайной выборки синтетических пользователей,
+в отчет попадают p50/p95/среднее и EXPLAIN (ANALYZE, BUFFERS) выполненных
+запросов. Отчеты двух коммитов можно сравнить:
+    
+    python -m bench.run --dsn postgresql://localhost/meditation_bench -o before.json
+    python -m bench.run --dsn postgresql://localhost/meditation_bench -o after.json --compare before.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import statistics
+import subprocess
+import time
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, List
+
+from bench.seed import FIRST_USER_ID
+from database import Database
+from utils import MarathonManager
+
+logger = logging.getLogger(__name__)
+
+# Замедление больше этой доли считается регрессией при сравнении
+REGRESSION_THRESHOLD = 0.2
+
+class RecordingConnection:
+    """Обертка соединения, запоминающая выполненные запросы с параметрами"""
+    
+    def __init__(self, conn, queries: List):
+        self._conn = conn
+        self._queries = queries
+    
+    def __getattr__(self, name):
+        attr = getattr(self._conn, name)
+        if name not in ('fetch', 'fetchrow', 'fetchval'):
+            return attr
+        
+        def recorded(query, *args, **kwargs):
+            self._queries.append((query, args))
+            return attr(query, *args, **kwargs)
+        return recorded
+
+def _percentile(samples: List[float], percent: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+class Benchmark:
+    def __init__(self, db: Database, iterations: int, users: int):
+        self.db = db
+        self.iterations = iterations
+        self.user_ids = list(range(FIRST_USER_ID, FIRST_USER_ID + users))
+        self.queries: List = []
+        self._recording = False
+        
+        # Перехватываем acquire, чтобы видеть SQL каждого метода
+        original_acquire = db.acquire
+        
+        @asynccontextmanager
+        async def acquire(*args, **kwargs):
+            async with original_acquire(*args, **kwargs) as conn:
+                yield RecordingConnection(conn, self.queries) if self._recording else conn
+        db.acquire = acquire
+    
+    async def measure(self, name: str, call: Callable[[int], Any]) -> Dict[str, Any]:
+        """Замер метода: call(user_id) вызывается для случайных пользователей"""
+        rng = random.Random(name)
+        
+        # Прогрев: подготовленные запросы и кэш страниц
+        for user_id in rng.sample(self.user_ids, min(3, len(self.user_ids))):
+            await call(user_id)
+        
+        timings = []
+        for _ in range(self.iterations):
+            user_id = rng.choice(self.user_ids)
+            started = time.perf_counter()
+            await call(user_id)
+            timings.append((time.perf_counter() - started) * 1000)
+        
+        # Отдельный вызов с записью SQL для планов
+        self.queries.clear()
+        self._recording = True
+        try:
+            await call(rng.choice(self.user_ids))
+        finally:
+            self._recording = False
+        
+        result = {
+            'iterations': len(timings),
+            'p50_ms': round(_percentile(timings, 50), 3),
+            'p95_ms': round(_percentile(timings, 95), 3),
+            'mean_ms': round(statistics.fmean(timings), 3),
+            'min_ms': round(min(timings), 3),
+            'max_ms': round(max(timings), 3),
+            'plans': await self.explain(self.queries),
+        }
+        logger.info("%s: p50=%sms p95=%sms", name, result['p50_ms'], result['p95_ms'])
+        return result
+    
+    async def explain(self, queries: List) -> List[Dict[str, Any]]:
+        """EXPLAIN ANALYZE для читающих запросов"""
+        plans = []
+        async with self.db.pool.acquire() as conn:
+            for query, args in queries:
+                if not query.lstrip().upper().startswith(('SELECT', 'WITH')):
+                    continue
+                raw = await conn.fetchval(f'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {query}', *args)
+                plan = json.loads(raw)[0]
+                plans.append({
+                    'query': ' '.join(query.split()),
+                    'execution_ms': plan.get('Execution Time'),
+                    'planning_ms': plan.get('Planning Time'),
+                    'plan': plan['Plan'],
+                })
+        return plans
+    
+    async def run(self) -> Dict[str, Dict[str, Any]]:
+        db = self.db
+        today = date.today()
+        month_ago = today - timedelta(days=30)
+        
+        async with db.pool.acquire() as conn:
+            marathon_ids = [row['marathon_id'] for row in await conn.fetch('SELECT marathon_id FROM marathons')]
+        
+        async def streaks(user_id):
+            # Без кэша: замеряем сам запрос серий
+            db._streaks_cache.clear()
+            await db.get_streaks(user_id)
+        
+        async def marathon_progress(user_id):
+            await db.get_marathon_progress(user_id, random.choice(marathon_ids))
+        
+        manager = MarathonManager(db, None, None)
+        
+        cases = {
+            'get_user_stats': db.get_user_stats,
+            'get_streaks': streaks,
+            'get_monthly_stats': db.get_monthly_stats,
+            'get_user_sessions': db.get_user_sessions,
+            'get_sessions_by_month': lambda uid: db.get_sessions_by_month(uid, month_ago.year, month_ago.month),
+            'get_daily_stats': lambda uid: db.get_daily_stats(uid, today - timedelta(days=1)),
+            'get_user_marathons': db.get_user_marathons,
+            'get_active_marathons': lambda uid: db.get_active_marathons(),
+            'get_dialogue_history': db.get_dialogue_history,
+        }
+        if marathon_ids:
+            cases['get_marathon_progress'] = marathon_progress
+            cases['marathon_group_stats'] = lambda uid: manager._get_marathon_group_stats(random.choice(marathon_ids))
+        
+        return {name: await self.measure(name, call) for name, call in cases.items()}
+
+def compare(current: Dict[str, Any], previous: Dict[str, Any]) -> bool:
+    """Печать разницы с предыдущим отчетом. True, если есть регрессии"""
+    print(f"Сравнение с {previous.get('commit')} ({previous.get('timestamp')})")
+    print(f"{'метод':<28}{'p50 было':>10}{'p50 стало':>11}{'p95 было':>10}{'p95 стало':>11}")
+    
+    regressions = False
+    for name, result in current['results'].items():
+        old = previous['results'].get(name)
+        if not old:
+            print(f"{name:<28}{'-':>10}{result['p50_ms']:>11}{'-':>10}{result['p95_ms']:>11}")
+            continue
+        
+        slower = old['p95_ms'] > 0 and (result['p95_ms'] - old['p95_ms']) / old['p95_ms'] > REGRESSION_THRESHOLD
+        regressions = regressions or slower
+        print(
+            f"{name:<28}{old['p50_ms']:>10}{result['p50_ms']:>11}{old['p95_ms']:>10}{result['p95_ms']:>11}"
+            f"{'  <- регрессия' if slower else ''}"
+        )
+    return regressions
+
+async def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк методов Database")
+    parser.add_argument("--dsn", required=True, help="DSN базы, заполненной bench.seed")
+    parser.add_argument("--users", type=int, default=5000, help="Столько же, сколько при заполнении")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("-o", "--output", default="bench_report.json")
+    parser.add_argument("--compare", help="Предыдущий отчет для сравнения")
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO)
+    db = Database(args.dsn)
+    await db.init()
+    try:
+        results = await Benchmark(db, args.iterations, args.users).run()
+    finally:
+        await db.close()
+    
+    report = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'commit': _git_commit(),
+        'params': {'users': args.users, 'iterations': args.iterations},
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2, default=str)
+    logger.info("Report saved to %s", args.output)
+    
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            if compare(report, json.load(f)):
+                raise SystemExit(1)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,184 @@
+# bench/seed.py
+"""Генерация синтетических данных для бенчмарков в локальной PostgreSQL.
+
+Создает пользователей с разной регулярностью практики, сессии за несколько
+лет, марафоны с тысячами участников и историю диалогов. Схема создается
+миграциями бота. Запускать только на тестовой базе:
+    
+    python -m bench.seed --dsn postgresql://localhost/meditation_bench --users 5000 --years 3
+"""
+import argparse
+import asyncio
+import logging
+import random
+from datetime import date, datetime, time, timedelta
+from typing import Iterator, List, Tuple
+
+import asyncpg
+
+from database import (Database, SESSIONS_PARTITION_PREFIX, create_active_session_index,
+                      create_dialogue_partitions, create_sessions_partitions)
+
+logger = logging.getLogger(__name__)
+
+# Первый пользователь синтетических данных; реальные Telegram ID не пересекаются
+FIRST_USER_ID = 9_000_000_000
+
+COMMENTS = [
+    "Спокойно и ровно", "Много мыслей, сложно сосредоточиться", "Отличная практика",
+    "Сонливость в середине", "Хорошо получилось дыхание", "Тревожно, но стало легче",
+    "Короткая практика перед работой", "Глубокое расслабление",
+]
+
+DIALOGUE_PHRASES = [
+    "Как справляться с отвлекающими мыслями?", "Сколько минут лучше медитировать?",
+    "Попробуйте сосредоточиться на дыхании и мягко возвращать внимание.",
+    "Регулярность важнее длительности: начните с 10 минут в день.",
+    "Сегодня было трудно усидеть на месте", "Какую технику посоветуете на вечер?",
+]
+
+SESSION_COLUMNS = ('user_id', 'start_time', 'end_time', 'duration', 'comment', 'rating', 'marathon_id')
+
+class MarathonPlan:
+    __slots__ = ('marathon_id', 'start_date', 'end_date', 'participants')
+    
+    def __init__(self, marathon_id: int, start_date: date, end_date: date):
+        self.marathon_id = marathon_id
+        self.start_date = start_date
+        self.end_date = end_date
+        self.participants = set()
+
+def _user_rows(rng: random.Random, count: int) -> List[Tuple]:
+    rows = []
+    for i in range(count):
+        user_id = FIRST_USER_ID + i
+        joined = datetime.now() - timedelta(days=rng.randint(0, 365 * 3))
+        rows.append((user_id, f"bench_user_{i}", f"User{i}", None, joined))
+    return rows
+
+def _user_sessions(rng: random.Random, user_id: int, first_day: date, last_day: date,
+                   marathons: List[MarathonPlan]) -> Iterator[Tuple]:
+    """Сессии одного пользователя: регулярность и привычное время у каждого свои"""
+    activity = rng.choice((0.05, 0.2, 0.5, 0.8, 0.95))
+    start_day = first_day + timedelta(days=rng.randint(0, max(0, (last_day - first_day).days // 2)))
+    habit_hour = rng.choice((6, 7, 8, 12, 19, 21, 22))
+    typical_duration = rng.choice((5, 10, 15, 20, 30, 45))
+    user_marathons = [m for m in marathons if user_id in m.participants]
+    
+    day = start_day
+    while day <= last_day:
+        # Внутри марафона пользователь старается не пропускать дни
+        marathon = next((m for m in user_marathons if m.start_date <= day <= m.end_date), None)
+        chance = max(activity, 0.85) if marathon else activity
+        
+        if rng.random() < chance:
+            for _ in range(2 if rng.random() < 0.15 else 1):
+                start = datetime.combine(day, time(habit_hour)) + timedelta(minutes=rng.randint(-60, 90))
+                duration = max(1, min(120, int(rng.lognormvariate(0, 0.4) * typical_duration)))
+                rating = max(1, min(10, round(rng.gauss(7.2, 1.6))))
+                comment = rng.choice(COMMENTS) if rng.random() < 0.4 else None
+                yield (user_id, start, start + timedelta(minutes=duration), duration,
+                       comment, rating, marathon.marathon_id if marathon else None)
+        day += timedelta(days=1)
+
+async def seed(db: Database, *, users: int, years: int, marathons: int, participants: int,
+               dialogue_messages: int, random_seed: int = 42, batch_size: int = 50_000):
+    rng = random.Random(random_seed)
+    today = date.today()
+    first_day = today - timedelta(days=365 * years)
+    
+    async with db.acquire('seed') as conn:
+        years_created = await create_sessions_partitions(conn, first_day)
+        for year in years_created:
+            await create_active_session_index(conn, f"{SESSIONS_PARTITION_PREFIX}{year}")
+        await create_dialogue_partitions(conn, today - timedelta(days=30))
+        
+        logger.info("Inserting %d users", users)
+        await conn.copy_records_to_table(
+            'users', records=_user_rows(rng, users),
+            columns=('user_id', 'username', 'first_name', 'last_name', 'joined_at')
+        )
+        
+        # Марафоны по 21-30 дней, равномерно за весь период
+        marathon_list = []
+        for i in range(marathons):
+            start = first_day + timedelta(days=rng.randint(0, (today - first_day).days - 30))
+            end = start + timedelta(days=rng.randint(20, 29))
+            marathon_id = await conn.fetchval('''
+                INSERT INTO marathons (title, description, start_date, end_date, daily_goal)
+                VALUES ($1, $2, $3, $4, $5)
+                RETURNING marathon_id
+            ''', f"Бенчмарк-марафон {i + 1}", "Синтетический марафон", start, end, rng.choice((1, 1, 2)))
+            marathon = MarathonPlan(marathon_id, start, end)
+            marathon.participants = set(rng.sample(
+                range(FIRST_USER_ID, FIRST_USER_ID + users), min(participants, users)
+            ))
+            marathon_list.append(marathon)
+        
+        logger.info("Inserting participants of %d marathons", marathons)
+        await conn.copy_records_to_table(
+            'marathon_participants',
+            records=[(uid, m.marathon_id) for m in marathon_list for uid in m.participants],
+            columns=('user_id', 'marathon_id')
+        )
+        
+        logger.info("Inserting sessions for %d years", years)
+        batch = []
+        total = 0
+        for user_id in range(FIRST_USER_ID, FIRST_USER_ID + users):
+            batch.extend(_user_sessions(rng, user_id, first_day, today - timedelta(days=1), marathon_list))
+            if len(batch) >= batch_size:
+                await conn.copy_records_to_table('sessions', records=batch, columns=SESSION_COLUMNS)
+                total += len(batch)
+                batch = []
+        if batch:
+            await conn.copy_records_to_table('sessions', records=batch, columns=SESSION_COLUMNS)
+            total += len(batch)
+        logger.info("Inserted %d sessions", total)
+        
+        # Диалоги у части пользователей за последние 30 дней
+        logger.info("Inserting dialogue history")
+        dialogue = []
+        now = datetime.now()
+        for user_id in rng.sample(range(FIRST_USER_ID, FIRST_USER_ID + users), max(1, users // 5)):
+            for i in range(dialogue_messages):
+                created_at = now - timedelta(days=rng.randint(0, 29), minutes=rng.randint(0, 1440))
+                dialogue.append((user_id, rng.choice(DIALOGUE_PHRASES), i % 2 == 0, created_at))
+        await conn.copy_records_to_table(
+            'dialogue_history', records=dialogue,
+            columns=('user_id', 'content', 'is_user', 'created_at')
+        )
+        
+        await conn.execute('ANALYZE')
+
+async def main():
+    parser = argparse.ArgumentParser(description="Заполнение тестовой БД синтетическими данными")
+    parser.add_argument("--dsn", required=True, help="DSN тестовой базы (данные добавляются к существующим)")
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--years", type=int, default=3, help="Глубина истории сессий в годах")
+    parser.add_argument("--marathons", type=int, default=10)
+    parser.add_argument("--participants", type=int, default=2000, help="Участников в каждом марафоне")
+    parser.add_argument("--dialogue-messages", type=int, default=40, help="Сообщений на пользователя с диалогом")
+    parser.add_argument("--seed", type=int, default=42, help="Зерно генератора для воспроизводимости")
+    parser.add_argument("--archive", action="store_true", help="Свернуть старые годы в архив после заполнения")
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO)
+    db = Database(args.dsn)
+    await db.init()
+    try:
+        await seed(
+            db, users=args.users, years=args.years, marathons=args.marathons,
+            participants=args.participants, dialogue_messages=args.dialogue_messages, random_seed=args.seed
+        )
+        if args.archive:
+            archived = await db.archive_old_sessions()
+            logger.info("Archived %d yearly partitions", archived)
+    except asyncpg.UniqueViolationError:
+        logger.error("Synthetic users already exist - use a clean database")
+        raise
+    finally:
+        await db.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
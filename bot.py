@@ -3,30 +3,126 @@ import asyncio
 import logging
 from datetime import datetime
 from aiogram import Bot, Dispatcher, types, F
-from aiogram.filters import Command
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.filters import Command, ExceptionTypeFilter
+from aiogram.types import BufferedInputFile
 from aiogram.fsm.context import FSMContext
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 from config import Config
 from database import Database
+from fsm_storage import PostgresStorage
+from logging_setup import parse_sampling, setup_logging
+from metrics import AI_SECONDS, DB_SECONDS, REGISTRY, instrument, pool_collector, start_metrics_server
+from middlewares.fsm_flush import FSMFlushMiddleware
+from middlewares.logging_context import LogContextMiddleware
+from middlewares.metrics import BotAPIMetricsMiddleware, HandlerMetricsMiddleware
+from middlewares.ordering import UpdateDropped, UserEventIsolation, drop_update
+from middlewares.profiling import UpdateProfilingMiddleware
+from middlewares.throttling import BucketLimit, ThrottlingMiddleware
+from middlewares.users import UserRegistrationMiddleware
 from keyboards import get_main_keyboard, get_rating_keyboard, get_history_keyboard, get_calendar_keyboard
+from ai_ledger import AICallLedger
+from analytics import ProgressAnalyzer
+from charts import ChartService, create_render_pool
+from profiling import LoopLagMonitor, SamplingProfiler
 from ai_service import AIService
 from states import MeditationStates, DialogueStates
+from utils import average_rating, format_rating
 
 # Импорт обработчиков
-from handlers import meditation, history, marathon, dialogue
-
-# Настройка логирования
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+from handlers import meditation, history, marathon, dialogue, export
 
 # Инициализация
 config = Config()
-bot = Bot(token=config.BOT_TOKEN)
-dp = Dispatcher(storage=MemoryStorage())
-db = Database(config.DATABASE_URL)
-ai = AIService(config.AI_API_KEY, config.AI_SERVICE, config.AI_MODEL)
+
+# Процессы отрисовки графиков создаются форком до запуска любых потоков
+chart_pool = create_render_pool(config.CHART_WORKERS)
+
+# Настройка логирования: запись через очередь в фоновом потоке
+log_listener = setup_logging(config.LOG_LEVEL, config.LOG_FORMAT, parse_sampling(config.LOG_SAMPLING))
+logger = logging.getLogger(__name__)
+
+bot = Bot(
+    token=config.BOT_TOKEN,
+    session=AiohttpSession(api=TelegramAPIServer.from_base(config.TELEGRAM_API_URL))
+    if config.TELEGRAM_API_URL else None
+)
+db = Database(
+    config.DATABASE_URL,
+    min_size=config.DB_POOL_MIN_SIZE,
+    max_size=config.DB_POOL_MAX_SIZE,
+    statement_cache_size=config.DB_STATEMENT_CACHE_SIZE,
+    command_timeout=config.DB_COMMAND_TIMEOUT,
+    statement_timeout_ms=config.DB_STATEMENT_TIMEOUT_MS,
+    acquire_timeout=config.DB_ACQUIRE_TIMEOUT,
+    application_name=config.DB_APPLICATION_NAME,
+    replica_url=config.DATABASE_REPLICA_URL,
+    read_your_writes_seconds=config.DB_READ_YOUR_WRITES_SECONDS,
+    slow_query_ms=config.DB_SLOW_QUERY_MS,
+    slow_query_explain_rate=config.DB_SLOW_QUERY_EXPLAIN_RATE
+)
+storage = PostgresStorage(
+    db,
+    state_ttl=config.FSM_STATE_TTL_HOURS * 3600,
+    cache_size=config.FSM_CACHE_SIZE,
+    cache_ttl=config.FSM_CACHE_TTL
+)
+# Очередь пользователя берется до чтения состояния FSM: следующее обновление
+# не обгонит предыдущее и не прочитает устаревшее состояние
+update_isolation = UserEventIsolation(
+    max_concurrent=config.UPDATES_MAX_CONCURRENT,
+    max_pending=config.UPDATES_MAX_PENDING_PER_USER,
+    max_total=config.UPDATES_MAX_PENDING_TOTAL
+)
+dp = Dispatcher(storage=storage, events_isolation=update_isolation)
+dp.errors.register(drop_update, ExceptionTypeFilter(UpdateDropped))
+log_context_middleware = LogContextMiddleware()
+dp.update.outer_middleware(log_context_middleware)
+# Состояние FSM записывается до того, как очередь пользователя перейдет к
+# следующему обновлению
+dp.update.outer_middleware(FSMFlushMiddleware(storage))
+dp.update.outer_middleware(UserRegistrationMiddleware(db))
+update_profiling = UpdateProfilingMiddleware()
+dp.update.outer_middleware(update_profiling)
+throttling = ThrottlingMiddleware(
+    {
+        "navigation": BucketLimit.per_minute(config.THROTTLE_NAVIGATION_PER_MINUTE, config.THROTTLE_NAVIGATION_BURST),
+        "stats": BucketLimit.per_minute(config.THROTTLE_STATS_PER_MINUTE, config.THROTTLE_STATS_BURST),
+        "llm": BucketLimit.per_minute(config.THROTTLE_LLM_PER_MINUTE, config.THROTTLE_LLM_BURST),
+    },
+    db=db,
+    shared=config.THROTTLE_SHARED,
+    exempt_ids=config.ADMIN_IDS
+)
+dp.message.middleware(throttling)
+dp.callback_query.middleware(throttling)
+dp.message.middleware(log_context_middleware)
+dp.callback_query.middleware(log_context_middleware)
+ai_ledger = AICallLedger(db, flush_interval=config.AI_LEDGER_FLUSH_INTERVAL)
+ai = AIService(
+    config.AI_API_KEY, config.AI_SERVICE, config.AI_MODEL,
+    base_url=config.AI_BASE_URL, ledger=ai_ledger
+)
+analytics = ProgressAnalyzer(db)
+charts = ChartService(db, workers=config.CHART_WORKERS, pool=chart_pool)
+
+# Метрики: время обработчиков, запросов Bot API, вызовов БД и ИИ
+if config.METRICS_PORT:
+    handler_metrics = HandlerMetricsMiddleware()
+    dp.message.middleware(handler_metrics)
+    dp.callback_query.middleware(handler_metrics)
+    bot.session.middleware(BotAPIMetricsMiddleware())
+    instrument(db, DB_SECONDS, exclude=("init", "close"))
+    instrument(ai, AI_SECONDS)
+    REGISTRY.add_collector(pool_collector(db))
+
+# Профилирование по команде /profile и мониторинг зависаний цикла событий
+profiler = SamplingProfiler(interval=config.PROFILE_SAMPLE_INTERVAL_MS / 1000)
+loop_monitor = LoopLagMonitor(threshold=config.LOOP_LAG_THRESHOLD_MS / 1000) if config.LOOP_LAG_THRESHOLD_MS else None
+if loop_monitor and config.METRICS_PORT:
+    REGISTRY.add_collector(loop_monitor.metrics_collector())
 
 @dp.message(Command("start"))
 async def cmd_start(message: types.Message):
@@ -48,12 +144,18 @@ async def cmd_start(message: types.Message):
         "• AI-ассистент для диалогов о медитации\n"
         "• Ручная запись медитаций\n"
         "• Удаление ошибочных записей\n"
-        "• Улучшенный календарь и статистика\n\n"
+        "• Улучшенный календарь и статистика\n"
+        "• Выгрузка истории: /export csv, jsonl или ics\n\n"
         "Выберите действие:",
         reply_markup=get_main_keyboard(is_admin=is_admin),
         parse_mode="Markdown"
     )
 
+@dp.message(Command("export"), flags={"throttling": "stats"})
+async def cmd_export(message: types.Message):
+    """Выгрузка личных данных: /export [csv|jsonl|ics]"""
+    await export.export_data(message, db)
+
 # Обработчики медитаций
 @dp.message(F.text == "🧘 Начать медитацию")
 async def handle_start_meditation(message: types.Message):
@@ -65,9 +167,9 @@ async def handle_end_meditation(message: types.Message, state: FSMContext):
 
 @dp.message(MeditationStates.waiting_for_comment)
 async def handle_process_comment(message: types.Message, state: FSMContext):
-    await meditation.process_comment(message, state, db)
+    await meditation.process_comment(message, state)
 
-@dp.callback_query(MeditationStates.waiting_for_rating, F.data.startswith("rating_"))
+@dp.callback_query(MeditationStates.waiting_for_rating, F.data.startswith("rating_"), flags={"throttling": "llm"})
 async def handle_process_rating(callback: types.CallbackQuery, state: FSMContext):
     await meditation.process_rating(callback, state, db, ai, config)
 
@@ -76,7 +178,7 @@ async def handle_process_rating(callback: types.CallbackQuery, state: FSMContext
 async def handle_start_dialogue(message: types.Message, state: FSMContext):
     await dialogue.start_dialogue(message, state, db, ai)
 
-@dp.message(DialogueStates.in_dialogue)
+@dp.message(DialogueStates.in_dialogue, flags={"throttling": "llm"})
 async def handle_dialogue_message(message: types.Message, state: FSMContext):
     await dialogue.process_dialogue(message, state, db, ai)
 
@@ -85,7 +187,7 @@ async def handle_dialogue_message(message: types.Message, state: FSMContext):
 async def handle_manual_record(message: types.Message, state: FSMContext):
     await dialogue.manual_meditation_entry(message, state)
 
-@dp.message(DialogueStates.waiting_for_manual_entry)
+@dp.message(DialogueStates.waiting_for_manual_entry, flags={"throttling": "llm"})
 async def handle_meditation_text(message: types.Message, state: FSMContext):
     await dialogue.process_manual_entry(message, state, db, ai, config)
 
@@ -141,7 +243,7 @@ async def handle_marathon_goal(message: types.Message, state: FSMContext):
     await marathon.process_marathon_goal(message, state, db)
 
 # Обработчики истории и прогресса
-@dp.message(F.text == "📊 Мой прогресс")
+@dp.message(F.text == "📊 Мой прогресс", flags={"throttling": "stats"})
 async def my_progress(message: types.Message):
     """Показ прогресса пользователя"""
     user_id = message.from_user.id
@@ -150,44 +252,50 @@ async def my_progress(message: types.Message):
     stats = await db.get_user_stats(user_id)
     
     text = "📊 *Ваш прогресс*\n\n"
-    text += f"🧘 Всего медитаций: {stats['total_sessions']}\n"
-    text += f"⏱️ Общее время: {stats['total_duration']} минут\n"
-    text += f"⭐ Средняя оценка: {stats['avg_rating']:.1f}/10\n\n"
+    text += f"🧘 Всего медитаций: {stats.total_sessions}\n"
+    text += f"⏱️ Общее время: {stats.total_duration} минут\n"
+    text += f"⭐ Средняя оценка: {stats.avg_rating:.1f}/10\n\n"
+    
+    # Серии дней подряд
+    streaks = await db.get_streaks(user_id)
+    text += f"🔥 Текущая серия: {streaks.current_streak} дн.\n"
+    text += f"🏆 Лучшая серия: {streaks.longest_streak} дн.\n"
+    text += f"📅 Регулярность: {streaks.consistency:.0f}% дней\n\n"
     
     # Прогресс по марафонам
     marathons = await db.get_user_marathons(user_id)
     if marathons:
         text += "*Марафоны:*\n"
         for marathon in marathons:
-            progress = await db.get_marathon_progress(user_id, marathon['marathon_id'])
-            text += f"\n📌 {marathon['title']}\n"
-            text += f"   Выполнено: {progress['completed_days']}/{progress['total_days']} дней\n"
-            text += f"   Медитаций: {progress['sessions_count']}\n"
+            progress = await db.get_marathon_progress(user_id, marathon.marathon_id)
+            text += f"\n📌 {marathon.title}\n"
+            text += f"   Выполнено: {progress.completed_days}/{progress.total_days} дней\n"
+            text += f"   Медитаций: {progress.sessions_count}\n"
     
     await message.answer(text, parse_mode="Markdown")
 
-@dp.message(F.text == "📖 История медитаций")
+@dp.message(F.text == "📖 История медитаций", flags={"throttling": "stats"})
 async def handle_meditation_history(message: types.Message):
     await history.meditation_history(message, db)
 
 # Обработчики календаря
-@dp.callback_query(F.data == "show_calendar")
+@dp.callback_query(F.data == "show_calendar", flags={"throttling": "stats"})
 async def handle_show_calendar(callback: types.CallbackQuery):
     await history.show_calendar(callback, db)
 
-@dp.callback_query(F.data.startswith("cal_day_"))
+@dp.callback_query(F.data.startswith("cal_day_"), flags={"throttling": "stats"})
 async def handle_show_day_details(callback: types.CallbackQuery):
     await history.show_day_details(callback, db)
 
-@dp.callback_query(F.data.startswith("cal_prev_") | F.data.startswith("cal_next_"))
+@dp.callback_query(F.data.startswith("cal_prev_") | F.data.startswith("cal_next_"), flags={"throttling": "stats"})
 async def handle_navigate_calendar(callback: types.CallbackQuery):
     await history.navigate_calendar(callback, db)
 
-@dp.callback_query(F.data == "history_week")
+@dp.callback_query(F.data == "history_week", flags={"throttling": "stats"})
 async def handle_show_week_history(callback: types.CallbackQuery):
     await history.show_week_history(callback, db)
 
-@dp.callback_query(F.data == "history_month")
+@dp.callback_query(F.data == "history_month", flags={"throttling": "stats"})
 async def handle_show_month_history(callback: types.CallbackQuery):
     await history.show_month_history(callback, db)
 
@@ -195,11 +303,15 @@ async def handle_show_month_history(callback: types.CallbackQuery):
 async def handle_ignore_callback(callback: types.CallbackQuery):
     await history.ignore_callback(callback)
 
-@dp.callback_query(F.data == "back_to_history")
+@dp.callback_query(F.data == "history_charts", flags={"throttling": "stats"})
+async def handle_show_charts(callback: types.CallbackQuery):
+    await history.show_charts(callback, charts)
+
+@dp.callback_query(F.data == "back_to_history", flags={"throttling": "stats"})
 async def handle_back_to_history(callback: types.CallbackQuery):
     await history.back_to_history(callback, db)
 
-@dp.callback_query(F.data.startswith("cal_month_stats_"))
+@dp.callback_query(F.data.startswith("cal_month_stats_"), flags={"throttling": "stats"})
 async def handle_month_stats(callback: types.CallbackQuery):
     """Показать статистику за конкретный месяц"""
     parts = callback.data.split("_")
@@ -213,17 +325,22 @@ async def handle_month_stats(callback: types.CallbackQuery):
         return
     
     # Считаем детальную статистику
-    total_duration = sum(s['duration'] for s in sessions)
-    avg_rating = sum(s['rating'] for s in sessions) / len(sessions)
-    days_with_practice = len(set(s['start_time'].date() for s in sessions))
+    total_sessions = sum(s.sessions_count for s in sessions)
+    total_duration = sum(s.duration for s in sessions)
+    avg_rating = average_rating(sessions)
+    days_with_practice = len(set(s.start_time.date() for s in sessions))
+    
+    # Рекорды - только по отдельным сессиям: архивная строка - сводка за день
+    single = [s for s in sessions if s.session_id is not None]
     
     # Самая длинная и короткая медитация
-    longest = max(sessions, key=lambda x: x['duration'])
-    shortest = min(sessions, key=lambda x: x['duration'])
+    longest = max(single, key=lambda x: x.duration, default=None)
+    shortest = min(single, key=lambda x: x.duration, default=None)
     
     # Лучшая и худшая оценка
-    best = max(sessions, key=lambda x: x['rating'])
-    worst = min(sessions, key=lambda x: x['rating'])
+    rated = [s for s in single if s.rating is not None]
+    best = max(rated, key=lambda x: x.rating, default=None)
+    worst = min(rated, key=lambda x: x.rating, default=None)
     
     month_names = {
         1: "Январь", 2: "Февраль", 3: "Март", 4: "Апрель",
@@ -233,17 +350,21 @@ async def handle_month_stats(callback: types.CallbackQuery):
     
     text = f"📊 *Детальная статистика за {month_names[month]} {year}*\n\n"
     text += f"🧘 *Основные показатели:*\n"
-    text += f"• Всего медитаций: {len(sessions)}\n"
+    text += f"• Всего медитаций: {total_sessions}\n"
     text += f"• Дней с практикой: {days_with_practice}\n"
     text += f"• Общее время: {total_duration} минут\n"
-    text += f"• Среднее время сессии: {total_duration // len(sessions)} минут\n"
-    text += f"• Средняя оценка: {avg_rating:.1f}/10\n\n"
+    text += f"• Среднее время сессии: {total_duration // total_sessions} минут\n"
+    text += f"• Средняя оценка: {format_rating(avg_rating)}\n\n"
     
     text += f"📈 *Рекорды месяца:*\n"
-    text += f"• Самая длинная: {longest['duration']} мин ({longest['start_time'].strftime('%d.%m')})\n"
-    text += f"• Самая короткая: {shortest['duration']} мин ({shortest['start_time'].strftime('%d.%m')})\n"
-    text += f"• Лучшая оценка: {best['rating']}/10 ({best['start_time'].strftime('%d.%m')})\n"
-    text += f"• Худшая оценка: {worst['rating']}/10 ({worst['start_time'].strftime('%d.%m')})\n"
+    if not single:
+        text += "• Месяц в архиве: хранятся только итоги по дням\n"
+    else:
+        text += f"• Самая длинная: {longest.duration} мин ({longest.start_time.strftime('%d.%m')})\n"
+        text += f"• Самая короткая: {shortest.duration} мин ({shortest.start_time.strftime('%d.%m')})\n"
+    if rated:
+        text += f"• Лучшая оценка: {best.rating}/10 ({best.start_time.strftime('%d.%m')})\n"
+        text += f"• Худшая оценка: {worst.rating}/10 ({worst.start_time.strftime('%d.%m')})\n"
     
     # Кнопка возврата
     builder = InlineKeyboardBuilder()
@@ -252,21 +373,177 @@ async def handle_month_stats(callback: types.CallbackQuery):
     await callback.message.edit_text(text, parse_mode="Markdown", reply_markup=builder.as_markup())
     await callback.answer()
 
+# Административные команды
+@dp.message(Command("dbpool"))
+async def cmd_db_pool(message: types.Message):
+    """Метрики пула соединений с БД (только для админов)"""
+    if message.from_user.id not in config.ADMIN_IDS:
+        return
+    
+    stats = db.get_pool_stats()
+    
+    text = "🗄 *Пул соединений БД*\n\n"
+    text += f"• Соединений: {stats['size']}/{stats['max_size']} (свободно {stats['idle']})\n"
+    text += f"• Ожидают соединения: {stats['waiting']} (максимум {stats['max_waiting']})\n"
+    text += f"• Получений: {stats['acquires']}, таймаутов: {stats['timeouts']}\n"
+    text += f"• Время получения: среднее {stats['avg_acquire_ms']:.1f} мс, "
+    text += f"максимум {stats['max_acquire_ms']:.1f} мс\n"
+    
+    replica = stats.get('replica')
+    if replica:
+        text += "\n*Реплика:*\n"
+        text += f"• Соединений: {replica['size']}/{replica['max_size']} (свободно {replica['idle']})\n"
+        text += f"• Ожидают соединения: {replica['waiting']} (максимум {replica['max_waiting']})\n"
+        text += f"• Время получения: среднее {replica['avg_acquire_ms']:.1f} мс\n"
+    
+    await message.answer(text, parse_mode="Markdown")
+
+@dp.message(Command("dbstats"))
+async def cmd_db_stats(message: types.Message):
+    """Время запросов по методам БД (только для админов). /dbstats reset - сбросить"""
+    if message.from_user.id not in config.ADMIN_IDS:
+        return
+    
+    if message.text.split()[1:] == ["reset"]:
+        db.query_stats.reset()
+        await message.answer("Статистика запросов сброшена.")
+        return
+    
+    stats = db.get_query_stats()
+    if not stats:
+        await message.answer("Запросов к БД пока не было.")
+        return
+    
+    text = f"🐢 Запросы БД (медленные - дольше {config.DB_SLOW_QUERY_MS:.0f} мс)\n\n"
+    for item in stats[:15]:
+        text += f"{item['method']}\n"
+        text += f"  запросов {item['queries']}, всего {item['total_ms']:.0f} мс, медленных {item['slow']}\n"
+        text += f"  среднее {item['avg_ms']:.1f} / p95 {item['p95_ms']:.1f} / макс {item['max_ms']:.1f} мс\n"
+        text += f"  ожидание соединения: среднее {item['avg_acquire_ms']:.1f}, макс {item['max_acquire_ms']:.1f} мс\n"
+    
+    await message.answer(text)
+
+@dp.message(Command("profile"))
+async def cmd_profile(message: types.Message):
+    """Профилирование (только для админов).
+    
+    /profile [секунд] - семплирующий профиль всего бота файлом,
+    /profile next - cProfile следующего своего обновления,
+    /profile loop - задержка цикла событий и последние зависания
+    """
+    if message.from_user.id not in config.ADMIN_IDS:
+        return
+    
+    args = message.text.split()[1:]
+    mode = args[0] if args else "10"
+    
+    if mode == "next":
+        update_profiling.arm(message.from_user.id)
+        await message.answer(
+            "🔬 Следующее ваше действие будет профилировано, отчет придет файлом.\n"
+            "В профиль попадут и другие обновления, обработанные в это время."
+        )
+        return
+    
+    if mode == "loop":
+        if not loop_monitor:
+            await message.answer("Мониторинг цикла событий отключен (LOOP_LAG_THRESHOLD_MS=0).")
+            return
+        stats = loop_monitor.get_stats()
+        text = "⏱ Цикл событий\n\n"
+        text += f"• Задержка: средняя {stats['avg_lag_ms']:.1f} мс, максимум {stats['max_lag_ms']:.1f} мс\n"
+        text += f"• Зависаний дольше {config.LOOP_LAG_THRESHOLD_MS:.0f} мс: {stats['stalls']}\n"
+        for stall in stats['recent_stalls'][-3:]:
+            text += f"\n{stall['at']}, {stall['blocked_ms']:.0f} мс:\n{stall['stack'][-800:]}\n"
+        await message.answer(text[:4000])
+        return
+    
+    if not mode.isdigit():
+        await message.answer("Использование: /profile [секунд] | next | loop")
+        return
+    if profiler.running:
+        await message.answer("Профиль уже снимается, дождитесь результата.")
+        return
+    
+    seconds = max(1, min(int(mode), 120))
+    await message.answer(f"🔬 Снимаю профиль {seconds} с...")
+    report = await profiler.capture(seconds)
+    await message.answer_document(
+        BufferedInputFile(report.encode(), filename=f"profile_{datetime.now():%Y%m%d_%H%M%S}.txt"),
+        caption=f"Семплирующий профиль за {seconds} с"
+    )
+
+@dp.message(Command("aiusage"))
+async def cmd_ai_usage(message: types.Message):
+    """Отчет по вызовам ИИ по дням (только для админов). /aiusage [дней]"""
+    if message.from_user.id not in config.ADMIN_IDS:
+        return
+    
+    args = message.text.split()[1:]
+    days = int(args[0]) if args and args[0].isdigit() else 7
+    rows = await ai_ledger.get_daily_report(max(1, min(days, 31)))
+    if not rows:
+        await message.answer("Вызовов ИИ за период не было.")
+        return
+    
+    def cost(prompt_tokens: int, completion_tokens: int) -> str:
+        if not (config.AI_PROMPT_PRICE_PER_1M or config.AI_COMPLETION_PRICE_PER_1M):
+            return ""
+        value = (prompt_tokens * config.AI_PROMPT_PRICE_PER_1M
+                 + completion_tokens * config.AI_COMPLETION_PRICE_PER_1M) / 1_000_000
+        return f", ${value:.2f}"
+    
+    def summarize(key) -> dict:
+        groups = {}
+        for row in rows:
+            group = groups.setdefault(key(row), {
+                'calls': 0, 'errors': 0, 'cache_hits': 0, 'prompt': 0,
+                'completion': 0, 'latency': 0.0, 'p95': 0.0
+            })
+            group['calls'] += row['calls']
+            group['errors'] += row['errors']
+            group['cache_hits'] += row['cache_hits']
+            group['prompt'] += row['prompt_tokens']
+            group['completion'] += row['completion_tokens']
+            group['latency'] += float(row['avg_latency_ms']) * row['calls']
+            group['p95'] = max(group['p95'], row['p95_latency_ms'])
+        return groups
+    
+    text = f"🤖 Вызовы ИИ за {days} дн.\n\nПо дням:\n"
+    for day, g in summarize(lambda row: row['day']).items():
+        text += (f"{day.strftime('%d.%m')}: {g['calls']} (ошибок {g['errors']}), "
+                 f"токены {g['prompt']}/{g['completion']}{cost(g['prompt'], g['completion'])}\n")
+    
+    text += "\nПо функциям:\n"
+    for feature, g in summarize(lambda row: row['feature']).items():
+        text += (f"{feature}: {g['calls']}, среднее {g['latency'] / g['calls']:.0f} мс, "
+                 f"p95 до {g['p95']:.0f} мс, кэш {g['cache_hits']}{cost(g['prompt'], g['completion'])}\n")
+    
+    text += "\nПо моделям:\n"
+    for (provider, model), g in summarize(lambda row: (row['provider'], row['model'])).items():
+        text += (f"{provider}/{model}: {g['calls']}, ошибок {g['errors']}, "
+                 f"среднее {g['latency'] / g['calls']:.0f} мс\n")
+    
+    await message.answer(text)
+
 # Обработчики для диалога с AI
 @dp.callback_query(F.data == "back_to_main")
 async def handle_back_to_main(callback: types.CallbackQuery, state: FSMContext):
     await dialogue.back_to_main_menu(callback, state, config)
 
-@dp.callback_query(F.data == "show_progress_analysis")
+@dp.callback_query(F.data == "show_progress_analysis", flags={"throttling": "llm"})
 async def handle_progress_analysis(callback: types.CallbackQuery):
-    await dialogue.show_progress_analysis(callback, db, ai)
+    await dialogue.show_progress_analysis(callback, db, ai, analytics)
 
 async def main():
     """Основная функция запуска бота"""
     await db.init()
     
     # Импортируем утилиты для фоновых задач
-    from utils import MarathonManager, send_daily_reminder
+    from utils import (MarathonManager, send_daily_reminder,
+                       maintain_dialogue_history, maintain_sessions_archive,
+                       maintain_fsm_storage, maintain_throttle_buckets,
+                       sweep_stale_sessions)
     
     # Создаем менеджер марафонов
     marathon_manager = MarathonManager(db, ai, bot)
@@ -274,10 +551,33 @@ async def main():
     # Запускаем фоновые задачи
     asyncio.create_task(marathon_manager.check_marathon_completions())
     asyncio.create_task(send_daily_reminder(bot, db))
+    asyncio.create_task(maintain_dialogue_history(db, config))
+    asyncio.create_task(maintain_sessions_archive(db, config))
+    asyncio.create_task(maintain_fsm_storage(storage))
+    asyncio.create_task(sweep_stale_sessions(bot, db, config))
+    if config.THROTTLE_SHARED:
+        asyncio.create_task(maintain_throttle_buckets(throttling))
+    if config.METRICS_PORT:
+        await start_metrics_server(config.METRICS_HOST, config.METRICS_PORT)
+    if loop_monitor:
+        asyncio.create_task(loop_monitor.run())
     
     # Запускаем бота
-    logger.info("🧘 Meditation Bot запущен!")
-    await dp.start_polling(bot)
+    logger.info("🧘 Meditation Bot запущен! Режим: %s", config.BOT_MODE)
+    try:
+        if config.BOT_MODE == "webhook":
+            from webhook import run_webhook
+            await run_webhook(dp, bot, config)
+        else:
+            # Polling не работает, пока у бота установлен вебхук
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
+    finally:
+        # Записываем журнал ИИ, закрываем пулы
+        await ai_ledger.close()
+        await db.close()
+        charts.close()
+        log_listener.stop()
 
 if __name__ == "__main__":
     asyncio.run(main())
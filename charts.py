@@ -0,0 +1,295 @@
+# charts.py
+"""Графики прогресса в PNG.
+
+Данные для графиков собираются из истории сессий (Database.get_session_history)
+в основном процессе, а отрисовка matplotlib выполняется в пуле процессов,
+чтобы не блокировать цикл событий. Пул создается через create_render_pool
+до запуска потоков (см. ее описание). Картинка определяется содержимым данных:
+по их хэшу кэшируются и готовые PNG, и file_id, который Telegram вернул после
+первой загрузки, поэтому повторный просмотр без новых медитаций не требует
+ни отрисовки, ни загрузки файла.
+"""
+import asyncio
+import hashlib
+import io
+import json
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, timedelta
+from typing import Dict, List, NamedTuple, Optional
+
+import numpy as np
+from aiogram import types
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import BufferedInputFile
+
+from cache import TTLCache
+from models import SessionHistory
+
+logger = logging.getLogger(__name__)
+
+EPOCH = date(1970, 1, 1)
+SECONDS_PER_DAY = 86400
+
+HEATMAP_WEEKS = 53
+TREND_WEEKS = 26
+
+# Цвета тепловой карты: нет медитаций, 1, 2, 3 и больше за день
+HEATMAP_COLORS = ["#ebedf0", "#9be9a8", "#40c463", "#216e39"]
+RATING_COLOR = "#216e39"
+DURATION_COLOR = "#9be9a8"
+
+MONTH_LABELS = ("янв", "фев", "мар", "апр", "май", "июн",
+                "июл", "авг", "сен", "окт", "ноя", "дек")
+WEEKDAY_LABELS = ("Пн", "", "Ср", "", "Пт", "", "")
+
+class Chart(NamedTuple):
+    kind: str
+    key: str  # хэш данных
+    caption: str
+    data: dict
+
+# Данные для графиков (основной процесс)
+
+def _day_offsets(history: SessionHistory, start: date) -> np.ndarray:
+    """Номер дня каждой строки истории относительно start"""
+    days = np.floor_divide(np.asarray(history.start_ts, dtype=np.float64), SECONDS_PER_DAY)
+    return days.astype(np.int64) - (start - EPOCH).days
+
+def heatmap_data(history: SessionHistory, today: date) -> dict:
+    """Число медитаций по дням за последний год, с понедельника"""
+    start = today - timedelta(days=today.weekday() + (HEATMAP_WEEKS - 1) * 7)
+    offsets = _day_offsets(history, start)
+    counts = np.asarray(history.counts, dtype=np.float64)
+    
+    size = HEATMAP_WEEKS * 7
+    inside = (offsets >= 0) & (offsets < size)
+    per_day = np.bincount(offsets[inside], weights=counts[inside], minlength=size)
+    
+    return {
+        'start': start.isoformat(),
+        'today': (today - start).days,
+        'counts': per_day.astype(int).tolist()
+    }
+
+def trend_data(history: SessionHistory, today: date) -> dict:
+    """Средняя оценка, минуты и число медитаций по неделям"""
+    start = today - timedelta(days=today.weekday() + (TREND_WEEKS - 1) * 7)
+    offsets = _day_offsets(history, start)
+    durations = np.nan_to_num(np.asarray(history.durations, dtype=np.float64))
+    ratings = np.asarray(history.ratings, dtype=np.float64)
+    counts = np.asarray(history.counts, dtype=np.float64)
+    
+    inside = (offsets >= 0) & (offsets < TREND_WEEKS * 7)
+    weeks = offsets[inside] // 7
+    rated = ~np.isnan(ratings[inside])
+    
+    minutes = np.bincount(weeks, weights=durations[inside], minlength=TREND_WEEKS)
+    sessions = np.bincount(weeks, weights=counts[inside], minlength=TREND_WEEKS)
+    rated_weights = np.bincount(weeks[rated], weights=counts[inside][rated], minlength=TREND_WEEKS)
+    rating_sums = np.bincount(
+        weeks[rated], weights=(ratings[inside] * counts[inside])[rated], minlength=TREND_WEEKS
+    )
+    
+    return {
+        'start': start.isoformat(),
+        'minutes': minutes.astype(int).tolist(),
+        'sessions': sessions.astype(int).tolist(),
+        'ratings': [
+            round(float(s / w), 2) if w else None
+            for s, w in zip(rating_sums, rated_weights)
+        ]
+    }
+
+# Отрисовка (процессы пула)
+
+def _init_worker():
+    """Загрузить matplotlib при старте процесса, а не при первом графике"""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.figure  # noqa: F401
+
+def _to_png(fig) -> bytes:
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png", bbox_inches="tight")
+    return buffer.getvalue()
+
+def render_heatmap(data: dict) -> bytes:
+    """Тепловая карта года: недели по горизонтали, дни недели по вертикали"""
+    from matplotlib.colors import ListedColormap
+    from matplotlib.figure import Figure
+    
+    start = date.fromisoformat(data['start'])
+    counts = np.asarray(data['counts'], dtype=np.float64)
+    levels = np.minimum(counts, len(HEATMAP_COLORS) - 1)
+    levels[data['today'] + 1:] = np.nan
+    grid = np.ma.masked_invalid(levels.reshape(HEATMAP_WEEKS, 7).T)
+    
+    fig = Figure(figsize=(11, 2.4), dpi=110)
+    ax = fig.add_subplot()
+    ax.pcolormesh(
+        grid, cmap=ListedColormap(HEATMAP_COLORS), vmin=-0.5, vmax=len(HEATMAP_COLORS) - 0.5,
+        edgecolors="white", linewidth=2
+    )
+    ax.set_aspect("equal")
+    ax.invert_yaxis()
+    
+    # Подпись месяца над неделей, в которой он начинается
+    ticks, labels = [], []
+    for week in range(HEATMAP_WEEKS):
+        week_start = start + timedelta(days=week * 7)
+        if week == 0 or week_start.day <= 7:
+            ticks.append(week + 0.5)
+            labels.append(MONTH_LABELS[week_start.month - 1])
+    ax.set_xticks(ticks, labels)
+    ax.xaxis.tick_top()
+    ax.set_yticks(np.arange(7) + 0.5, WEEKDAY_LABELS)
+    ax.tick_params(length=0, labelsize=8)
+    for spine in ax.spines.values():
+        spine.set_visible(False)
+    
+    active_days = int(np.count_nonzero(counts))
+    ax.set_title(
+        f"Медитаций за год: {int(counts.sum())}, дней с практикой: {active_days}",
+        fontsize=10, pad=18
+    )
+    return _to_png(fig)
+
+def render_trends(data: dict) -> bytes:
+    """Минуты по неделям (столбцы) и средняя оценка с линией тренда"""
+    from matplotlib.figure import Figure
+    
+    start = date.fromisoformat(data['start'])
+    weeks = np.arange(len(data['minutes']))
+    ratings = np.array([np.nan if r is None else r for r in data['ratings']])
+    
+    fig = Figure(figsize=(10, 4.5), dpi=110)
+    ax = fig.add_subplot()
+    ax.bar(weeks, data['minutes'], color=DURATION_COLOR, label="Минут за неделю")
+    ax.set_ylabel("Минут")
+    
+    rating_ax = ax.twinx()
+    rated = ~np.isnan(ratings)
+    rating_ax.plot(weeks[rated], ratings[rated], "o-", color=RATING_COLOR, label="Средняя оценка")
+    if rated.sum() >= 3:
+        slope, intercept = np.polyfit(weeks[rated], ratings[rated], 1)
+        rating_ax.plot(weeks, slope * weeks + intercept, "--", color=RATING_COLOR, alpha=0.5, label="Тренд оценки")
+    rating_ax.set_ylim(0, 10.5)
+    rating_ax.set_ylabel("Оценка")
+    
+    tick_weeks = weeks[::4]
+    ax.set_xticks(tick_weeks, [
+        (start + timedelta(days=int(w) * 7)).strftime("%d.%m") for w in tick_weeks
+    ])
+    ax.set_title(f"Последние {len(weeks)} недель: {sum(data['sessions'])} медитаций", fontsize=10)
+    
+    handles, labels = ax.get_legend_handles_labels()
+    rating_handles, rating_labels = rating_ax.get_legend_handles_labels()
+    ax.legend(handles + rating_handles, labels + rating_labels, loc="upper left", fontsize=8)
+    return _to_png(fig)
+
+RENDERERS = {
+    'heatmap': render_heatmap,
+    'trends': render_trends,
+}
+
+def create_render_pool(workers: int) -> ProcessPoolExecutor:
+    """Пул процессов отрисовки, процессы запускаются сразу.
+    
+    fork: при spawn и forkserver каждый процесс пула заново выполнял бы
+    bot.py (__main__). Форк процесса с работающими потоками может унаследовать
+    захваченную блокировку, поэтому пул нужно создать до запуска потоков
+    (логирования, метрик, asyncio.to_thread).
+    """
+    pool = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("fork"),
+        initializer=_init_worker
+    )
+    # С fork пул запускает все процессы при первой задаче
+    pool.submit(int)
+    return pool
+
+class ChartService:
+    """Графики пользователя с кэшем PNG и file_id по хэшу данных"""
+    
+    def __init__(self, db, workers: int = 2, image_cache_size: int = 256,
+                 pool: Optional[ProcessPoolExecutor] = None):
+        self.db = db
+        self.workers = workers
+        self._pool = pool or create_render_pool(workers)
+        self._images = TTLCache(maxsize=image_cache_size)
+        self._file_ids = TTLCache(maxsize=100000)
+        self._rendering: Dict[str, asyncio.Future] = {}
+    
+    @staticmethod
+    def _chart(kind: str, caption: str, data: dict) -> Chart:
+        digest = hashlib.sha256(
+            json.dumps([kind, data], sort_keys=True).encode()
+        ).hexdigest()
+        return Chart(kind, digest, caption, data)
+    
+    async def get_charts(self, user_id: int) -> List[Chart]:
+        """Графики пользователя (пустой список, если медитаций нет)"""
+        history = await self.db.get_session_history(user_id)
+        if not history.start_ts:
+            return []
+        
+        today = date.today()
+        return [
+            self._chart('heatmap', "🗓 Медитации за год", heatmap_data(history, today)),
+            self._chart('trends', "📈 Оценки и время по неделям", trend_data(history, today)),
+        ]
+    
+    async def render(self, chart: Chart) -> bytes:
+        """PNG графика; одинаковые графики рисуются один раз"""
+        image = self._images.get(chart.key)
+        if image is not None:
+            return image
+        
+        future = self._rendering.get(chart.key)
+        if future is None:
+            future = asyncio.ensure_future(self._render(chart))
+            self._rendering[chart.key] = future
+            future.add_done_callback(lambda _: self._rendering.pop(chart.key, None))
+        
+        image = await asyncio.shield(future)
+        self._images.set(chart.key, image)
+        return image
+    
+    async def _render(self, chart: Chart) -> bytes:
+        """Отрисовать график в пуле; пул с упавшим процессом пересоздается один раз"""
+        loop = asyncio.get_running_loop()
+        pool = self._pool
+        try:
+            return await loop.run_in_executor(pool, RENDERERS[chart.kind], chart.data)
+        except BrokenProcessPool:
+            logger.warning("Chart render pool is broken, restarting it")
+            # Пул мог пересоздать параллельный вызов
+            if self._pool is pool:
+                pool.shutdown(wait=False, cancel_futures=True)
+                # Здесь потоки уже работают, но другого способа вернуть пул нет
+                self._pool = create_render_pool(self.workers)
+            return await loop.run_in_executor(self._pool, RENDERERS[chart.kind], chart.data)
+    
+    async def send(self, message: types.Message, chart: Chart) -> types.Message:
+        """Отправить график в чат, по возможности повторно используя file_id"""
+        file_id = self._file_ids.get(chart.key)
+        if file_id:
+            try:
+                return await message.answer_photo(file_id, caption=chart.caption)
+            except TelegramBadRequest as e:
+                logger.warning("Cached chart file_id rejected: %s", e)
+                self._file_ids.invalidate(chart.key)
+        
+        image = await self.render(chart)
+        sent = await message.answer_photo(
+            BufferedInputFile(image, filename=f"{chart.kind}.png"), caption=chart.caption
+        )
+        self._file_ids.set(chart.key, sent.photo[-1].file_id)
+        return sent
+    
+    def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
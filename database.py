@@ -1,227 +1,887 @@
 # database.py
+import asyncio
 import asyncpg
+import random
+import time
+from collections import deque
+from contextlib import asynccontextmanager
 from datetime import datetime, date, timedelta
-from typing import Optional, List, Dict, Any
+from typing import AsyncIterator, Optional, List, Dict, Any
 import logging
 
+from cache import TTLCache
+from migrations import apply_migrations
+from models import (DailyStats, DialogueMessage, Marathon, MarathonProgress,
+                    MonthlyStats, Session, SessionHistory, StoppedSession, Streaks,
+                    UserStats)
+
 logger = logging.getLogger(__name__)
 
+DIALOGUE_PARTITION_PREFIX = "dialogue_history_"
+SESSIONS_PARTITION_PREFIX = "sessions_y"
+ACTIVE_SESSION_INDEX_SUFFIX = "_active_user"
+
+# Завершенные сессии за период вместе с архивными сводками по дням.
+# Архивная строка - это день целиком, sessions_count хранит число сессий в нем,
+# rating - округленную среднюю оценку дня (только для показа), rating_sum и
+# rating_count - сумму и число оценок. Средние считаются по rating_sum.
+SESSION_ROWS_SQL = '''
+    SELECT session_id, user_id, start_time, end_time, duration, comment, rating,
+           marathon_id, 1 AS sessions_count, (rating IS NOT NULL)::integer AS rating_count,
+           rating AS rating_sum
+    FROM sessions
+    WHERE user_id = $1
+        AND end_time IS NOT NULL
+        AND start_time >= $2 AND start_time < $3
+    UNION ALL
+    SELECT NULL, user_id, day::timestamp, day::timestamp, total_duration, NULL,
+           ROUND(rating_sum::numeric / NULLIF(rating_count, 0))::integer,
+           marathon_id, sessions_count, rating_count, rating_sum
+    FROM sessions_archive
+    WHERE user_id = $1
+        AND day >= $2::date AND day < $3::date
+'''
+
+# Вся история одной строкой из массивов: колонки передаются одним сообщением
+# протокола вместо тысяч строк и сразу превращаются в массивы NumPy
+SESSION_HISTORY_SQL = f'''
+    SELECT
+        COALESCE(array_agg(EXTRACT(EPOCH FROM start_time)::float8 ORDER BY start_time),
+                 '{{}}') AS start_ts,
+        COALESCE(array_agg(duration ORDER BY start_time), '{{}}') AS durations,
+        COALESCE(array_agg(rating_sum::float8 / NULLIF(rating_count, 0) ORDER BY start_time),
+                 '{{}}') AS ratings,
+        COALESCE(array_agg(sessions_count ORDER BY start_time), '{{}}') AS counts,
+        COALESCE(array_agg(session_id IS NULL ORDER BY start_time), '{{}}') AS archived
+    FROM ({SESSION_ROWS_SQL}) history
+'''
+
+# Серии дней с медитациями (gaps-and-islands): у дней одной серии разность
+# day - row_number постоянна. $2 - текущая дата, серия считается текущей,
+# если закончилась сегодня или вчера.
+STREAKS_SQL = '''
+    WITH days AS (
+        SELECT DISTINCT DATE(start_time) AS day
+        FROM sessions
+        WHERE user_id = $1 AND end_time IS NOT NULL AND start_time < $2::date + 1
+        UNION
+        SELECT day FROM sessions_archive WHERE user_id = $1
+    ), islands AS (
+        SELECT day, day - (ROW_NUMBER() OVER (ORDER BY day))::integer AS grp
+        FROM days
+    ), streaks AS (
+        SELECT MIN(day) AS first_day, MAX(day) AS last_day, COUNT(*) AS length
+        FROM islands
+        GROUP BY grp
+    )
+    SELECT
+        COALESCE(MAX(length) FILTER (WHERE last_day >= $2::date - 1), 0) AS current_streak,
+        COALESCE(MAX(length), 0) AS longest_streak,
+        COALESCE(SUM(length), 0)::integer AS active_days,
+        MIN(first_day) AS first_day
+    FROM streaks
+'''
+
+# Частые запросы: подготавливаются заранее на каждом новом соединении пула
+# active_sessions ведет триггер (миграция 0009): строка есть, пока сессия
+# не завершена. start_time в условии отсекает лишние партиции
+ACTIVE_SESSION_SQL = '''
+    SELECT s.* FROM active_sessions a
+    JOIN sessions s ON s.session_id = a.session_id AND s.start_time = a.start_time
+    WHERE a.user_id = $1
+'''
+
+USER_SESSIONS_SQL = '''
+    SELECT * FROM sessions
+    WHERE user_id = $1 AND end_time IS NOT NULL
+    ORDER BY start_time DESC
+    LIMIT $2
+'''
+
+USER_MARATHONS_SQL = '''
+    SELECT m.* FROM marathons m
+    JOIN marathon_participants mp ON m.marathon_id = mp.marathon_id
+    WHERE mp.user_id = $1
+    ORDER BY m.start_date DESC
+'''
+
+SAVE_DIALOGUE_MESSAGE_SQL = '''
+    INSERT INTO dialogue_history (user_id, content, is_user)
+    VALUES ($1, $2, $3)
+'''
+
+DIALOGUE_HISTORY_SQL = '''
+    SELECT content, is_user, created_at
+    FROM dialogue_history
+    WHERE user_id = $1
+    ORDER BY created_at DESC
+    LIMIT $2
+'''
+
+DIALOGUE_EXPORT_SQL = '''
+    SELECT content, is_user, created_at
+    FROM dialogue_history
+    WHERE user_id = $1
+    ORDER BY created_at
+'''
+
+# Частые запросы: на каждом соединении готовятся при первом выполнении
+HOT_STATEMENTS = frozenset((
+    ACTIVE_SESSION_SQL,
+    USER_SESSIONS_SQL,
+    USER_MARATHONS_SQL,
+    SAVE_DIALOGUE_MESSAGE_SQL,
+    DIALOGUE_HISTORY_SQL,
+))
+
+def _month_start(day: date) -> date:
+    """Первое число месяца"""
+    return day.replace(day=1)
+
+def _add_months(month: date, months: int) -> date:
+    """Сдвиг первого числа месяца на заданное количество месяцев"""
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+# Работа с партициями
+async def create_dialogue_partitions(conn, first_day: date, months_ahead: int = 2):
+    """Создание помесячных партиций с месяца до first_day до текущего месяца + months_ahead"""
+    month = _add_months(_month_start(first_day), -1)
+    last_month = _add_months(_month_start(date.today()), months_ahead)
+    
+    while month <= last_month:
+        next_month = _add_months(month, 1)
+        await conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {DIALOGUE_PARTITION_PREFIX}{month:%Y_%m}
+            PARTITION OF dialogue_history
+            FOR VALUES FROM ('{month}') TO ('{next_month}')
+        ''')
+        month = next_month
+
+async def create_sessions_partitions(conn, first_day: date, years_ahead: int = 1) -> List[int]:
+    """Создание годовых партиций сессий с года first_day до текущего года + years_ahead"""
+    years = list(range(first_day.year, date.today().year + years_ahead + 1))
+    for year in years:
+        await create_sessions_partition(conn, year)
+    return years
+
+async def create_sessions_partition(conn, year: int):
+    """Создание партиции сессий за год"""
+    await conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {SESSIONS_PARTITION_PREFIX}{year}
+        PARTITION OF sessions
+        FOR VALUES FROM ('{year}-01-01') TO ('{year + 1}-01-01')
+    ''')
+
+async def create_active_session_index(conn, partition: str):
+    """Частичный индекс незавершенных сессий пользователя в партиции.
+    
+    Уникальный индекс на секционированной таблице обязан включать start_time,
+    поэтому индекс (user_id) WHERE end_time IS NULL создается на каждой годовой
+    партиции отдельно и не видит сессий в соседних партициях. Одну незавершенную
+    сессию на пользователя во всей таблице гарантирует active_sessions.
+    """
+    await conn.execute(f'''
+        CREATE UNIQUE INDEX IF NOT EXISTS {partition}{ACTIVE_SESSION_INDEX_SUFFIX}
+        ON {partition} (user_id) WHERE end_time IS NULL
+    ''')
+
+async def list_partitions(conn, table: str) -> List[str]:
+    """Имена партиций таблицы"""
+    rows = await conn.fetch('''
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = $1::regclass
+    ''', table)
+    return [row['relname'] for row in rows]
+
+class ActiveSessionExists(Exception):
+    """У пользователя уже есть незавершенная сессия"""
+    
+    def __init__(self, session: Session):
+        super().__init__(f"User {session.user_id} already has active session {session.session_id}")
+        self.session = session
+
+class PoolStats:
+    """Метрики насыщения пула: ожидающие соединения и время получения"""
+    
+    def __init__(self):
+        self.acquires = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.timeouts = 0
+        self.acquire_time_total = 0.0
+        self.acquire_time_max = 0.0
+    
+    def record_acquire(self, elapsed: float):
+        self.acquires += 1
+        self.acquire_time_total += elapsed
+        self.acquire_time_max = max(self.acquire_time_max, elapsed)
+    
+    def snapshot(self, pool: Optional[asyncpg.Pool]) -> Dict[str, Any]:
+        return {
+            'size': pool.get_size() if pool else 0,
+            'idle': pool.get_idle_size() if pool else 0,
+            'max_size': pool.get_max_size() if pool else 0,
+            'waiting': self.waiting,
+            'max_waiting': self.max_waiting,
+            'acquires': self.acquires,
+            'timeouts': self.timeouts,
+            'avg_acquire_ms': self.acquire_time_total / self.acquires * 1000 if self.acquires else 0.0,
+            'max_acquire_ms': self.acquire_time_max * 1000,
+        }
+
+class QueryStats:
+    """Время получения соединения и выполнения запросов по методам Database.
+    
+    Запросы дольше slow_ms пишутся в лог с параметрами; для доли
+    explain_rate из них (только чтение) в фоне выполняется EXPLAIN ANALYZE.
+    """
+    
+    SAMPLE_SIZE = 256
+    
+    def __init__(self, slow_ms: float = 200, explain_rate: float = 0.0, explain=None):
+        self.slow_ms = slow_ms
+        self.explain_rate = explain_rate
+        self._explain = explain
+        self._explain_task: Optional[asyncio.Task] = None
+        self.methods: Dict[str, Dict[str, Any]] = {}
+    
+    def _method(self, method: str) -> Dict[str, Any]:
+        stats = self.methods.get(method)
+        if stats is None:
+            stats = self.methods[method] = {
+                'acquires': 0, 'acquire_total': 0.0, 'acquire_max': 0.0,
+                'queries': 0, 'exec_total': 0.0, 'exec_max': 0.0, 'slow': 0,
+                'samples': deque(maxlen=self.SAMPLE_SIZE),
+            }
+        return stats
+    
+    def record_acquire(self, method: str, elapsed: float):
+        stats = self._method(method)
+        stats['acquires'] += 1
+        stats['acquire_total'] += elapsed
+        stats['acquire_max'] = max(stats['acquire_max'], elapsed)
+    
+    def record_query(self, method: Optional[str], query: str, args: tuple, elapsed: float):
+        # Служебные запросы пула (RESET при возврате) и соединения
+        # в обход Database.acquire, включая EXPLAIN-выборки, не учитываются
+        if method is None:
+            return
+        stats = self._method(method)
+        stats['queries'] += 1
+        stats['exec_total'] += elapsed
+        stats['exec_max'] = max(stats['exec_max'], elapsed)
+        stats['samples'].append(elapsed)
+        
+        if elapsed * 1000 < self.slow_ms:
+            return
+        stats['slow'] += 1
+        logger.warning(
+            "Slow query in %s: %.0f ms, query: %.500s, params: %.300r",
+            method, elapsed * 1000, ' '.join(query.split()), args
+        )
+        
+        # Одна EXPLAIN-выборка за раз, только для читающих запросов
+        if (self._explain and self.explain_rate and random.random() < self.explain_rate
+                and query.lstrip().upper().startswith(('SELECT', 'WITH'))
+                and (self._explain_task is None or self._explain_task.done())):
+            self._explain_task = asyncio.create_task(self._explain(method, query, args))
+    
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """Агрегаты по методам, самые затратные по суммарному времени первыми"""
+        result = []
+        for method, stats in self.methods.items():
+            samples = sorted(stats['samples'])
+            queries, acquires = stats['queries'], stats['acquires']
+            result.append({
+                'method': method,
+                'acquires': acquires,
+                'avg_acquire_ms': stats['acquire_total'] / acquires * 1000 if acquires else 0.0,
+                'max_acquire_ms': stats['acquire_max'] * 1000,
+                'queries': queries,
+                'total_ms': stats['exec_total'] * 1000,
+                'avg_ms': stats['exec_total'] / queries * 1000 if queries else 0.0,
+                'p95_ms': samples[int(len(samples) * 0.95)] * 1000 if samples else 0.0,
+                'max_ms': stats['exec_max'] * 1000,
+                'slow': stats['slow'],
+            })
+        result.sort(key=lambda item: item['total_ms'], reverse=True)
+        return result
+    
+    def reset(self):
+        self.methods.clear()
+
+class DatabaseConnection(asyncpg.Connection):
+    """Соединение пула с подготовленными частыми запросами и замером времени.
+    
+    Запрос из hot_queries готовится при первом выполнении на соединении, а не
+    в init-хуке: первые соединения пула открываются до применения миграций,
+    когда таблиц еще нет.
+    
+    query_stats и hot_queries выставляются init-хуком пула, query_method - в
+    Database.acquire на время использования соединения (через
+    set_query_method: прокси пула не дает присваивать атрибуты).
+    """
+    
+    query_stats: Optional[QueryStats] = None
+    query_method: Optional[str] = None
+    hot_queries: frozenset = frozenset()
+    # Текст запроса -> подготовленный запрос; словарь только заменяется целиком
+    hot_statements: Dict[str, asyncpg.prepared_stmt.PreparedStatement] = {}
+    
+    def set_query_method(self, method: Optional[str]):
+        self.query_method = method
+    
+    async def _run(self, name: str, query: str, *args, **kwargs):
+        """Метод name соединения или подготовленного запроса с тем же текстом"""
+        statement = None
+        if args and query in self.hot_queries:
+            statement = self.hot_statements.get(query)
+            if statement is None:
+                # execute и fetch* с тем же текстом дальше идут без разбора на сервере
+                statement = await self.prepare(query)
+                self.hot_statements = {**self.hot_statements, query: statement}
+        if statement is not None:
+            try:
+                if name == 'execute':
+                    await statement.fetch(*args, **kwargs)
+                    return statement.get_statusmsg()
+                return await getattr(statement, name)(*args, **kwargs)
+            except (asyncpg.InvalidCachedStatementError, asyncpg.OutdatedSchemaCacheError):
+                # Схема изменилась после подготовки: этот вызов идет через кэш
+                # соединения, следующий подготовит запрос заново
+                self.hot_statements = {
+                    text: prepared for text, prepared in self.hot_statements.items()
+                    if text != query
+                }
+        return await getattr(asyncpg.Connection, name)(self, query, *args, **kwargs)
+    
+    async def _timed(self, name: str, query: str, args: tuple, **kwargs):
+        if self.query_stats is None:
+            return await self._run(name, query, *args, **kwargs)
+        
+        started = time.perf_counter()
+        try:
+            return await self._run(name, query, *args, **kwargs)
+        finally:
+            self.query_stats.record_query(self.query_method, query, args, time.perf_counter() - started)
+    
+    async def execute(self, query: str, *args, **kwargs):
+        return await self._timed('execute', query, args, **kwargs)
+    
+    async def executemany(self, command: str, args, **kwargs):
+        if self.query_stats is None:
+            return await super().executemany(command, args, **kwargs)
+        
+        started = time.perf_counter()
+        try:
+            return await super().executemany(command, args, **kwargs)
+        finally:
+            # Параметры пакета не логируем целиком, только их число
+            self.query_stats.record_query(
+                self.query_method, command, (f'<{len(args)} rows>',), time.perf_counter() - started
+            )
+    
+    async def fetch(self, query: str, *args, **kwargs):
+        return await self._timed('fetch', query, args, **kwargs)
+    
+    async def fetchrow(self, query: str, *args, **kwargs):
+        return await self._timed('fetchrow', query, args, **kwargs)
+    
+    async def fetchval(self, query: str, *args, **kwargs):
+        return await self._timed('fetchval', query, args, **kwargs)
+
 class Database:
-    def __init__(self, database_url: str):
+    def __init__(self, database_url: str, *,
+                 min_size: int = 2,
+                 max_size: int = 10,
+                 statement_cache_size: int = 100,
+                 command_timeout: Optional[float] = 30,
+                 statement_timeout_ms: int = 15000,
+                 acquire_timeout: Optional[float] = 10,
+                 application_name: str = "meditation-bot",
+                 replica_url: Optional[str] = None,
+                 read_your_writes_seconds: float = 5.0,
+                 slow_query_ms: float = 200,
+                 slow_query_explain_rate: float = 0.0):
         self.database_url = database_url
         self.pool: Optional[asyncpg.Pool] = None
+        self._session_years: set = set()
+        
+        # Реплика для чтения: отчеты и статистика не нагружают основной сервер
+        self.replica_url = replica_url
+        self.replica_pool: Optional[asyncpg.Pool] = None
+        self.read_your_writes_seconds = read_your_writes_seconds
+        self._last_write: Dict[int, float] = {}
+        
+        self.min_size = min_size
+        self.max_size = max_size
+        self.statement_cache_size = statement_cache_size
+        self.command_timeout = command_timeout
+        self.statement_timeout_ms = statement_timeout_ms
+        self.acquire_timeout = acquire_timeout
+        self.application_name = application_name
+        self.pool_stats = PoolStats()
+        self.replica_pool_stats = PoolStats()
+        self.query_stats = QueryStats(slow_query_ms, slow_query_explain_rate, self._explain_slow_query)
+        
+        # Серии пересчитываются только после изменения сессий пользователя
+        # или смены дня; TTL - страховка от расхождений с архивом
+        self._streaks_cache = TTLCache(maxsize=10000, ttl=3600)
+        
+        # Пользователи, чья строка в users уже актуальна: user_id -> профиль
+        self._known_users = TTLCache(maxsize=100000)
+        
+        # Незавершенные сессии: user_id -> строка sessions. Загружаются при
+        # старте и обновляются при начале и завершении медитации. Это только
+        # подсказка для чтения: другой процесс мог начать или завершить сессию,
+        # поэтому запись (начало, завершение) всегда проверяется в БД
+        self._active_sessions: Dict[int, Session] = {}
     
     async def init(self):
-        """Инициализация пула соединений и создание таблиц"""
-        self.pool = await asyncpg.create_pool(self.database_url)
-        await self.create_tables()
-    
-    async def create_tables(self):
-        """Создание необходимых таблиц"""
-        async with self.pool.acquire() as conn:
-            # Пользователи
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id BIGINT PRIMARY KEY,
-                    username VARCHAR(255),
-                    first_name VARCHAR(255),
-                    last_name VARCHAR(255),
-                    joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    timezone VARCHAR(50) DEFAULT 'UTC'
-                )
-            ''')
-            
-            # Сессии медитаций
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS sessions (
-                    session_id SERIAL PRIMARY KEY,
-                    user_id BIGINT REFERENCES users(user_id),
-                    start_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    end_time TIMESTAMP,
-                    duration INTEGER,
-                    comment TEXT,
-                    rating INTEGER CHECK (rating >= 1 AND rating <= 10),
-                    marathon_id INTEGER
-                )
-            ''')
-            
-            # Марафоны
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS marathons (
-                    marathon_id SERIAL PRIMARY KEY,
-                    title VARCHAR(255) NOT NULL,
-                    description TEXT,
-                    start_date DATE NOT NULL,
-                    end_date DATE NOT NULL,
-                    daily_goal INTEGER NOT NULL DEFAULT 1,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            # Участники марафонов
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS marathon_participants (
-                    user_id BIGINT REFERENCES users(user_id),
-                    marathon_id INTEGER REFERENCES marathons(marathon_id),
-                    joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    PRIMARY KEY (user_id, marathon_id)
-                )
-            ''')
-            
-            # История диалогов с AI
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS dialogue_history (
-                    id SERIAL PRIMARY KEY,
-                    user_id BIGINT REFERENCES users(user_id),
-                    content TEXT NOT NULL,
-                    is_user BOOLEAN NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            # Создаем индексы для оптимизации
-            await conn.execute('''
-                CREATE INDEX IF NOT EXISTS idx_sessions_user_id 
-                ON sessions(user_id)
-            ''')
-            
-            await conn.execute('''
-                CREATE INDEX IF NOT EXISTS idx_sessions_marathon_id 
-                ON sessions(marathon_id)
-            ''')
-            
-            await conn.execute('''
-                CREATE INDEX IF NOT EXISTS idx_dialogue_user_id 
-                ON dialogue_history(user_id, created_at DESC)
-            ''')
+        """Инициализация пула соединений и применение миграций схемы"""
+        self.pool = await self._create_pool(self.database_url)
+        await apply_migrations(self.pool)
+        
+        async with self.acquire('init') as conn:
+            await self._load_session_years(conn)
+        await self.reload_active_sessions()
+        
+        if self.replica_url:
+            try:
+                self.replica_pool = await self._create_pool(self.replica_url)
+            except (OSError, asyncpg.PostgresError) as e:
+                logger.error("Read replica is unavailable, reading from primary: %s", e)
+    
+    async def _create_pool(self, dsn: str) -> asyncpg.Pool:
+        """Создание пула с настройками из конфигурации.
+        
+        statement_timeout и application_name передаются через server_settings:
+        пул выполняет RESET ALL при возврате соединения, и SET из init-хука
+        сбросился бы после первого же запроса.
+        """
+        return await asyncpg.create_pool(
+            dsn,
+            min_size=self.min_size,
+            max_size=self.max_size,
+            statement_cache_size=self.statement_cache_size,
+            command_timeout=self.command_timeout,
+            connection_class=DatabaseConnection,
+            init=self._init_connection,
+            server_settings={
+                'application_name': self.application_name,
+                'statement_timeout': str(self.statement_timeout_ms),
+            }
+        )
+    
+    async def _init_connection(self, conn: DatabaseConnection):
+        """Хук нового соединения пула"""
+        conn.query_stats = self.query_stats
+        if self.statement_cache_size > 0:
+            conn.hot_queries = HOT_STATEMENTS
+    
+    @asynccontextmanager
+    async def acquire(self, method: str, *, replica: bool = False, user_id: Optional[int] = None):
+        """Получение соединения из пула с учетом метрик насыщения.
+        
+        method - имя, под которым ожидание и запросы попадают в статистику
+        (обычно имя вызывающего метода). replica=True направляет чтение на
+        реплику, если она настроена и пользователь user_id ничего не
+        записывал за последние read_your_writes_seconds (иначе читаем с
+        основного сервера).
+        """
+        pool, stats = self.pool, self.pool_stats
+        if replica and self.replica_pool and not self._wrote_recently(user_id):
+            pool, stats = self.replica_pool, self.replica_pool_stats
+        
+        stats.waiting += 1
+        stats.max_waiting = max(stats.max_waiting, stats.waiting)
+        started = time.perf_counter()
+        
+        try:
+            conn = await pool.acquire(timeout=self.acquire_timeout)
+        except asyncio.TimeoutError:
+            stats.timeouts += 1
+            logger.warning("Database pool acquire timed out, stats: %s", stats.snapshot(pool))
+            raise
+        finally:
+            stats.waiting -= 1
+        
+        elapsed = time.perf_counter() - started
+        stats.record_acquire(elapsed)
+        self.query_stats.record_acquire(method, elapsed)
+        conn.set_query_method(method)
+        try:
+            yield conn
+        finally:
+            conn.set_query_method(None)
+            await pool.release(conn)
+    
+    def _mark_write(self, user_id: Optional[int]):
+        """Запомнить запись пользователя для read-your-writes"""
+        if user_id is None or not self.replica_pool:
+            return
+        
+        now = time.monotonic()
+        self._last_write[user_id] = now
+        
+        # Периодически выбрасываем устаревшие отметки
+        if len(self._last_write) > 10000:
+            self._last_write = {
+                uid: ts for uid, ts in self._last_write.items()
+                if now - ts < self.read_your_writes_seconds
+            }
+    
+    def _wrote_recently(self, user_id: Optional[int]) -> bool:
+        """Писал ли пользователь в БД в пределах окна read-your-writes"""
+        if user_id is None:
+            return False
+        last_write = self._last_write.get(user_id)
+        return last_write is not None and time.monotonic() - last_write < self.read_your_writes_seconds
+    
+    def _invalidate_streaks(self, user_id: Optional[int]):
+        """Сбросить закэшированные серии после изменения сессий"""
+        if user_id is not None:
+            self._streaks_cache.invalidate(user_id)
+    
+    async def _explain_slow_query(self, method: str, query: str, args: tuple):
+        """EXPLAIN ANALYZE медленного запроса в лог (запрос выполняется повторно)"""
+        try:
+            async with self.pool.acquire() as conn:
+                rows = await conn.fetch(f'EXPLAIN (ANALYZE, BUFFERS) {query}', *args)
+            plan = '\n'.join(row[0] for row in rows)
+            logger.warning("Plan of slow query in %s:\n%s", method, plan)
+        except Exception as e:
+            logger.error("Error explaining slow query in %s: %s", method, e)
+    
+    def get_query_stats(self) -> List[Dict[str, Any]]:
+        """Время запросов по методам (самые затратные первыми)"""
+        return self.query_stats.snapshot()
+    
+    def get_pool_stats(self) -> Dict[str, Any]:
+        """Текущие метрики пула соединений"""
+        stats = self.pool_stats.snapshot(self.pool)
+        if self.replica_pool:
+            stats['replica'] = self.replica_pool_stats.snapshot(self.replica_pool)
+        return stats
+    
+    async def _load_session_years(self, conn):
+        """Загрузка списка годов, для которых уже есть партиции сессий"""
+        self._session_years = {
+            int(name[len(SESSIONS_PARTITION_PREFIX):])
+            for name in await list_partitions(conn, 'sessions')
+            if name[len(SESSIONS_PARTITION_PREFIX):].isdigit()
+        }
     
     # Методы для работы с пользователями
     async def create_user(self, user_id: int, username: Optional[str],
                          first_name: Optional[str], last_name: Optional[str]):
-        """Создание или обновление пользователя"""
-        async with self.pool.acquire() as conn:
-            await conn.execute('''
-                INSERT INTO users (user_id, username, first_name, last_name)
+        """Создание или обновление пользователя.
+        
+        Запрос выполняется, только если пользователь еще не встречался этому
+        процессу или его профиль изменился; неизменная строка не перезаписывается.
+        """
+        profile = (username, first_name, last_name)
+        if self._known_users.get(user_id) == profile:
+            return
+        
+        async with self.acquire('create_user') as conn:
+            status = await conn.execute('''
+                INSERT INTO users AS u (user_id, username, first_name, last_name)
                 VALUES ($1, $2, $3, $4)
                 ON CONFLICT (user_id) 
                 DO UPDATE SET 
                     username = EXCLUDED.username,
                     first_name = EXCLUDED.first_name,
                     last_name = EXCLUDED.last_name
+                WHERE (u.username, u.first_name, u.last_name)
+                    IS DISTINCT FROM (EXCLUDED.username, EXCLUDED.first_name, EXCLUDED.last_name)
             ''', user_id, username, first_name, last_name)
+        
+        self._known_users.set(user_id, profile)
+        if status.split()[-1] != '0':
+            self._mark_write(user_id)
     
     # Методы для работы с сессиями
+    async def reload_active_sessions(self):
+        """Загрузка незавершенных сессий из БД в реестр процесса"""
+        async with self.acquire('reload_active_sessions') as conn:
+            rows = await conn.fetch('''
+                SELECT s.* FROM active_sessions a
+                JOIN sessions s ON s.session_id = a.session_id AND s.start_time = a.start_time
+            ''')
+        self._active_sessions = {row['user_id']: Session.from_record(row) for row in rows}
+    
     async def create_session(self, user_id: int, marathon_id: Optional[int] = None) -> int:
-        """Создание новой сессии медитации"""
-        async with self.pool.acquire() as conn:
-            session_id = await conn.fetchval('''
-                INSERT INTO sessions (user_id, marathon_id)
-                VALUES ($1, $2)
-                RETURNING session_id
-            ''', user_id, marathon_id)
-            return session_id
+        """Создание новой сессии медитации.
+        
+        Без marathon_id сессия привязывается к текущему марафону пользователя.
+        Если у пользователя уже есть незавершенная сессия, выбрасывается
+        ActiveSessionExists. Проверяет это БД (active_sessions), а не реестр
+        процесса - он может не знать о сессиях других процессов.
+        """
+        try:
+            async with self.acquire('create_session') as conn:
+                row = await conn.fetchrow('''
+                    INSERT INTO sessions (user_id, marathon_id)
+                    VALUES ($1, COALESCE($2, (
+                        SELECT m.marathon_id FROM marathons m
+                        JOIN marathon_participants mp ON m.marathon_id = mp.marathon_id
+                        WHERE mp.user_id = $1
+                            AND CURRENT_DATE BETWEEN m.start_date AND m.end_date
+                        ORDER BY m.start_date DESC
+                        LIMIT 1
+                    )))
+                    RETURNING *
+                ''', user_id, marathon_id)
+        except asyncpg.UniqueViolationError:
+            # Незавершенная сессия уже есть - подтягиваем ее в реестр
+            active = await self._fetch_active_session(user_id)
+            if active is None:
+                raise
+            raise ActiveSessionExists(active)
+        
+        self._active_sessions[user_id] = Session.from_record(row)
+        self._mark_write(user_id)
+        return row['session_id']
     
-    async def get_active_session(self, user_id: int) -> Optional[Dict[str, Any]]:
-        """Получение активной сессии пользователя"""
-        async with self.pool.acquire() as conn:
-            row = await conn.fetchrow('''
-                SELECT * FROM sessions
-                WHERE user_id = $1 AND end_time IS NULL
-                ORDER BY start_time DESC
-                LIMIT 1
-            ''', user_id)
-            return dict(row) if row else None
+    async def get_active_session(self, user_id: int) -> Optional[Session]:
+        """Получение активной сессии пользователя.
+        
+        Берется из реестра; к БД обращаемся, только если в реестре ее нет
+        (сессию мог начать другой процесс). Реестр может быть устаревшим,
+        поэтому stop_session проверяет сессию в БД.
+        """
+        active = self._active_sessions.get(user_id)
+        if active is None:
+            active = await self._fetch_active_session(user_id)
+        return active
+    
+    async def _fetch_active_session(self, user_id: int) -> Optional[Session]:
+        async with self.acquire('fetch_active_session') as conn:
+            row = await conn.fetchrow(ACTIVE_SESSION_SQL, user_id)
+        if row is None:
+            self._active_sessions.pop(user_id, None)
+            return None
+        self._active_sessions[user_id] = Session.from_record(row)
+        return self._active_sessions[user_id]
     
-    async def end_session(self, session_id: int) -> int:
-        """Завершение сессии и расчет продолжительности"""
-        async with self.pool.acquire() as conn:
-            result = await conn.fetchrow('''
+    def _forget_active_session(self, user_id: int, session_id: int):
+        active = self._active_sessions.get(user_id)
+        if active and active.session_id == session_id:
+            del self._active_sessions[user_id]
+    
+    async def stop_session(self, session: Session) -> Optional[StoppedSession]:
+        """Завершить медитацию: записать время окончания и длительность.
+        
+        Пишется сразу, а не после опроса: если бот перезапустится или
+        пользователь бросит опрос, измеренная длительность не потеряется, и
+        сессию не закроет очистка забытых медитаций. Комментарий и оценка
+        дописываются вторым UPDATE в finalize_session. Возвращает None, если
+        сессия уже закрыта (автоматически или другим процессом) - запись в
+        реестре при этом удаляется.
+        """
+        async with self.acquire('stop_session') as conn:
+            row = await conn.fetchrow('''
                 UPDATE sessions
-                SET end_time = CURRENT_TIMESTAMP,
-                    duration = EXTRACT(EPOCH FROM (CURRENT_TIMESTAMP - start_time)) / 60
-                WHERE session_id = $1
-                RETURNING duration
-            ''', session_id)
-            return int(result['duration'])
+                SET end_time = LOCALTIMESTAMP,
+                    duration = GREATEST(0, FLOOR(EXTRACT(EPOCH FROM LOCALTIMESTAMP - start_time) / 60))::integer
+                WHERE session_id = $1 AND start_time = $2 AND end_time IS NULL
+                RETURNING end_time, duration
+            ''', session.session_id, session.start_time)
+        
+        self._forget_active_session(session.user_id, session.session_id)
+        if row is None:
+            return None
+        
+        self._mark_write(session.user_id)
+        self._invalidate_streaks(session.user_id)
+        return StoppedSession(session.session_id, row['end_time'], row['duration'])
     
-    async def update_session_comment(self, session_id: int, comment: str):
-        """Обновление комментария сессии"""
-        async with self.pool.acquire() as conn:
-            await conn.execute('''
+    async def finalize_session(self, session_id: int, comment: Optional[str] = None,
+                               rating: Optional[int] = None) -> bool:
+        """Записать комментарий и оценку завершенной сессии одним UPDATE.
+        
+        Комментарий до оценки хранится только в FSM, поэтому брошенный опрос
+        оставляет сессию без комментария и оценки. Возвращает False, если
+        завершенной сессии нет (например, ее удалили).
+        """
+        async with self.acquire('finalize_session') as conn:
+            user_id = await conn.fetchval('''
                 UPDATE sessions
-                SET comment = $2
-                WHERE session_id = $1
-            ''', session_id, comment)
+                SET comment = $2,
+                    rating = $3
+                WHERE session_id = $1 AND end_time IS NOT NULL
+                RETURNING user_id
+            ''', session_id, comment, rating)
+        
+        if user_id is None:
+            return False
+        
+        self._mark_write(user_id)
+        self._invalidate_streaks(user_id)
+        return True
     
-    async def update_session_rating(self, session_id: int, rating: int):
-        """Обновление оценки сессии"""
-        async with self.pool.acquire() as conn:
-            await conn.execute('''
+    async def close_stale_sessions(self, max_age_hours: float) -> List[Session]:
+        """Закрыть незавершенные сессии старше max_age_hours.
+        
+        Продолжительность такой сессии неизвестна, поэтому она закрывается
+        нулевой длительности с пометкой auto_closed. Возвращает закрытые сессии.
+        """
+        async with self.acquire('close_stale_sessions') as conn:
+            rows = await conn.fetch('''
                 UPDATE sessions
-                SET rating = $2
-                WHERE session_id = $1
-            ''', session_id, rating)
+                SET end_time = start_time,
+                    duration = 0,
+                    auto_closed = TRUE
+                WHERE end_time IS NULL
+                    AND start_time < CURRENT_TIMESTAMP - make_interval(secs => $1)
+                RETURNING *
+            ''', max_age_hours * 3600)
+        
+        sessions = [Session.from_record(row) for row in rows]
+        for session in sessions:
+            self._forget_active_session(session.user_id, session.session_id)
+            self._mark_write(session.user_id)
+            self._invalidate_streaks(session.user_id)
+        return sessions
     
     async def create_manual_session(self, user_id: int, start_time: datetime, 
                                   duration: int, rating: Optional[int] = None, 
                                   comment: Optional[str] = None) -> int:
         """Создать сессию медитации вручную"""
-        async with self.pool.acquire() as conn:
+        async with self.acquire('create_manual_session') as conn:
             # Вычисляем end_time
             end_time = start_time + timedelta(minutes=duration)
             
+            # Ручная запись может относиться к году без партиции
+            if start_time.year not in self._session_years:
+                await create_sessions_partition(conn, start_time.year)
+                await create_active_session_index(conn, f"{SESSIONS_PARTITION_PREFIX}{start_time.year}")
+                self._session_years.add(start_time.year)
+            
             session_id = await conn.fetchval('''
                 INSERT INTO sessions (user_id, start_time, end_time, duration, rating, comment)
                 VALUES ($1, $2, $3, $4, $5, $6)
                 RETURNING session_id
             ''', user_id, start_time, end_time, duration, rating, comment)
-            return session_id
+        self._mark_write(user_id)
+        self._invalidate_streaks(user_id)
+        return session_id
     
-    async def get_session_by_id(self, session_id: int) -> Optional[Dict[str, Any]]:
+    async def get_session_by_id(self, session_id: int) -> Optional[Session]:
         """Получить сессию по ID"""
-        async with self.pool.acquire() as conn:
+        async with self.acquire('get_session_by_id') as conn:
             row = await conn.fetchrow('''
                 SELECT * FROM sessions
                 WHERE session_id = $1
             ''', session_id)
-            return dict(row) if row else None
+            return Session.from_record(row) if row else None
     
     async def delete_session(self, session_id: int, user_id: int) -> bool:
         """Удалить сессию медитации"""
-        async with self.pool.acquire() as conn:
+        async with self.acquire('delete_session') as conn:
             result = await conn.execute('''
                 DELETE FROM sessions
                 WHERE session_id = $1 AND user_id = $2
             ''', session_id, user_id)
-            return result.split()[-1] != '0'
+        self._forget_active_session(user_id, session_id)
+        self._mark_write(user_id)
+        self._invalidate_streaks(user_id)
+        return result.split()[-1] != '0'
     
-    async def get_user_sessions(self, user_id: int, limit: int = 10) -> List[Dict[str, Any]]:
+    async def get_user_sessions(self, user_id: int, limit: int = 10) -> List[Session]:
         """Получение истории сессий пользователя"""
-        async with self.pool.acquire() as conn:
-            rows = await conn.fetch('''
-                SELECT * FROM sessions
-                WHERE user_id = $1 AND end_time IS NOT NULL
-                ORDER BY start_time DESC
-                LIMIT $2
-            ''', user_id, limit)
-            return [dict(row) for row in rows]
-    
-    async def get_user_stats(self, user_id: int) -> Dict[str, Any]:
-        """Получение статистики пользователя"""
-        async with self.pool.acquire() as conn:
+        async with self.acquire('get_user_sessions', replica=True, user_id=user_id) as conn:
+            rows = await conn.fetch(USER_SESSIONS_SQL, user_id, limit)
+            return [Session.from_record(row) for row in rows]
+    
+    async def get_user_stats(self, user_id: int) -> UserStats:
+        """Получение статистики пользователя (с учетом архива)"""
+        async with self.acquire('get_user_stats', replica=True, user_id=user_id) as conn:
             stats = await conn.fetchrow('''
+                WITH hot AS (
+                    SELECT 
+                        COUNT(*) as sessions_count,
+                        COALESCE(SUM(duration), 0) as total_duration,
+                        COALESCE(SUM(rating), 0) as rating_sum,
+                        COUNT(rating) as rating_count
+                    FROM sessions
+                    WHERE user_id = $1 AND end_time IS NOT NULL
+                ), archived AS (
+                    SELECT 
+                        COALESCE(SUM(sessions_count), 0) as sessions_count,
+                        COALESCE(SUM(total_duration), 0) as total_duration,
+                        COALESCE(SUM(rating_sum), 0) as rating_sum,
+                        COALESCE(SUM(rating_count), 0) as rating_count
+                    FROM sessions_archive
+                    WHERE user_id = $1
+                )
                 SELECT 
-                    COUNT(*) as total_sessions,
-                    COALESCE(SUM(duration), 0) as total_duration,
-                    COALESCE(AVG(rating), 0) as avg_rating
-                FROM sessions
-                WHERE user_id = $1 AND end_time IS NOT NULL
+                    hot.sessions_count + archived.sessions_count as total_sessions,
+                    hot.total_duration + archived.total_duration as total_duration,
+                    COALESCE(
+                        (hot.rating_sum + archived.rating_sum)::numeric
+                        / NULLIF(hot.rating_count + archived.rating_count, 0),
+                        0
+                    ) as avg_rating
+                FROM hot, archived
             ''', user_id)
-            return dict(stats)
+            return UserStats.from_record(stats)
+    
+    async def get_session_history(self, user_id: int) -> SessionHistory:
+        """Вся история сессий пользователя (с архивом) в колоночном виде"""
+        async with self.acquire('get_session_history', replica=True, user_id=user_id) as conn:
+            row = await conn.fetchrow(
+                SESSION_HISTORY_SQL, user_id, datetime.min, datetime.max
+            )
+            return SessionHistory.from_record(row)
+    
+    async def iter_session_batches(self, user_id: int, batch_size: int = 500) -> AsyncIterator[List[Session]]:
+        """Все сессии пользователя (с архивом) пачками через серверный курсор.
+        
+        Соединение занято, пока итератор не дочитан или не закрыт.
+        """
+        async with self.acquire('iter_session_batches', replica=True, user_id=user_id) as conn:
+            async with conn.transaction(isolation='repeatable_read', readonly=True):
+                cursor = await conn.cursor(
+                    SESSION_ROWS_SQL + ' ORDER BY start_time',
+                    user_id, datetime.min, datetime.max
+                )
+                while True:
+                    rows = await cursor.fetch(batch_size)
+                    if not rows:
+                        break
+                    yield [Session.from_record(row) for row in rows]
+    
+    async def get_streaks(self, user_id: int) -> Streaks:
+        """Текущая и самая длинная серия дней подряд и регулярность практики.
+        
+        consistency - доля дней с медитацией (в процентах) с первой
+        медитации по сегодняшний день.
+        """
+        today = date.today()
+        cached = self._streaks_cache.get(user_id)
+        if cached and cached[0] == today:
+            return cached[1]
+        
+        async with self.acquire('get_streaks', replica=True, user_id=user_id) as conn:
+            row = await conn.fetchrow(STREAKS_SQL, user_id, today)
+        
+        consistency = 0.0
+        if row['first_day']:
+            total_days = (today - row['first_day']).days + 1
+            consistency = min(100.0, row['active_days'] * 100 / total_days)
+        
+        streaks = Streaks(row['current_streak'], row['longest_streak'], row['active_days'], consistency)
+        self._streaks_cache.set(user_id, (today, streaks))
+        return streaks
     
-    async def get_monthly_stats(self, user_id: int) -> Dict[str, Any]:
+    async def get_monthly_stats(self, user_id: int) -> MonthlyStats:
         """Получение статистики за последние 30 дней"""
-        async with self.pool.acquire() as conn:
+        async with self.acquire('get_monthly_stats', replica=True, user_id=user_id) as conn:
             stats = await conn.fetchrow('''
                 SELECT 
                     COUNT(*) as sessions_count,
@@ -233,53 +893,53 @@ class Database:
                     AND end_time IS NOT NULL
                     AND start_time >= CURRENT_TIMESTAMP - INTERVAL '30 days'
             ''', user_id)
-            return dict(stats)
+            return MonthlyStats.from_record(stats)
     
-    async def get_sessions_by_month(self, user_id: int, year: int, month: int) -> List[Dict[str, Any]]:
+    async def get_sessions_by_month(self, user_id: int, year: int, month: int) -> List[Session]:
         """Получение всех сессий за конкретный месяц"""
-        async with self.pool.acquire() as conn:
-            rows = await conn.fetch('''
-                SELECT * FROM sessions
-                WHERE user_id = $1 
-                    AND end_time IS NOT NULL
-                    AND EXTRACT(YEAR FROM start_time) = $2
-                    AND EXTRACT(MONTH FROM start_time) = $3
-                ORDER BY start_time
-            ''', user_id, year, month)
-            return [dict(row) for row in rows]
+        month_start = datetime(year, month, 1)
+        next_month = datetime.combine(_add_months(month_start.date(), 1), datetime.min.time())
+        
+        async with self.acquire('get_sessions_by_month', replica=True, user_id=user_id) as conn:
+            rows = await conn.fetch(
+                SESSION_ROWS_SQL + ' ORDER BY start_time',
+                user_id, month_start, next_month
+            )
+            return [Session.from_record(row) for row in rows]
     
-    async def get_daily_stats(self, user_id: int, date: date) -> Dict[str, Any]:
+    async def get_daily_stats(self, user_id: int, date: date) -> DailyStats:
         """Получение статистики за конкретный день"""
-        async with self.pool.acquire() as conn:
-            stats = await conn.fetchrow('''
+        day_start = datetime.combine(date, datetime.min.time())
+        day_end = day_start + timedelta(days=1)
+        
+        async with self.acquire('get_daily_stats', replica=True, user_id=user_id) as conn:
+            stats = await conn.fetchrow(f'''
                 SELECT 
-                    COUNT(*) as sessions_count,
+                    COALESCE(SUM(sessions_count), 0) as sessions_count,
                     COALESCE(SUM(duration), 0) as total_duration,
-                    COALESCE(AVG(rating), 0) as avg_rating,
+                    COALESCE(SUM(rating_sum)::numeric / NULLIF(SUM(rating_count), 0), 0) as avg_rating,
                     COALESCE(MAX(rating), 0) as max_rating
-                FROM sessions
-                WHERE user_id = $1 
-                    AND DATE(start_time) = $2
-                    AND end_time IS NOT NULL
-            ''', user_id, date)
+                FROM ({SESSION_ROWS_SQL}) day_sessions
+            ''', user_id, day_start, day_end)
             
-            sessions = await conn.fetch('''
-                SELECT * FROM sessions
-                WHERE user_id = $1 
-                    AND DATE(start_time) = $2
-                    AND end_time IS NOT NULL
-                ORDER BY start_time
-            ''', user_id, date)
+            sessions = await conn.fetch(
+                SESSION_ROWS_SQL + ' ORDER BY start_time',
+                user_id, day_start, day_end
+            )
             
-            result = dict(stats)
-            result['sessions'] = [dict(row) for row in sessions]
-            return result
+            return DailyStats(
+                sessions_count=stats['sessions_count'],
+                total_duration=stats['total_duration'],
+                avg_rating=stats['avg_rating'],
+                max_rating=stats['max_rating'],
+                sessions=[Session.from_record(row) for row in sessions]
+            )
     
     # Методы для работы с марафонами
     async def create_marathon(self, title: str, description: str,
                             start_date: date, end_date: date, daily_goal: int) -> int:
         """Создание нового марафона"""
-        async with self.pool.acquire() as conn:
+        async with self.acquire('create_marathon') as conn:
             marathon_id = await conn.fetchval('''
                 INSERT INTO marathons (title, description, start_date, end_date, daily_goal)
                 VALUES ($1, $2, $3, $4, $5)
@@ -287,37 +947,38 @@ class Database:
             ''', title, description, start_date, end_date, daily_goal)
             return marathon_id
     
-    async def get_active_marathons(self) -> List[Dict[str, Any]]:
+    async def get_active_marathons(self) -> List[Marathon]:
         """Получение активных марафонов"""
-        async with self.pool.acquire() as conn:
+        async with self.acquire('get_active_marathons', replica=True) as conn:
             rows = await conn.fetch('''
                 SELECT * FROM marathons
                 WHERE start_date <= CURRENT_DATE AND end_date >= CURRENT_DATE
                 ORDER BY start_date
             ''')
-            return [dict(row) for row in rows]
+            return [Marathon.from_record(row) for row in rows]
     
-    async def get_marathon(self, marathon_id: int) -> Optional[Dict[str, Any]]:
+    async def get_marathon(self, marathon_id: int) -> Optional[Marathon]:
         """Получение информации о марафоне"""
-        async with self.pool.acquire() as conn:
+        async with self.acquire('get_marathon', replica=True) as conn:
             row = await conn.fetchrow('''
                 SELECT * FROM marathons
                 WHERE marathon_id = $1
             ''', marathon_id)
-            return dict(row) if row else None
+            return Marathon.from_record(row) if row else None
     
     async def add_marathon_participant(self, user_id: int, marathon_id: int):
         """Добавление участника в марафон"""
-        async with self.pool.acquire() as conn:
+        async with self.acquire('add_marathon_participant') as conn:
             await conn.execute('''
                 INSERT INTO marathon_participants (user_id, marathon_id)
                 VALUES ($1, $2)
                 ON CONFLICT DO NOTHING
             ''', user_id, marathon_id)
+        self._mark_write(user_id)
     
     async def is_marathon_participant(self, user_id: int, marathon_id: int) -> bool:
         """Проверка участия в марафоне"""
-        async with self.pool.acquire() as conn:
+        async with self.acquire('is_marathon_participant', replica=True, user_id=user_id) as conn:
             result = await conn.fetchval('''
                 SELECT EXISTS(
                     SELECT 1 FROM marathon_participants
@@ -326,81 +987,182 @@ class Database:
             ''', user_id, marathon_id)
             return result
     
-    async def get_user_marathons(self, user_id: int) -> List[Dict[str, Any]]:
+    async def get_user_marathons(self, user_id: int) -> List[Marathon]:
         """Получение марафонов пользователя"""
-        async with self.pool.acquire() as conn:
-            rows = await conn.fetch('''
-                SELECT m.* FROM marathons m
-                JOIN marathon_participants mp ON m.marathon_id = mp.marathon_id
-                WHERE mp.user_id = $1
-                ORDER BY m.start_date DESC
-            ''', user_id)
-            return [dict(row) for row in rows]
+        async with self.acquire('get_user_marathons', replica=True, user_id=user_id) as conn:
+            rows = await conn.fetch(USER_MARATHONS_SQL, user_id)
+            return [Marathon.from_record(row) for row in rows]
     
-    async def get_marathon_progress(self, user_id: int, marathon_id: int) -> Dict[str, Any]:
+    async def get_marathon_progress(self, user_id: int, marathon_id: int) -> MarathonProgress:
         """Получение прогресса пользователя в марафоне"""
-        async with self.pool.acquire() as conn:
-            marathon = await self.get_marathon(marathon_id)
-            
-            # Считаем количество дней и выполненных дней
-            total_days = (marathon['end_date'] - marathon['start_date']).days + 1
-            
-            # Получаем количество сессий в рамках марафона
-            sessions_count = await conn.fetchval('''
-                SELECT COUNT(*) FROM sessions
-                WHERE user_id = $1 AND marathon_id = $2 AND end_time IS NOT NULL
-            ''', user_id, marathon_id)
-            
-            # Считаем количество дней с выполненной целью
-            completed_days = await conn.fetchval('''
-                SELECT COUNT(*)
-                FROM (
-                    SELECT DATE(start_time) as session_date
-                    FROM sessions
-                    WHERE user_id = $1 AND marathon_id = $2 AND end_time IS NOT NULL
-                    GROUP BY DATE(start_time)
-                    HAVING COUNT(*) >= $3
-                ) daily_goals
-            ''', user_id, marathon_id, marathon['daily_goal'])
+        # Вне acquire, чтобы не держать два соединения пула одновременно
+        marathon = await self.get_marathon(marathon_id)
+        
+        # Считаем количество дней и выполненных дней
+        total_days = (marathon.end_date - marathon.start_date).days + 1
+        
+        async with self.acquire('get_marathon_progress', replica=True, user_id=user_id) as conn:
+            # Сессии марафона по дням, включая архивные сводки
+            progress = await conn.fetchrow('''
+                WITH daily AS (
+                    SELECT session_date, SUM(sessions_count)::bigint as sessions_count
+                    FROM (
+                        SELECT DATE(start_time) as session_date, COUNT(*) as sessions_count
+                        FROM sessions
+                        WHERE user_id = $1 AND marathon_id = $2 AND end_time IS NOT NULL
+                        GROUP BY DATE(start_time)
+                        UNION ALL
+                        SELECT day, sessions_count
+                        FROM sessions_archive
+                        WHERE user_id = $1 AND marathon_id = $2
+                    ) days
+                    GROUP BY session_date
+                )
+                SELECT 
+                    COALESCE(SUM(sessions_count), 0) as sessions_count,
+                    COUNT(*) FILTER (WHERE sessions_count >= $3) as completed_days
+                FROM daily
+            ''', user_id, marathon_id, marathon.daily_goal)
             
-            return {
-                'total_days': total_days,
-                'completed_days': completed_days or 0,
-                'sessions_count': sessions_count,
-                'daily_goal': marathon['daily_goal']
-            }
+            return MarathonProgress(
+                total_days=total_days,
+                completed_days=progress['completed_days'] or 0,
+                sessions_count=progress['sessions_count'],
+                daily_goal=marathon.daily_goal
+            )
     
     # Методы для диалогов с AI
     async def save_dialogue_message(self, user_id: int, content: str, is_user: bool):
         """Сохранить сообщение в историю диалога"""
-        async with self.pool.acquire() as conn:
-            await conn.execute('''
-                INSERT INTO dialogue_history (user_id, content, is_user)
-                VALUES ($1, $2, $3)
-            ''', user_id, content, is_user)
+        async with self.acquire('save_dialogue_message') as conn:
+            await conn.execute(SAVE_DIALOGUE_MESSAGE_SQL, user_id, content, is_user)
+        self._mark_write(user_id)
     
-    async def get_dialogue_history(self, user_id: int, limit: int = 20) -> List[Dict[str, Any]]:
+    async def get_dialogue_history(self, user_id: int, limit: int = 20) -> List[DialogueMessage]:
         """Получить историю диалога пользователя"""
-        async with self.pool.acquire() as conn:
-            rows = await conn.fetch('''
-                SELECT content, is_user, created_at
-                FROM dialogue_history
-                WHERE user_id = $1
-                ORDER BY created_at DESC
-                LIMIT $2
-            ''', user_id, limit)
+        async with self.acquire('get_dialogue_history', replica=True, user_id=user_id) as conn:
+            rows = await conn.fetch(DIALOGUE_HISTORY_SQL, user_id, limit)
             # Возвращаем в хронологическом порядке
-            return [dict(row) for row in reversed(rows)]
+            return [DialogueMessage.from_record(row) for row in reversed(rows)]
     
-    async def clear_old_dialogue_history(self, days: int = 30):
-        """Очистить старую историю диалогов"""
-        async with self.pool.acquire() as conn:
-            await conn.execute('''
-                DELETE FROM dialogue_history
-                WHERE created_at < CURRENT_TIMESTAMP - INTERVAL '%s days'
-            ''', days)
+    async def iter_dialogue_batches(self, user_id: int, batch_size: int = 500) -> AsyncIterator[List[DialogueMessage]]:
+        """Вся история диалога пользователя пачками через серверный курсор"""
+        async with self.acquire('iter_dialogue_batches', replica=True, user_id=user_id) as conn:
+            async with conn.transaction(isolation='repeatable_read', readonly=True):
+                cursor = await conn.cursor(DIALOGUE_EXPORT_SQL, user_id)
+                while True:
+                    rows = await cursor.fetch(batch_size)
+                    if not rows:
+                        break
+                    yield [DialogueMessage.from_record(row) for row in rows]
+    
+    async def ensure_dialogue_partitions(self, months_ahead: int = 2):
+        """Создать партиции истории диалогов на ближайшие месяцы"""
+        async with self.acquire('ensure_dialogue_partitions') as conn:
+            await create_dialogue_partitions(conn, date.today(), months_ahead)
+    
+    async def clear_old_dialogue_history(self, days: int = 30) -> int:
+        """Очистить старую историю диалогов.
+        
+        Удаляются только целые месяцы, полностью вышедшие за срок хранения,
+        поэтому очистка - это DROP партиций, а не построчный DELETE.
+        """
+        cutoff = _month_start(date.today() - timedelta(days=days))
+        dropped = 0
+        
+        async with self.acquire('clear_old_dialogue_history') as conn:
+            for name in await list_partitions(conn, 'dialogue_history'):
+                try:
+                    month = datetime.strptime(
+                        name[len(DIALOGUE_PARTITION_PREFIX):], "%Y_%m"
+                    ).date()
+                except ValueError:
+                    continue
+                
+                # Партиция покрывает [month, month + 1), удаляем только истекшие целиком
+                if _add_months(month, 1) <= cutoff:
+                    await conn.execute(f'DROP TABLE IF EXISTS {name}')
+                    dropped += 1
+        
+        if dropped:
+            logger.info("Dropped %d expired dialogue_history partitions", dropped)
+        return dropped
+    
+    # Обслуживание партиций и архива сессий
+    async def ensure_sessions_partitions(self, years_ahead: int = 1):
+        """Создать партиции сессий на текущий и следующие годы"""
+        async with self.acquire('ensure_sessions_partitions') as conn:
+            years = await create_sessions_partitions(conn, date.today(), years_ahead)
+            for year in years:
+                await create_active_session_index(conn, f"{SESSIONS_PARTITION_PREFIX}{year}")
+            self._session_years.update(years)
+    
+    async def archive_old_sessions(self, archive_after_days: int = 730) -> int:
+        """Свернуть старые сессии в архивные сводки.
+        
+        Годовая партиция, целиком вышедшая за горизонт, агрегируется в
+        sessions_archive по (пользователь, день, марафон) и удаляется.
+        Партиция с незавершенными сессиями пропускается: в архив попадают
+        только завершенные, а DROP удалил бы и остальные. Такие сессии
+        закрывает sweep_stale_sessions, и партиция архивируется при
+        следующем запуске.
+        """
+        horizon = date.today() - timedelta(days=archive_after_days)
+        archived = 0
+        
+        async with self.acquire('archive_old_sessions') as conn:
+            for name in await list_partitions(conn, 'sessions'):
+                suffix = name[len(SESSIONS_PARTITION_PREFIX):]
+                if not suffix.isdigit():
+                    continue
+                
+                year = int(suffix)
+                if date(year + 1, 1, 1) > horizon:
+                    continue
+                
+                async with conn.transaction():
+                    # Блокировка сразу под DROP: между проверкой и удалением
+                    # в партицию ничего не запишут
+                    await conn.execute(f'LOCK TABLE {name} IN ACCESS EXCLUSIVE MODE')
+                    open_sessions = await conn.fetchval(
+                        f'SELECT COUNT(*) FROM {name} WHERE end_time IS NULL'
+                    )
+                    if open_sessions:
+                        logger.warning(
+                            "Skipping archive of %s: %d sessions are not finished",
+                            name, open_sessions
+                        )
+                        continue
+                    
+                    await conn.execute(f'''
+                        INSERT INTO sessions_archive (
+                            user_id, day, marathon_id, sessions_count,
+                            total_duration, rating_sum, rating_count, max_rating
+                        )
+                        SELECT 
+                            user_id,
+                            DATE(start_time),
+                            marathon_id,
+                            COUNT(*),
+                            COALESCE(SUM(duration), 0),
+                            COALESCE(SUM(rating), 0),
+                            COUNT(rating),
+                            MAX(rating)
+                        FROM {name}
+                        GROUP BY user_id, DATE(start_time), marathon_id
+                    ''')
+                    await conn.execute(f'DROP TABLE {name}')
+                
+                self._session_years.discard(year)
+                archived += 1
+        
+        if archived:
+            logger.info("Archived %d sessions partitions", archived)
+        return archived
     
     async def close(self):
-        """Закрытие пула соединений"""
+        """Закрытие пулов соединений"""
         if self.pool:
             await self.pool.close()
+        if self.replica_pool:
+            await self.replica_pool.close()
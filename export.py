@@ -0,0 +1,232 @@
+# export.py
+"""Выгрузка личных данных пользователя: сессии и история диалога.
+
+Строки читаются из БД серверным курсором пачками (Database.iter_session_batches,
+Database.iter_dialogue_batches), каждая пачка сразу кодируется и дописывается
+в gzip-файл во временном каталоге, поэтому память не зависит от объема
+истории. Сжатие и запись на диск выполняются в отдельном потоке.
+
+Форматы:
+- csv   - два файла: сессии и диалог;
+- jsonl - один файл, у каждой строки поле type (session или message);
+- ics   - календарь сессий (архивные дни - события на весь день).
+"""
+import asyncio
+import csv
+import gzip
+import io
+import json
+import logging
+import os
+import tempfile
+from contextlib import aclosing, asynccontextmanager
+from datetime import date, datetime, timedelta, timezone
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+from models import DialogueMessage, Session
+
+logger = logging.getLogger(__name__)
+
+# Предел размера документа, который бот может отправить через Bot API
+MAX_DOCUMENT_SIZE = 50 * 1024 * 1024
+
+SESSION_COLUMNS = ("start_time", "end_time", "duration_min", "rating", "comment",
+                   "marathon_id", "sessions_count", "archived")
+DIALOGUE_COLUMNS = ("created_at", "author", "content")
+
+ICS_HEADER = (
+    "BEGIN:VCALENDAR\r\n"
+    "VERSION:2.0\r\n"
+    "PRODID:-//Meditation Bot//Export//RU\r\n"
+    "CALSCALE:GREGORIAN\r\n"
+)
+ICS_FOOTER = "END:VCALENDAR\r\n"
+
+class ExportFile(NamedTuple):
+    path: str
+    filename: str
+    rows: int
+
+# Кодирование пачек
+
+def _csv_text(rows) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue()
+
+def _sessions_csv(batch: List[Session]) -> str:
+    return _csv_text(
+        (s.start_time.isoformat(), s.end_time.isoformat() if s.end_time else "",
+         s.duration, s.rating, s.comment or "", s.marathon_id or "",
+         s.sessions_count, int(s.session_id is None))
+        for s in batch
+    )
+
+def _dialogue_csv(batch: List[DialogueMessage]) -> str:
+    return _csv_text(
+        (m.created_at.isoformat(), "user" if m.is_user else "assistant", m.content)
+        for m in batch
+    )
+
+def _json_lines(items) -> str:
+    return "".join(json.dumps(item, ensure_ascii=False) + "\n" for item in items)
+
+def _sessions_jsonl(batch: List[Session]) -> str:
+    return _json_lines({
+        'type': 'session',
+        'start_time': s.start_time.isoformat(),
+        'end_time': s.end_time.isoformat() if s.end_time else None,
+        'duration_min': s.duration,
+        'rating': s.rating,
+        'comment': s.comment,
+        'marathon_id': s.marathon_id,
+        'sessions_count': s.sessions_count,
+        'archived': s.session_id is None,
+    } for s in batch)
+
+def _dialogue_jsonl(batch: List[DialogueMessage]) -> str:
+    return _json_lines({
+        'type': 'message',
+        'created_at': m.created_at.isoformat(),
+        'author': 'user' if m.is_user else 'assistant',
+        'content': m.content,
+    } for m in batch)
+
+def _ics_escape(text: str) -> str:
+    return (text.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,")
+            .replace("\r\n", "\\n").replace("\n", "\\n"))
+
+def _ics_line(line: str) -> str:
+    """Строка iCalendar со сгибанием по 75 октетов (RFC 5545, 3.1)"""
+    if len(line.encode("utf-8")) <= 75:
+        return line + "\r\n"
+    
+    parts, current, size = [], "", 0
+    for char in line:
+        char_size = len(char.encode("utf-8"))
+        if size + char_size > 75:
+            parts.append(current)
+            # Продолжение начинается с пробела, он тоже входит в 75 октетов
+            current, size = "", 1
+        current += char
+        size += char_size
+    parts.append(current)
+    return "\r\n ".join(parts) + "\r\n"
+
+def _sessions_ics(batch: List[Session]) -> str:
+    # Время в БД локальное, поэтому в календаре оно "плавающее" (без зоны)
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    lines = []
+    for s in batch:
+        if s.session_id is None:
+            day = s.start_time.date()
+            lines += [
+                "BEGIN:VEVENT",
+                f"UID:archive-{s.user_id}-{day:%Y%m%d}@meditation-bot",
+                f"DTSTAMP:{stamp}",
+                f"DTSTART;VALUE=DATE:{day:%Y%m%d}",
+                f"DTEND;VALUE=DATE:{day + timedelta(days=1):%Y%m%d}",
+                f"SUMMARY:Медитации: {s.sessions_count}, {s.duration} мин",
+            ]
+        else:
+            end_time = s.end_time or s.start_time + timedelta(minutes=s.duration or 0)
+            description = f"Оценка: {s.rating}/10" if s.rating is not None else ""
+            if s.comment:
+                description = f"{description}\n{s.comment}" if description else s.comment
+            lines += [
+                "BEGIN:VEVENT",
+                f"UID:session-{s.session_id}@meditation-bot",
+                f"DTSTAMP:{stamp}",
+                f"DTSTART:{s.start_time:%Y%m%dT%H%M%S}",
+                f"DTEND:{end_time:%Y%m%dT%H%M%S}",
+                f"SUMMARY:Медитация {s.duration} мин",
+            ]
+            if description:
+                lines.append(f"DESCRIPTION:{_ics_escape(description)}")
+        lines.append("END:VEVENT")
+    return "".join(_ics_line(line) for line in lines)
+
+class _Part(NamedTuple):
+    """Один файл выгрузки: кодировщики пачек по источникам данных"""
+    name: str
+    encoders: Dict[str, Callable[[list], str]]
+    header: str = ""
+    footer: str = ""
+
+EXPORT_FORMATS: Dict[str, List[_Part]] = {
+    'csv': [
+        _Part("sessions.csv", {'sessions': _sessions_csv}, header=_csv_text([SESSION_COLUMNS])),
+        _Part("dialogue.csv", {'dialogue': _dialogue_csv}, header=_csv_text([DIALOGUE_COLUMNS])),
+    ],
+    'jsonl': [
+        _Part("export.jsonl", {'sessions': _sessions_jsonl, 'dialogue': _dialogue_jsonl}),
+    ],
+    'ics': [
+        _Part("sessions.ics", {'sessions': _sessions_ics}, header=ICS_HEADER, footer=ICS_FOOTER),
+    ],
+}
+
+# Запись
+
+@asynccontextmanager
+async def _gzip_file(directory: Optional[str]):
+    """Временный gzip-файл; при ошибке удаляется"""
+    fd, path = tempfile.mkstemp(prefix="export_", suffix=".gz", dir=directory)
+    os.close(fd)
+    gz = gzip.open(path, "wb")
+    
+    async def write(text: str):
+        if text:
+            await asyncio.to_thread(gz.write, text.encode("utf-8"))
+    
+    try:
+        yield path, write
+    except BaseException:
+        gz.close()
+        os.remove(path)
+        raise
+    await asyncio.to_thread(gz.close)
+
+def remove_export_files(files: List[ExportFile]):
+    for file in files:
+        try:
+            os.remove(file.path)
+        except FileNotFoundError:
+            pass
+
+async def export_user_data(db, user_id: int, fmt: str,
+                           directory: Optional[str] = None) -> List[ExportFile]:
+    """Выгрузить данные пользователя в сжатые файлы формата fmt.
+    
+    Файлы остаются во временном каталоге - после отправки их нужно удалить
+    через remove_export_files.
+    """
+    sources = {
+        'sessions': db.iter_session_batches,
+        'dialogue': db.iter_dialogue_batches,
+    }
+    stamp = date.today().isoformat()
+    files = []
+    
+    try:
+        for part in EXPORT_FORMATS[fmt]:
+            rows = 0
+            async with _gzip_file(directory) as (path, write):
+                await write(part.header)
+                for source, encode in part.encoders.items():
+                    # aclosing: при ошибке соединение с курсором сразу вернется в пул
+                    async with aclosing(sources[source](user_id)) as batches:
+                        async for batch in batches:
+                            await write(encode(batch))
+                            rows += len(batch)
+                await write(part.footer)
+            
+            stem, extension = os.path.splitext(part.name)
+            files.append(ExportFile(path, f"meditation_{stem}_{stamp}{extension}.gz", rows))
+    except BaseException:
+        remove_export_files(files)
+        raise
+    
+    logger.info("Exported %s for user %s: %s", fmt, user_id,
+                ", ".join(f"{f.filename} ({f.rows} rows)" for f in files))
+    return files
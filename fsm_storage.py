@@ -0,0 +1,203 @@
+# fsm_storage.py
+import asyncio
+import json
+import logging
+from datetime import date, datetime
+from typing import Any, Dict, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+UPSERT_STATE_SQL = '''
+    INSERT INTO fsm_states (bot_id, chat_id, user_id, thread_id, destiny, state, data, updated_at)
+    VALUES ($1, $2, $3, $4, $5, $6, $7::jsonb, CURRENT_TIMESTAMP)
+    ON CONFLICT (bot_id, chat_id, user_id, thread_id, destiny)
+    DO UPDATE SET
+        state = EXCLUDED.state,
+        data = EXCLUDED.data,
+        updated_at = EXCLUDED.updated_at
+'''
+
+DELETE_STATE_SQL = '''
+    DELETE FROM fsm_states
+    WHERE bot_id = $1 AND chat_id = $2 AND user_id = $3 AND thread_id = $4 AND destiny = $5
+'''
+
+LOAD_STATE_SQL = '''
+    SELECT state, data FROM fsm_states
+    WHERE bot_id = $1 AND chat_id = $2 AND user_id = $3 AND thread_id = $4 AND destiny = $5
+        AND updated_at > CURRENT_TIMESTAMP - make_interval(secs => $6)
+'''
+
+# Пауза перед повторной записью после ошибки БД
+FLUSH_RETRY_DELAY = 5
+
+# Состояние и данные одного ключа
+Record = Tuple[Optional[str], Dict[str, Any]]
+
+EMPTY_RECORD: Record = (None, {})
+
+def _json_default(value: Any):
+    """Даты в данных FSM (например, даты марафона) сохраняем с пометкой типа"""
+    if isinstance(value, datetime):
+        return {'__datetime__': value.isoformat()}
+    if isinstance(value, date):
+        return {'__date__': value.isoformat()}
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def _json_object_hook(obj: Dict[str, Any]):
+    if len(obj) == 1:
+        if '__datetime__' in obj:
+            return datetime.fromisoformat(obj['__datetime__'])
+        if '__date__' in obj:
+            return date.fromisoformat(obj['__date__'])
+    return obj
+
+def dumps(data: Dict[str, Any]) -> str:
+    return json.dumps(data, default=_json_default, ensure_ascii=False)
+
+def loads(raw: str) -> Dict[str, Any]:
+    return json.loads(raw, object_hook=_json_object_hook)
+
+class PostgresStorage(BaseStorage):
+    """Хранилище FSM в PostgreSQL с пакетной записью изменений.
+    
+    Изменения за время обработки обновления копятся в памяти и записываются
+    в БД одним пакетом, когда обработчик закончил работу
+    (middlewares.fsm_flush.FSMFlushMiddleware вызывает flush). Следующее
+    обновление пользователя, в том числе в другом процессе, уже видит их.
+    Изменения вне обработки обновлений нужно записывать вызовом flush().
+    Состояния, не менявшиеся дольше state_ttl секунд, считаются устаревшими
+    и не загружаются.
+    
+    По умолчанию состояние читается из БД каждый раз. cache_ttl > 0 включает
+    LRU-кэш чтения, но кэш не узнает об изменениях из других процессов, поэтому
+    подходит, только когда бот работает в одном процессе.
+    """
+    
+    def __init__(self, db, *,
+                 state_ttl: float = 86400,
+                 cache_size: int = 10000,
+                 cache_ttl: float = 0):
+        self.db = db
+        self.state_ttl = state_ttl
+        self.cache_ttl = cache_ttl
+        self._cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self._dirty: Dict[StorageKey, Record] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+    
+    @staticmethod
+    def _key_args(key: StorageKey) -> tuple:
+        return (key.bot_id, key.chat_id, key.user_id, key.thread_id or 0, key.destiny)
+    
+    async def _load(self, key: StorageKey) -> Record:
+        """Текущая запись: несохраненные изменения, затем кэш, затем БД"""
+        if key in self._dirty:
+            return self._dirty[key]
+        
+        if self.cache_ttl > 0:
+            record = self._cache.get(key)
+            if record is not None:
+                return record
+        
+        async with self.db.acquire('fsm_storage.load') as conn:
+            row = await conn.fetchrow(LOAD_STATE_SQL, *self._key_args(key), float(self.state_ttl))
+        
+        record = (row['state'], loads(row['data'])) if row else EMPTY_RECORD
+        # Пока шел запрос, запись могла измениться - не затираем ее
+        if key in self._dirty:
+            return self._dirty[key]
+        if self.cache_ttl > 0:
+            self._cache.set(key, record)
+        return record
+    
+    def _store(self, key: StorageKey, record: Record):
+        """Обновить кэш и отметить запись для ближайшего flush"""
+        self._dirty[key] = record
+        if self.cache_ttl > 0:
+            self._cache.set(key, record)
+    
+    def _schedule_flush(self, delay: float):
+        """Повторить запись после ошибки БД"""
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush(delay))
+    
+    async def _delayed_flush(self, delay: float):
+        await asyncio.sleep(delay)
+        self._flush_task = None
+        await self.flush()
+    
+    def _requeue(self, batch: Dict[StorageKey, Record]):
+        """Вернуть неудачный пакет, не затирая более новые изменения"""
+        for key, record in batch.items():
+            self._dirty.setdefault(key, record)
+    
+    async def flush(self):
+        """Записать накопленные изменения одним пакетом"""
+        if not self._dirty:
+            return
+        
+        batch, self._dirty = self._dirty, {}
+        upserts = []
+        deletes = []
+        for key, (state, data) in batch.items():
+            if state is None and not data:
+                deletes.append(self._key_args(key))
+            else:
+                upserts.append((*self._key_args(key), state, dumps(data)))
+        
+        try:
+            async with self.db.acquire('fsm_storage.flush') as conn:
+                async with conn.transaction():
+                    if upserts:
+                        await conn.executemany(UPSERT_STATE_SQL, upserts)
+                    if deletes:
+                        await conn.executemany(DELETE_STATE_SQL, deletes)
+        except asyncio.CancelledError:
+            self._requeue(batch)
+            raise
+        except Exception as e:
+            logger.error("Error flushing FSM states: %s", e)
+            self._requeue(batch)
+            self._schedule_flush(FLUSH_RETRY_DELAY)
+    
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        _, data = await self._load(key)
+        state_name = state.state if isinstance(state, State) else state
+        self._store(key, (state_name, data))
+    
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self._load(key)
+        return state
+    
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        state, _ = await self._load(key)
+        self._store(key, (state, data.copy()))
+    
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self._load(key)
+        return data.copy()
+    
+    async def purge_expired(self) -> int:
+        """Удалить из БД состояния старше state_ttl. Возвращает число строк"""
+        async with self.db.acquire('fsm_storage.purge_expired') as conn:
+            result = await conn.execute('''
+                DELETE FROM fsm_states
+                WHERE updated_at < CURRENT_TIMESTAMP - make_interval(secs => $1)
+            ''', float(self.state_ttl))
+        return int(result.split()[-1])
+    
+    async def close(self) -> None:
+        """Сбросить несохраненные изменения перед остановкой"""
+        if self._flush_task and not self._flush_task.done():
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+        self._cache.clear()
@@ -44,8 +44,8 @@ async def process_dialogue(message: types.Message, state: FSMContext, db, ai):
     # Формируем контекст
     context = ""
     for msg in history:
-        role = "Пользователь" if msg['is_user'] else "Ассистент"
-        context += f"{role}: {msg['content']}\n"
+        role = "Пользователь" if msg.is_user else "Ассистент"
+        context += f"{role}: {msg.content}\n"
     
     # Генерируем ответ
     response = await ai.generate_dialogue_response(
@@ -210,15 +210,15 @@ async def delete_meditation(message: types.Message, db):
     keyboard = InlineKeyboardBuilder()
     
     for i, session in enumerate(sessions, 1):
-        date = session['start_time'].strftime("%d.%m.%Y %H:%M")
-        button_text = f"{i}. {date} ({session['duration']} мин)"
+        date = session.start_time.strftime("%d.%m.%Y %H:%M")
+        button_text = f"{i}. {date} ({session.duration} мин)"
         
         text += f"{i}. {date}\n"
-        text += f"   ⏱️ {session['duration']} мин | ⭐ {session['rating']}/10\n\n"
+        text += f"   ⏱️ {session.duration} мин | ⭐ {session.rating}/10\n\n"
         
         keyboard.button(
             text=button_text,
-            callback_data=f"delete_session_{session['session_id']}"
+            callback_data=f"delete_session_{session.session_id}"
         )
     
     keyboard.adjust(1)
@@ -244,14 +244,14 @@ async def confirm_delete_session(callback: types.CallbackQuery, db):
     
     text = (
         "⚠️ *Подтвердите удаление:*\n\n"
-        f"📅 {session['start_time'].strftime('%d.%m.%Y %H:%M')}\n"
-        f"⏱️ {session['duration']} минут\n"
-        f"⭐ Оценка: {session['rating']}/10\n"
+        f"📅 {session.start_time.strftime('%d.%m.%Y %H:%M')}\n"
+        f"⏱️ {session.duration} минут\n"
+        f"⭐ Оценка: {session.rating}/10\n"
     )
     
-    if session['comment']:
-        comment_preview = session['comment'][:50]
-        if len(session['comment']) > 50:
+    if session.comment:
+        comment_preview = session.comment[:50]
+        if len(session.comment) > 50:
             comment_preview += "..."
         text += f"💭 {comment_preview}\n"
     
@@ -281,33 +281,38 @@ async def process_delete_session(callback: types.CallbackQuery, db):
     
     await callback.answer()
 
-async def show_progress_analysis(callback: types.CallbackQuery, db, ai):
+async def show_progress_analysis(callback: types.CallbackQuery, db, ai, analytics):
     """Показать анализ прогресса от AI"""
     user_id = callback.from_user.id
     
     # Получаем статистику пользователя
     stats = await db.get_user_stats(user_id)
     monthly_stats = await db.get_monthly_stats(user_id)
-    recent_sessions = await db.get_user_sessions(user_id, limit=10)
+    
+    # Аналитика по всей истории (из кэша, если сессии не менялись)
+    report = await analytics.get_report(user_id, stats)
     
     # Формируем данные для анализа
     analysis_data = {
-        'total_sessions': stats['total_sessions'],
-        'total_duration': stats['total_duration'],
-        'avg_rating': stats['avg_rating'],
-        'monthly_sessions': monthly_stats['sessions_count'],
-        'monthly_avg_rating': monthly_stats['avg_rating'],
-        'recent_sessions': recent_sessions
+        'monthly_sessions': monthly_stats.sessions_count,
+        'monthly_avg_rating': monthly_stats.avg_rating,
+        'report': report
     }
     
     # Генерируем анализ через AI
     analysis = await ai.get_progress_analysis(analysis_data)
     
     text = "📊 *Анализ вашего прогресса*\n\n"
-    text += f"🧘 Всего медитаций: {stats['total_sessions']}\n"
-    text += f"⏱️ Общее время: {stats['total_duration']} минут\n"
-    text += f"⭐ Средняя оценка: {stats['avg_rating']:.1f}/10\n"
-    text += f"📅 За месяц: {monthly_stats['sessions_count']} медитаций\n\n"
+    text += f"🧘 Всего медитаций: {stats.total_sessions}\n"
+    text += f"⏱️ Общее время: {stats.total_duration} минут\n"
+    text += f"⭐ Средняя оценка: {stats.avg_rating:.1f}/10\n"
+    text += f"📅 За месяц: {monthly_stats.sessions_count} медитаций\n"
+    if report.rolling_short is not None:
+        text += f"📈 Последние 7: {report.rolling_short:.1f}/10\n"
+    best_time = report.best(report.time_of_day)
+    if best_time:
+        text += f"🕐 Лучше всего получается {best_time.label}\n"
+    text += "\n"
     text += f"🤖 *AI-анализ:*\n{analysis}"
     
     # Кнопка возврата
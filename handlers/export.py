@@ -0,0 +1,54 @@
+# handlers/export.py
+import os
+
+from aiogram import types
+from aiogram.types import FSInputFile
+
+from export import EXPORT_FORMATS, MAX_DOCUMENT_SIZE, export_user_data, remove_export_files
+
+# Пользователи, для которых выгрузка уже готовится
+_active_exports = set()
+
+async def export_data(message: types.Message, db):
+    """Выгрузка сессий и диалога: /export [csv|jsonl|ics]"""
+    user_id = message.from_user.id
+    args = message.text.split()[1:]
+    fmt = args[0].lower() if args else "csv"
+    
+    if fmt not in EXPORT_FORMATS:
+        await message.answer(
+            "📦 Выгрузка ваших данных:\n"
+            "/export csv - таблицы сессий и диалога\n"
+            "/export jsonl - все записи, по одной на строку\n"
+            "/export ics - календарь медитаций"
+        )
+        return
+    
+    if user_id in _active_exports:
+        await message.answer("⏳ Выгрузка уже готовится, подождите.")
+        return
+    
+    _active_exports.add(user_id)
+    try:
+        await message.answer("📦 Готовлю выгрузку...")
+        files = await export_user_data(db, user_id, fmt)
+        try:
+            if not any(file.rows for file in files):
+                await message.answer("Пока нечего выгружать.")
+                return
+            
+            for file in files:
+                if not file.rows:
+                    continue
+                if os.path.getsize(file.path) > MAX_DOCUMENT_SIZE:
+                    await message.answer(f"❗ Файл {file.filename} слишком большой для отправки.")
+                    continue
+                
+                await message.answer_document(
+                    FSInputFile(file.path, filename=file.filename),
+                    caption=f"Записей: {file.rows}"
+                )
+        finally:
+            remove_export_files(files)
+    finally:
+        _active_exports.discard(user_id)
@@ -4,6 +4,7 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder
 from datetime import datetime, timedelta, date
 
 from keyboards import get_history_keyboard, get_calendar_keyboard
+from utils import average_rating, format_rating
 
 async def meditation_history(message: types.Message, db):
     """История медитаций"""
@@ -16,7 +17,7 @@ async def meditation_history(message: types.Message, db):
     
     # Получаем общую статистику
     stats = await db.get_user_stats(user_id)
-    total_sessions = stats['total_sessions']
+    total_sessions = stats.total_sessions
     
     # Получаем статистику за последние 30 дней
     monthly_stats = await db.get_monthly_stats(user_id)
@@ -24,19 +25,19 @@ async def meditation_history(message: types.Message, db):
     text = "📖 *История медитаций*\n\n"
     text += f"📊 *Общая статистика:*\n"
     text += f"• Всего медитаций: {total_sessions}\n"
-    text += f"• За последние 30 дней: {monthly_stats['sessions_count']}\n"
-    text += f"• Средняя оценка за месяц: {monthly_stats['avg_rating']:.1f}/10\n"
-    text += f"• Всего времени: {stats['total_duration']} мин\n\n"
+    text += f"• За последние 30 дней: {monthly_stats.sessions_count}\n"
+    text += f"• Средняя оценка за месяц: {monthly_stats.avg_rating:.1f}/10\n"
+    text += f"• Всего времени: {stats.total_duration} мин\n\n"
     
     text += f"*Последние 15 медитаций:*\n\n"
     
     for session in sessions:
-        date = session['start_time'].strftime("%d.%m.%Y %H:%M")
+        date = session.start_time.strftime("%d.%m.%Y %H:%M")
         text += f"🧘 {date}\n"
-        text += f"   ⏱️ {session['duration']} мин | ⭐ {session['rating']}/10\n"
-        if session['comment']:
+        text += f"   ⏱️ {session.duration} мин | ⭐ {session.rating}/10\n"
+        if session.comment:
             # Умная обрезка комментария
-            comment = session['comment']
+            comment = session.comment
             if len(comment) > 100:
                 # Обрезаем до последнего пробела перед 100 символом
                 cut_pos = comment[:100].rfind(' ')
@@ -62,38 +63,38 @@ async def show_calendar(callback: types.CallbackQuery, db):
     # Создаем словарь с данными по дням
     sessions_by_day = {}
     for session in sessions:
-        day = session['start_time'].day
+        day = session.start_time.day
         if day not in sessions_by_day:
             sessions_by_day[day] = {
-                'ratings': [],
+                'sessions': [],
                 'count': 0,
                 'total_duration': 0
             }
-        sessions_by_day[day]['ratings'].append(session['rating'])
-        sessions_by_day[day]['count'] += 1
-        sessions_by_day[day]['total_duration'] += session['duration']
+        sessions_by_day[day]['sessions'].append(session)
+        sessions_by_day[day]['count'] += session.sessions_count
+        sessions_by_day[day]['total_duration'] += session.duration
     
     # Вычисляем средние оценки
     for day, data in sessions_by_day.items():
-        data['avg_rating'] = sum(data['ratings']) / len(data['ratings'])
+        data['avg_rating'] = average_rating(data['sessions'])
     
     # Формируем текст
     text = "📅 *Календарь медитаций*\n\n"
-    text += "✅ 8-10 баллов | 🔶 5-7 баллов | ❌ 1-4 балла\n"
+    text += "✅ 8-10 баллов | 🔶 5-7 баллов | ❌ 1-4 балла | ⚪ без оценки\n"
     text += "_Цифра - количество медитаций за день_\n\n"
     
     # Статистика месяца
     if sessions:
-        total_sessions = len(sessions)
-        total_duration = sum(s['duration'] for s in sessions)
-        avg_rating = sum(s['rating'] for s in sessions) / total_sessions
+        total_sessions = sum(s.sessions_count for s in sessions)
+        total_duration = sum(s.duration for s in sessions)
+        avg_rating = average_rating(sessions)
         days_with_practice = len(sessions_by_day)
         
         text += f"*Статистика {now.strftime('%B %Y')}:*\n"
         text += f"• Медитаций: {total_sessions}\n"
         text += f"• Дней с практикой: {days_with_practice}\n"
         text += f"• Общее время: {total_duration} мин\n"
-        text += f"• Средняя оценка: {avg_rating:.1f}/10\n"
+        text += f"• Средняя оценка: {format_rating(avg_rating)}\n"
     
     keyboard = get_calendar_keyboard(now.year, now.month, sessions_by_day, from_history=True)
     
@@ -107,22 +108,22 @@ async def show_day_details(callback: types.CallbackQuery, db):
     
     stats = await db.get_daily_stats(callback.from_user.id, selected_date)
     
-    if not stats or stats['sessions_count'] == 0:
+    if not stats or stats.sessions_count == 0:
         await callback.answer("В этот день не было медитаций", show_alert=True)
         return
     
     text = f"📅 *Медитации за {selected_date.strftime('%d.%m.%Y')}*\n\n"
-    text += f"Всего сессий: {stats['sessions_count']}\n"
-    text += f"Общее время: {stats['total_duration']} минут\n"
-    text += f"Средняя оценка: {stats['avg_rating']:.1f}/10\n\n"
+    text += f"Всего сессий: {stats.sessions_count}\n"
+    text += f"Общее время: {stats.total_duration} минут\n"
+    text += f"Средняя оценка: {stats.avg_rating:.1f}/10\n\n"
     
-    for i, session in enumerate(stats['sessions'], 1):
-        time = session['start_time'].strftime("%H:%M")
+    for i, session in enumerate(stats.sessions, 1):
+        time = session.start_time.strftime("%H:%M")
         text += f"*Сессия {i} ({time})*\n"
-        text += f"⏱️ Продолжительность: {session['duration']} мин\n"
-        text += f"⭐ Оценка: {session['rating']}/10\n"
-        if session['comment']:
-            text += f"💭 Комментарий: {session['comment']}\n"
+        text += f"⏱️ Продолжительность: {session.duration} мин\n"
+        text += f"⭐ Оценка: {session.rating}/10\n"
+        if session.comment:
+            text += f"💭 Комментарий: {session.comment}\n"
         text += "\n"
     
     # Кнопка возврата к календарю
@@ -157,20 +158,20 @@ async def navigate_calendar(callback: types.CallbackQuery, db):
     # Создаем словарь с данными по дням
     sessions_by_day = {}
     for session in sessions:
-        day = session['start_time'].day
+        day = session.start_time.day
         if day not in sessions_by_day:
             sessions_by_day[day] = {
-                'ratings': [],
+                'sessions': [],
                 'count': 0,
                 'total_duration': 0
             }
-        sessions_by_day[day]['ratings'].append(session['rating'])
-        sessions_by_day[day]['count'] += 1
-        sessions_by_day[day]['total_duration'] += session['duration']
+        sessions_by_day[day]['sessions'].append(session)
+        sessions_by_day[day]['count'] += session.sessions_count
+        sessions_by_day[day]['total_duration'] += session.duration
     
     # Вычисляем средние оценки
     for day, data in sessions_by_day.items():
-        data['avg_rating'] = sum(data['ratings']) / len(data['ratings'])
+        data['avg_rating'] = average_rating(data['sessions'])
     
     # Обновляем календарь
     month_names = {
@@ -180,19 +181,19 @@ async def navigate_calendar(callback: types.CallbackQuery, db):
     }
     
     text = f"📅 *Календарь медитаций - {month_names[month]} {year}*\n\n"
-    text += "✅ 8-10 баллов | 🔶 5-7 баллов | ❌ 1-4 балла\n\n"
+    text += "✅ 8-10 баллов | 🔶 5-7 баллов | ❌ 1-4 балла | ⚪ без оценки\n\n"
     
     if sessions:
-        total_sessions = len(sessions)
-        total_duration = sum(s['duration'] for s in sessions)
-        avg_rating = sum(s['rating'] for s in sessions) / total_sessions
+        total_sessions = sum(s.sessions_count for s in sessions)
+        total_duration = sum(s.duration for s in sessions)
+        avg_rating = average_rating(sessions)
         days_with_practice = len(sessions_by_day)
         
         text += f"*Статистика месяца:*\n"
         text += f"• Медитаций: {total_sessions}\n"
         text += f"• Дней с практикой: {days_with_practice}\n"
         text += f"• Общее время: {total_duration} мин\n"
-        text += f"• Средняя оценка: {avg_rating:.1f}/10\n"
+        text += f"• Средняя оценка: {format_rating(avg_rating)}\n"
     else:
         text += "В этом месяце медитаций не было\n"
     
@@ -208,28 +209,28 @@ async def show_week_history(callback: types.CallbackQuery, db):
     
     # Получаем сессии за неделю
     sessions = await db.get_user_sessions(user_id, limit=50)  # Берем больше, потом отфильтруем
-    week_sessions = [s for s in sessions if s['start_time'] >= week_ago]
+    week_sessions = [s for s in sessions if s.start_time >= week_ago]
     
     if not week_sessions:
         await callback.answer("За последнюю неделю не было медитаций", show_alert=True)
         return
     
     # Считаем статистику
-    total_duration = sum(s['duration'] for s in week_sessions)
-    avg_rating = sum(s['rating'] for s in week_sessions) / len(week_sessions)
-    days_with_meditation = len(set(s['start_time'].date() for s in week_sessions))
+    total_duration = sum(s.duration for s in week_sessions)
+    avg_rating = average_rating(week_sessions)
+    days_with_meditation = len(set(s.start_time.date() for s in week_sessions))
     
     text = "📊 *Медитации за последнюю неделю*\n\n"
     text += f"📈 *Статистика:*\n"
     text += f"• Всего медитаций: {len(week_sessions)}\n"
     text += f"• Дней с практикой: {days_with_meditation}/7\n"
     text += f"• Общее время: {total_duration} минут\n"
-    text += f"• Средняя оценка: {avg_rating:.1f}/10\n\n"
+    text += f"• Средняя оценка: {format_rating(avg_rating)}\n\n"
     
     text += "*Детали:*\n"
     for session in week_sessions[:10]:  # Показываем только 10 последних
-        date = session['start_time'].strftime("%d.%m %H:%M")
-        text += f"• {date} - {session['duration']} мин, ⭐ {session['rating']}/10\n"
+        date = session.start_time.strftime("%d.%m %H:%M")
+        text += f"• {date} - {session.duration} мин, ⭐ {session.rating}/10\n"
     
     if len(week_sessions) > 10:
         text += f"\n_...и еще {len(week_sessions) - 10} медитаций_"
@@ -248,21 +249,21 @@ async def show_month_history(callback: types.CallbackQuery, db):
     
     # Получаем сессии за месяц
     sessions = await db.get_user_sessions(user_id, limit=100)
-    month_sessions = [s for s in sessions if s['start_time'] >= month_ago]
+    month_sessions = [s for s in sessions if s.start_time >= month_ago]
     
     if not month_sessions:
         await callback.answer("За последний месяц не было медитаций", show_alert=True)
         return
     
     # Считаем статистику
-    total_duration = sum(s['duration'] for s in month_sessions)
-    avg_rating = sum(s['rating'] for s in month_sessions) / len(month_sessions)
-    days_with_meditation = len(set(s['start_time'].date() for s in month_sessions))
+    total_duration = sum(s.duration for s in month_sessions)
+    avg_rating = average_rating(month_sessions)
+    days_with_meditation = len(set(s.start_time.date() for s in month_sessions))
     
     # Группируем по неделям
     weeks = {}
     for session in month_sessions:
-        week_num = session['start_time'].isocalendar()[1]
+        week_num = session.start_time.isocalendar()[1]
         if week_num not in weeks:
             weeks[week_num] = []
         weeks[week_num].append(session)
@@ -272,16 +273,16 @@ async def show_month_history(callback: types.CallbackQuery, db):
     text += f"• Всего медитаций: {len(month_sessions)}\n"
     text += f"• Дней с практикой: {days_with_meditation}/30\n"
     text += f"• Общее время: {total_duration} минут\n"
-    text += f"• Средняя оценка: {avg_rating:.1f}/10\n\n"
+    text += f"• Средняя оценка: {format_rating(avg_rating)}\n\n"
     
     text += "*По неделям:*\n"
     for week_num, week_sessions in sorted(weeks.items(), reverse=True):
-        week_total = sum(s['duration'] for s in week_sessions)
-        week_avg = sum(s['rating'] for s in week_sessions) / len(week_sessions)
+        week_total = sum(s.duration for s in week_sessions)
+        week_avg = average_rating(week_sessions)
         text += f"\n📅 Неделя {week_num}:\n"
         text += f"   • Медитаций: {len(week_sessions)}\n"
         text += f"   • Время: {week_total} мин\n"
-        text += f"   • Средняя оценка: {week_avg:.1f}/10\n"
+        text += f"   • Средняя оценка: {format_rating(week_avg)}\n"
     
     # Кнопка возврата
     builder = InlineKeyboardBuilder()
@@ -290,6 +291,18 @@ async def show_month_history(callback: types.CallbackQuery, db):
     await callback.message.edit_text(text, parse_mode="Markdown", reply_markup=builder.as_markup())
     await callback.answer()
 
+async def show_charts(callback: types.CallbackQuery, charts):
+    """Показать графики: тепловую карту за год и тренды по неделям"""
+    chart_list = await charts.get_charts(callback.from_user.id)
+    
+    if not chart_list:
+        await callback.answer("Пока нет медитаций для графиков", show_alert=True)
+        return
+    
+    await callback.answer()
+    for chart in chart_list:
+        await charts.send(callback.message, chart)
+
 async def back_to_history(callback: types.CallbackQuery, db):
     """Вернуться к истории медитаций"""
     # Получаем данные для истории
@@ -303,7 +316,7 @@ async def back_to_history(callback: types.CallbackQuery, db):
     
     # Получаем общую статистику
     stats = await db.get_user_stats(user_id)
-    total_sessions = stats['total_sessions']
+    total_sessions = stats.total_sessions
     
     # Получаем статистику за последние 30 дней
     monthly_stats = await db.get_monthly_stats(user_id)
@@ -311,19 +324,19 @@ async def back_to_history(callback: types.CallbackQuery, db):
     text = "📖 *История медитаций*\n\n"
     text += f"📊 *Общая статистика:*\n"
     text += f"• Всего медитаций: {total_sessions}\n"
-    text += f"• За последние 30 дней: {monthly_stats['sessions_count']}\n"
-    text += f"• Средняя оценка за месяц: {monthly_stats['avg_rating']:.1f}/10\n"
-    text += f"• Всего времени: {stats['total_duration']} мин\n\n"
+    text += f"• За последние 30 дней: {monthly_stats.sessions_count}\n"
+    text += f"• Средняя оценка за месяц: {monthly_stats.avg_rating:.1f}/10\n"
+    text += f"• Всего времени: {stats.total_duration} мин\n\n"
     
     text += f"*Последние 15 медитаций:*\n\n"
     
     for session in sessions:
-        date = session['start_time'].strftime("%d.%m.%Y %H:%M")
+        date = session.start_time.strftime("%d.%m.%Y %H:%M")
         text += f"🧘 {date}\n"
-        text += f"   ⏱️ {session['duration']} мин | ⭐ {session['rating']}/10\n"
-        if session['comment']:
+        text += f"   ⏱️ {session.duration} мин | ⭐ {session.rating}/10\n"
+        if session.comment:
             # Умная обрезка комментария
-            comment = session['comment']
+            comment = session.comment
             if len(comment) > 100:
                 cut_pos = comment[:100].rfind(' ')
                 if cut_pos > 80:
@@ -25,15 +25,15 @@ async def join_marathon(message: types.Message, db):
     keyboard = types.InlineKeyboardMarkup(inline_keyboard=[])
     
     for marathon in marathons:
-        text += f"📌 *{marathon['title']}*\n"
-        text += f"📅 {marathon['start_date']} - {marathon['end_date']}\n"
-        text += f"🎯 Цель: {marathon['daily_goal']} медитаций в день\n"
-        text += f"📝 {marathon['description']}\n\n"
+        text += f"📌 *{marathon.title}*\n"
+        text += f"📅 {marathon.start_date} - {marathon.end_date}\n"
+        text += f"🎯 Цель: {marathon.daily_goal} медитаций в день\n"
+        text += f"📝 {marathon.description}\n\n"
         
         keyboard.inline_keyboard.append([
             types.InlineKeyboardButton(
-                text=f"Присоединиться к «{marathon['title']}»",
-                callback_data=f"join_marathon_{marathon['marathon_id']}"
+                text=f"Присоединиться к «{marathon.title}»",
+                callback_data=f"join_marathon_{marathon.marathon_id}"
             )
         ])
     
@@ -55,9 +55,9 @@ async def process_marathon_join(callback: types.CallbackQuery, db):
     marathon = await db.get_marathon(marathon_id)
     
     await callback.message.edit_text(
-        f"✅ Вы присоединились к марафону «{marathon['title']}»!\n\n"
-        f"🎯 Ваша цель: {marathon['daily_goal']} медитаций в день\n"
-        f"📅 До конца марафона: {(marathon['end_date'] - datetime.now().date()).days} дней\n\n"
+        f"✅ Вы присоединились к марафону «{marathon.title}»!\n\n"
+        f"🎯 Ваша цель: {marathon.daily_goal} медитаций в день\n"
+        f"📅 До конца марафона: {(marathon.end_date - datetime.now().date()).days} дней\n\n"
         "Удачи в практике! 🧘"
     )
     await callback.answer()
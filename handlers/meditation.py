@@ -1,8 +1,7 @@
 # handlers/meditation.py
 from aiogram import types, F
 from aiogram.fsm.context import FSMContext
-from datetime import datetime
-
+from database import ActiveSessionExists
 from keyboards import get_main_keyboard, get_rating_keyboard
 from states import MeditationStates
 
@@ -10,27 +9,17 @@ async def start_meditation(message: types.Message, db, config):
     """Начало медитации"""
     user_id = message.from_user.id
     
-    # Проверяем, нет ли активной медитации
-    active_session = await db.get_active_session(user_id)
-    if active_session:
+    # Создаем новую сессию (она сама привяжется к текущему марафону).
+    # Активная медитация проверяется по реестру и уникальному индексу
+    try:
+        await db.create_session(user_id)
+    except ActiveSessionExists:
         await message.answer(
             "❗ У вас уже есть активная медитация.\n"
             "Завершите её перед началом новой."
         )
         return
     
-    # Проверяем, в каком марафоне участвует пользователь
-    user_marathons = await db.get_user_marathons(user_id)
-    active_marathon_id = None
-    
-    for marathon in user_marathons:
-        if marathon['start_date'] <= datetime.now().date() <= marathon['end_date']:
-            active_marathon_id = marathon['marathon_id']
-            break
-    
-    # Создаем новую сессию
-    session_id = await db.create_session(user_id, active_marathon_id)
-    
     await message.answer(
         "🧘 Медитация начата!\n\n"
         "Сосредоточьтесь на практике.\n"
@@ -51,11 +40,25 @@ async def end_meditation(message: types.Message, state: FSMContext, db, config):
         )
         return
     
-    # Завершаем сессию
-    duration = await db.end_session(session['session_id'])
+    # Записываем время окончания сразу, комментарий и оценка - после опроса
+    stopped = await db.stop_session(session)
+    if stopped is None:
+        # Реестр процесса устарел: сверяемся с БД (сессию мог начать другой процесс)
+        session = await db.get_active_session(user_id)
+        stopped = await db.stop_session(session) if session else None
+    if stopped is None:
+        await message.answer(
+            "❗ Эта медитация уже была закрыта автоматически.",
+            reply_markup=get_main_keyboard(is_admin=message.from_user.id in config.ADMIN_IDS)
+        )
+        return
+    duration = stopped.duration
     
     # Сохраняем данные в состояние
-    await state.update_data(session_id=session['session_id'], duration=duration)
+    await state.update_data(
+        session_id=stopped.session_id,
+        duration=duration
+    )
     
     await message.answer(
         f"✅ Медитация завершена!\n"
@@ -64,14 +67,10 @@ async def end_meditation(message: types.Message, state: FSMContext, db, config):
     )
     await state.set_state(MeditationStates.waiting_for_comment)
 
-async def process_comment(message: types.Message, state: FSMContext, db):
+async def process_comment(message: types.Message, state: FSMContext):
     """Обработка комментария"""
-    comment = message.text
-    data = await state.get_data()
-    
-    # Сохраняем комментарий
-    await db.update_session_comment(data['session_id'], comment)
-    await state.update_data(comment=comment)
+    # Сохраняем комментарий до оценки
+    await state.update_data(comment=message.text)
     
     await message.answer(
         "Спасибо за отзыв!\n\n"
@@ -85,8 +84,10 @@ async def process_rating(callback: types.CallbackQuery, state: FSMContext, db, a
     rating = int(callback.data.split("_")[1])
     data = await state.get_data()
     
-    # Сохраняем оценку
-    await db.update_session_rating(data['session_id'], rating)
+    # Записываем комментарий и оценку одним запросом
+    saved = await db.finalize_session(
+        data['session_id'], comment=data['comment'], rating=rating
+    )
     
     # Генерируем отзыв от ИИ
     ai_feedback = await ai.generate_feedback(
@@ -102,7 +103,8 @@ async def process_rating(callback: types.CallbackQuery, state: FSMContext, db, a
     )
     
     await callback.message.answer(
-        "Отлично! Ваша медитация сохранена.",
+        "Отлично! Ваша медитация сохранена." if saved
+        else "❗ Эта медитация не найдена - возможно, она была удалена.",
         reply_markup=get_main_keyboard(is_admin=callback.from_user.id in config.ADMIN_IDS)
     )
     
@@ -28,7 +28,7 @@ source $VENV_DIR/bin/activate
 # 3. Обновление pip и установка зависимостей
 echo -e "\n${GREEN}3. Установка зависимостей...${NC}"
 pip install --upgrade pip
-pip install aiogram==3.3.0 asyncpg==0.29.0 aiohttp==3.9.1 python-dotenv==1.0.0 pytz==2024.1
+pip install aiogram==3.3.0 asyncpg==0.29.0 aiohttp==3.9.1 python-dotenv==1.0.0 pytz==2024.1 numpy==1.26.4 matplotlib==3.8.2
 
 # 4. Установка PostgreSQL если нужно
 echo -e "\n${GREEN}4. Проверка PostgreSQL...${NC}"
@@ -204,6 +204,8 @@ asyncpg==0.29.0
 aiohttp==3.9.1
 python-dotenv==1.0.0
 pytz==2024.1
+numpy==1.26.4
+matplotlib==3.8.2
 EOF
 
 # 10. Инструкции по завершению установки
@@ -72,8 +72,9 @@ def get_history_keyboard() -> types.InlineKeyboardMarkup:
     builder.button(text="📅 Календарь", callback_data="show_calendar")
     builder.button(text="📊 За неделю", callback_data="history_week")
     builder.button(text="📈 За месяц", callback_data="history_month")
+    builder.button(text="📈 Графики", callback_data="history_charts")
     
-    builder.adjust(3)
+    builder.adjust(3, 1)
     
     return builder.as_markup()
 
@@ -117,7 +118,9 @@ def get_calendar_keyboard(year: int, month: int, user_sessions: dict = None, fro
             count = user_sessions[day]['count']
             
             # Выбираем эмодзи по средней оценке (компактные символы)
-            if avg_rating >= 8:
+            if avg_rating is None:
+                emoji = "⚪"
+            elif avg_rating >= 8:
                 emoji = "✅"
             elif avg_rating >= 5:
                 emoji = "🔶"  
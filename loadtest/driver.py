@@ -0,0 +1,290 @@
+# loadtest/driver.py
+"""Нагрузочный тест бота целиком, без Telegram.
+
+Поднимает заглушку Bot API (loadtest/fake_bot_api.py) и с заданной частотой
+запускает сценарии виртуальных пользователей: медитация с оценкой, листание
+календаря, диалог с ИИ, вступление в марафон. Бот - настоящий bot.py,
+подключенный к заглушке через TELEGRAM_API_URL (--spawn-bot запускает его
+сам). В отчете: обновлений в секунду, перцентили времени обработки по шагам
+и число вызовов Bot API.
+
+    python -m loadtest.driver --spawn-bot --users 200 --rate 20 --duration 60
+
+Ограничения частоты бота стоит поднять (THROTTLE_*), иначе часть шагов
+останется без ответа. --spawn-bot делает это сам.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from loadtest import mock_llm
+from loadtest.fake_bot_api import FakeBotAPI, start_server
+
+logger = logging.getLogger(__name__)
+
+# Виртуальные пользователи; не пересекаются с bench.seed
+FIRST_USER_ID = 8_000_000_000
+FAKE_BOT_TOKEN = "100000:loadtest"
+
+# Шаги сценария: ("text", текст), ("callback", data) или
+# ("button", префикс) - нажать inline-кнопку из последнего ответа бота
+JOURNEYS: Dict[str, List[Tuple[str, str]]] = {
+    "meditation": [
+        ("text", "🧘 Начать медитацию"),
+        ("text", "⏹️ Завершить медитацию"),
+        ("text", "Спокойная практика, немного отвлекался"),
+        ("button", "rating_"),
+    ],
+    "calendar": [
+        ("text", "📖 История медитаций"),
+        ("callback", "show_calendar"),
+        ("button", "cal_prev_"),
+        ("button", "cal_prev_"),
+        ("button", "cal_next_"),
+        ("button", "cal_month_stats_"),
+    ],
+    "dialogue": [
+        ("text", "💬 Диалог с ИИ"),
+        ("text", "Как не отвлекаться во время медитации?"),
+        ("text", "А сколько минут в день достаточно?"),
+    ],
+    "marathon": [
+        ("text", "🏃 Присоединиться к марафону"),
+        ("button", "join_marathon_"),
+    ],
+    "progress": [
+        ("text", "📊 Мой прогресс"),
+    ],
+}
+
+DEFAULT_WEIGHTS = {"meditation": 4, "calendar": 3, "progress": 2, "dialogue": 1, "marathon": 1}
+
+def _percentile(samples: List[float], percent: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))]
+
+class LoadDriver:
+    def __init__(self, api: FakeBotAPI, *, users: int, rate: float, duration: float,
+                 think_time: float, reply_timeout: float, weights: Dict[str, int]):
+        self.api = api
+        self.rate = rate
+        self.duration = duration
+        self.think_time = think_time
+        self.reply_timeout = reply_timeout
+        self.journeys = list(weights)
+        self.weights = [weights[name] for name in self.journeys]
+        
+        self.idle_users = list(range(FIRST_USER_ID, FIRST_USER_ID + users))
+        self.started_users = set()
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.timeouts: Dict[str, int] = defaultdict(int)
+        self.skipped: Dict[str, int] = defaultdict(int)
+        self.journeys_done: Dict[str, int] = defaultdict(int)
+        self.not_started = 0
+    
+    async def _step(self, user_id: int, kind: str, value: str) -> bool:
+        """Один шаг сценария. False - бот не ответил, сценарий прерывается"""
+        if kind == "text":
+            self.api.push_message(user_id, value)
+        elif kind == "callback":
+            self.api.push_callback(user_id, value)
+        else:
+            markup = self.api.last_markup.get(user_id, {})
+            buttons = [
+                button["callback_data"] for row in markup.get("inline_keyboard", [])
+                for button in row if button.get("callback_data", "").startswith(value)
+            ]
+            if not buttons:
+                self.skipped[value] += 1
+                return True
+            self.api.push_callback(user_id, random.choice(buttons))
+        
+        latency = await self.api.wait_reply(user_id, self.reply_timeout)
+        if latency is None:
+            self.timeouts[value] += 1
+            return False
+        self.latencies[value].append(latency * 1000)
+        return True
+    
+    async def _journey(self, user_id: int, name: str):
+        try:
+            if user_id not in self.started_users:
+                self.started_users.add(user_id)
+                if not await self._step(user_id, "text", "/start"):
+                    return
+            
+            for kind, value in JOURNEYS[name]:
+                await asyncio.sleep(random.expovariate(1 / self.think_time) if self.think_time else 0)
+                if not await self._step(user_id, kind, value):
+                    return
+            self.journeys_done[name] += 1
+        finally:
+            self.idle_users.append(user_id)
+    
+    async def run(self) -> float:
+        """Запуск сценариев с частотой rate в секунду. Возвращает длительность теста"""
+        tasks = set()
+        started = time.perf_counter()
+        next_start = started
+        
+        while time.perf_counter() - started < self.duration:
+            # Пуассоновский поток сценариев
+            next_start += random.expovariate(self.rate)
+            await asyncio.sleep(max(0.0, next_start - time.perf_counter()))
+            if not self.idle_users:
+                self.not_started += 1
+                continue
+            
+            user_id = self.idle_users.pop(random.randrange(len(self.idle_users)))
+            name = random.choices(self.journeys, self.weights)[0]
+            task = asyncio.create_task(self._journey(user_id, name))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        
+        if tasks:
+            await asyncio.wait(tasks)
+        return time.perf_counter() - started
+    
+    def report(self, elapsed: float) -> Dict:
+        all_latencies = [value for values in self.latencies.values() for value in values]
+        
+        def summary(samples: List[float]) -> Dict[str, float]:
+            if not samples:
+                return {"count": 0}
+            return {
+                "count": len(samples),
+                "p50_ms": round(_percentile(samples, 50), 1),
+                "p95_ms": round(_percentile(samples, 95), 1),
+                "p99_ms": round(_percentile(samples, 99), 1),
+                "mean_ms": round(statistics.fmean(samples), 1),
+                "max_ms": round(max(samples), 1),
+            }
+        
+        api_stats = self.api.get_stats()
+        return {
+            "elapsed_s": round(elapsed, 1),
+            "updates_per_s": round(api_stats["delivered_updates"] / elapsed, 1) if elapsed else 0,
+            "latency": summary(all_latencies),
+            "steps": {step: summary(samples) for step, samples in self.latencies.items()},
+            "timeouts": dict(self.timeouts),
+            "skipped_buttons": dict(self.skipped),
+            "journeys_completed": dict(self.journeys_done),
+            "journeys_not_started": self.not_started,
+            **api_stats,
+        }
+
+def spawn_bot(api_url: str, llm_url: Optional[str] = None) -> subprocess.Popen:
+    """Запуск bot.py, подключенного к заглушке, без ограничений частоты"""
+    env = dict(os.environ)
+    if llm_url:
+        env.update({"AI_BASE_URL": llm_url, "AI_API_KEY": env.get("AI_API_KEY") or "mock"})
+    env.update({
+        "TELEGRAM_API_URL": api_url,
+        "BOT_TOKEN": FAKE_BOT_TOKEN,
+        "BOT_MODE": "polling",
+        "UPDATES_MAX_PENDING_TOTAL": "100000",
+    })
+    for bucket in ("NAVIGATION", "STATS", "LLM"):
+        env[f"THROTTLE_{bucket}_PER_MINUTE"] = "100000"
+        env[f"THROTTLE_{bucket}_BURST"] = "100000"
+    
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return subprocess.Popen([sys.executable, "bot.py"], cwd=root, env=env)
+
+async def wait_for_bot(api: FakeBotAPI, process: Optional[subprocess.Popen], timeout: float = 60):
+    """Ждем первого getUpdates - значит бот инициализировался и слушает"""
+    deadline = time.monotonic() + timeout
+    while not api.calls["getUpdates"]:
+        if process and process.poll() is not None:
+            raise RuntimeError(f"bot.py exited with code {process.returncode}")
+        if time.monotonic() > deadline:
+            raise RuntimeError("Bot did not start polling the fake Bot API")
+        await asyncio.sleep(0.2)
+
+async def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота на заглушке Bot API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--spawn-bot", action="store_true", help="Запустить bot.py самостоятельно")
+    parser.add_argument("--users", type=int, default=100, help="Число виртуальных пользователей")
+    parser.add_argument("--rate", type=float, default=10, help="Сценариев в секунду")
+    parser.add_argument("--duration", type=float, default=60, help="Длительность в секундах")
+    parser.add_argument("--think-ms", type=float, default=300, help="Средняя пауза между шагами")
+    parser.add_argument("--reply-timeout", type=float, default=30)
+    parser.add_argument("--journeys", default=",".join(f"{k}={v}" for k, v in DEFAULT_WEIGHTS.items()),
+                        help="Веса сценариев, например meditation=4,calendar=3")
+    parser.add_argument("--latency-ms", type=float, default=0, help="Задержка ответов Bot API")
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Доля ответов 429 от Bot API")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--mock-llm", action="store_true", help="Поднять заглушку LLM (loadtest/mock_llm.py) для бота")
+    parser.add_argument("--llm-port", type=int, default=8082)
+    parser.add_argument("--llm-latency-ms", type=float, default=800)
+    parser.add_argument("--llm-latency-sigma", type=float, default=0.4)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--llm-fixtures", help="Фикстуры ответов LLM для воспроизведения")
+    parser.add_argument("-o", "--output", help="Сохранить отчет в JSON")
+    args = parser.parse_args()
+    
+    weights = {}
+    for item in args.journeys.split(","):
+        name, _, weight = item.partition("=")
+        if name not in JOURNEYS:
+            parser.error(f"unknown journey: {name}")
+        weights[name] = int(weight or 1)
+    
+    logging.basicConfig(level=logging.INFO)
+    api = FakeBotAPI(
+        latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate, retry_after=args.retry_after
+    )
+    runner = await start_server(api, args.host, args.port)
+    api_url = f"http://{args.host}:{args.port}"
+    
+    llm, llm_runner, llm_url = None, None, None
+    if args.mock_llm:
+        llm = mock_llm.MockLLM(
+            latency_ms=args.llm_latency_ms, latency_sigma=args.llm_latency_sigma,
+            error_rate=args.llm_error_rate, fixtures=args.llm_fixtures
+        )
+        llm_runner = await mock_llm.start_server(llm, args.host, args.llm_port)
+        llm_url = f"http://{args.host}:{args.llm_port}/v1"
+    
+    process = spawn_bot(api_url, llm_url) if args.spawn_bot else None
+    if not process:
+        logger.info("Waiting for bot with TELEGRAM_API_URL=%s%s", api_url,
+                    f" and AI_BASE_URL={llm_url}" if llm_url else "")
+    
+    try:
+        await wait_for_bot(api, process)
+        driver = LoadDriver(
+            api, users=args.users, rate=args.rate, duration=args.duration,
+            think_time=args.think_ms / 1000, reply_timeout=args.reply_timeout, weights=weights
+        )
+        report = driver.report(await driver.run())
+        if llm:
+            report["llm"] = dict(llm.stats)
+    finally:
+        if process:
+            process.terminate()
+            process.wait()
+        if llm_runner:
+            await llm_runner.cleanup()
+        await runner.cleanup()
+    
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,264 @@
+# loadtest/fake_bot_api.py
+"""Локальная заглушка Telegram Bot API для нагрузочных тестов.
+
+Поддерживает getUpdates (long polling), sendMessage, editMessageText,
+editMessageReplyMarkup и answerCallbackQuery; остальные методы отвечают
+True. Обновления добавляются через push_update(), ответы бота
+отслеживаются по чатам. Задержка ответа и доля ошибок 429 настраиваются.
+
+Бот подключается к заглушке через TELEGRAM_API_URL, отдельно ее можно
+запустить так:
+    
+    python -m loadtest.fake_bot_api --port 8081 --latency-ms 30 --error-rate 0.01
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from aiohttp import web
+
+BOT_USER = {"id": 100000, "is_bot": True, "first_name": "LoadTest", "username": "loadtest_bot"}
+
+# Методы, в которые можно внедрять 429 (getUpdates не трогаем)
+RATE_LIMITED_METHODS = {"sendMessage", "editMessageText", "editMessageReplyMarkup", "answerCallbackQuery"}
+
+class FakeBotAPI:
+    """Состояние заглушки: очередь обновлений, ответы бота и счетчики"""
+    
+    def __init__(self, *, latency_ms: float = 0, jitter_ms: float = 0,
+                 error_rate: float = 0.0, retry_after: int = 1):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        
+        self._updates: List[Dict[str, Any]] = []
+        self._update_id = 0
+        self._message_id = 0
+        self._callback_id = 0
+        self._new_updates = asyncio.Event()
+        
+        # chat_id -> (время доставки обновления боту, future первого ответа)
+        self._waiters: Dict[int, tuple] = {}
+        self._callback_chats: Dict[str, int] = {}
+        self._pushed_at: Dict[int, float] = {}
+        
+        self.last_markup: Dict[int, Dict[str, Any]] = {}
+        self.last_message_id: Dict[int, int] = {}
+        self.calls: Counter = Counter()
+        self.errors_injected: Counter = Counter()
+        self.delivered = 0
+    
+    # Обновления от "пользователей"
+    
+    def _user(self, user_id: int) -> Dict[str, Any]:
+        return {"id": user_id, "is_bot": False, "first_name": f"Load{user_id}", "language_code": "ru"}
+    
+    def _next_message_id(self) -> int:
+        self._message_id += 1
+        return self._message_id
+    
+    def push_message(self, user_id: int, text: str) -> int:
+        message = {
+            "message_id": self._next_message_id(),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self._user(user_id),
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return self.push_update(user_id, {"message": message})
+    
+    def push_callback(self, user_id: int, data: str) -> int:
+        self._callback_id += 1
+        callback_id = str(self._callback_id)
+        self._callback_chats[callback_id] = user_id
+        return self.push_update(user_id, {"callback_query": {
+            "id": callback_id,
+            "from": self._user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": self.last_message_id.get(user_id, self._next_message_id()),
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": BOT_USER,
+                "text": "...",
+            },
+        }})
+    
+    def push_update(self, chat_id: int, payload: Dict[str, Any]) -> int:
+        """Добавить обновление в очередь. Ответом считается первый вызов API для chat_id"""
+        self._update_id += 1
+        update = {"update_id": self._update_id, **payload}
+        self._updates.append(update)
+        self._pushed_at[self._update_id] = time.perf_counter()
+        self._waiters[chat_id] = (None, asyncio.get_running_loop().create_future())
+        self._new_updates.set()
+        return self._update_id
+    
+    async def wait_reply(self, chat_id: int, timeout: float) -> Optional[float]:
+        """Ждать ответа бота в чате. Возвращает время обработки (с момента доставки боту) или None"""
+        waiter = self._waiters.get(chat_id)
+        if not waiter:
+            return None
+        try:
+            return await asyncio.wait_for(asyncio.shield(waiter[1]), timeout)
+        except asyncio.TimeoutError:
+            return None
+    
+    def _reply(self, chat_id: Optional[int]):
+        # Вызовы до доставки обновления относятся к предыдущему обработчику
+        waiter = self._waiters.get(chat_id)
+        if not waiter or waiter[0] is None:
+            return
+        del self._waiters[chat_id]
+        if not waiter[1].done():
+            waiter[1].set_result(time.perf_counter() - waiter[0])
+    
+    # HTTP
+    
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = self._parse(await request.post())
+        self.calls[method] += 1
+        
+        if method == "getUpdates":
+            return self._ok(await self._get_updates(params))
+        
+        if self.latency_ms or self.jitter_ms:
+            await asyncio.sleep(max(0.0, self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)) / 1000)
+        
+        if method in RATE_LIMITED_METHODS and self.error_rate and random.random() < self.error_rate:
+            self.errors_injected[method] += 1
+            return web.json_response({
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }, status=429)
+        
+        if method == "getMe":
+            return self._ok(BOT_USER)
+        if method in ("sendMessage", "editMessageText", "editMessageReplyMarkup"):
+            return self._ok(self._message(method, params))
+        if method == "answerCallbackQuery":
+            self._reply(self._callback_chats.pop(params.get("callback_query_id"), None))
+        return self._ok(True)
+    
+    def _message(self, method: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        chat_id = int(params["chat_id"])
+        message_id = int(params.get("message_id") or self._next_message_id())
+        self.last_message_id[chat_id] = message_id
+        markup = params.get("reply_markup")
+        if markup and "inline_keyboard" in markup:
+            self.last_markup[chat_id] = markup
+        self._reply(chat_id)
+        
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+            "text": params.get("text", ""),
+        }
+        if markup and "inline_keyboard" in markup:
+            message["reply_markup"] = markup
+        return message
+    
+    async def _get_updates(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        offset = int(params.get("offset") or 0)
+        timeout = float(params.get("timeout") or 0)
+        
+        # Подтвержденные ботом обновления больше не нужны
+        self._updates = [u for u in self._updates if u["update_id"] >= offset]
+        if not self._updates and timeout:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        
+        updates = list(self._updates)
+        now = time.perf_counter()
+        for update in updates:
+            if self._pushed_at.pop(update["update_id"], None) is None:
+                continue
+            self.delivered += 1
+            chat_id = self._chat_of(update)
+            waiter = self._waiters.get(chat_id)
+            if waiter and waiter[0] is None:
+                self._waiters[chat_id] = (now, waiter[1])
+        return updates
+    
+    @staticmethod
+    def _chat_of(update: Dict[str, Any]) -> Optional[int]:
+        if "message" in update:
+            return update["message"]["chat"]["id"]
+        if "callback_query" in update:
+            return update["callback_query"]["from"]["id"]
+        return None
+    
+    @staticmethod
+    def _parse(form) -> Dict[str, Any]:
+        """Параметры запроса aiogram: сложные значения приходят строкой JSON"""
+        params = {}
+        for key, value in form.items():
+            if isinstance(value, str) and value[:1] in ("{", "["):
+                try:
+                    value = json.loads(value)
+                except ValueError:
+                    pass
+            params[key] = value
+        return params
+    
+    @staticmethod
+    def _ok(result: Any) -> web.Response:
+        return web.json_response({"ok": True, "result": result})
+    
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        return app
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "delivered_updates": self.delivered,
+            "api_calls": dict(self.calls),
+            "errors_injected": dict(self.errors_injected),
+        }
+
+async def start_server(api: FakeBotAPI, host: str, port: int) -> web.AppRunner:
+    runner = web.AppRunner(api.create_app())
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+async def main():
+    parser = argparse.ArgumentParser(description="Заглушка Telegram Bot API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Доля ответов 429")
+    parser.add_argument("--retry-after", type=int, default=1)
+    args = parser.parse_args()
+    
+    api = FakeBotAPI(
+        latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate, retry_after=args.retry_after
+    )
+    runner = await start_server(api, args.host, args.port)
+    print(f"Fake Bot API: http://{args.host}:{args.port}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,323 @@
+# loadtest/mock_llm.py
+"""Локальная заглушка LLM API для тестов без сети.
+
+Понимает форматы OpenAI/OpenRouter (POST .../chat/completions) и Anthropic
+(POST .../messages), включая потоковые ответы (stream: true). Задержка
+задается логнормальным распределением, ошибки - долей ответов 429/5xx.
+
+Ответы либо синтезируются детерминированно по тексту запроса, либо берутся
+из файла фикстур. В режиме записи запросы проксируются к настоящему API и
+ответы сохраняются в тот же файл:
+    
+    # Запись реальных ответов (ключ API передает сам бот)
+    python -m loadtest.mock_llm --fixtures llm_fixtures.jsonl --record --upstream https://openrouter.ai/api/v1
+    # Воспроизведение
+    python -m loadtest.mock_llm --fixtures llm_fixtures.jsonl --latency-ms 800 --latency-sigma 0.4
+
+Бот подключается через AI_BASE_URL=http://127.0.0.1:8082/v1.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import random
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+import aiohttp
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+OPENAI = "openai"
+ANTHROPIC = "anthropic"
+
+ERROR_STATUSES = {OPENAI: (429, 500, 503), ANTHROPIC: (429, 500, 529)}
+
+# Заголовки, которые передаются настоящему API при записи
+FORWARDED_HEADERS = ("Authorization", "X-API-Key", "anthropic-version", "HTTP-Referer", "X-Title")
+
+REPLIES = [
+    "Прекрасная практика! Обратите внимание, как меняется дыхание к концу сессии, "
+    "и постарайтесь сохранить это ощущение спокойствия в течение дня.",
+    "Отвлекающие мысли - естественная часть медитации. Замечайте их без оценки "
+    "и мягко возвращайте внимание к дыханию.",
+    "Регулярность важнее длительности. Попробуйте практиковать в одно и то же время, "
+    "чтобы медитация стала привычкой.",
+    "Вы уже проделали большой путь. Завтра попробуйте начать с короткого сканирования тела, "
+    "а затем перейти к наблюдению за дыханием.",
+]
+
+def request_key(kind: str, body: Dict[str, Any]) -> str:
+    """Ключ фикстуры: формат и содержимое запроса без параметров доставки"""
+    relevant = {k: v for k, v in body.items() if k not in ("stream", "temperature")}
+    raw = json.dumps([kind, relevant], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+class MockLLM:
+    def __init__(self, *, latency_ms: float = 0, latency_sigma: float = 0.0,
+                 tokens_per_second: float = 50, error_rate: float = 0.0,
+                 fixtures: Optional[str] = None, record: bool = False,
+                 upstream: Optional[str] = None, strict: bool = False, seed: Optional[int] = None):
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.fixtures_path = fixtures
+        self.record = record
+        self.upstream = upstream.rstrip("/") if upstream else None
+        self.strict = strict
+        self.rng = random.Random(seed)
+        
+        self.fixtures: Dict[str, Dict[str, Any]] = {}
+        self.stats: Counter = Counter()
+        if fixtures:
+            self._load_fixtures()
+    
+    def _load_fixtures(self):
+        try:
+            with open(self.fixtures_path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        fixture = json.loads(line)
+                        self.fixtures[fixture["key"]] = fixture
+        except FileNotFoundError:
+            if not self.record:
+                raise
+        logger.info("Loaded %d LLM fixtures", len(self.fixtures))
+    
+    def _save_fixture(self, fixture: Dict[str, Any]):
+        self.fixtures[fixture["key"]] = fixture
+        with open(self.fixtures_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(fixture, ensure_ascii=False) + "\n")
+    
+    # Ответы
+    
+    def _latency(self) -> float:
+        if not self.latency_ms:
+            return 0.0
+        return self.latency_ms * self.rng.lognormvariate(0, self.latency_sigma) / 1000
+    
+    @staticmethod
+    def _prompt_text(kind: str, body: Dict[str, Any]) -> str:
+        parts = [body.get("system") or ""] if kind == ANTHROPIC else []
+        for message in body.get("messages", []):
+            content = message.get("content")
+            parts.append(content if isinstance(content, str) else json.dumps(content, ensure_ascii=False))
+        return "\n".join(parts)
+    
+    def _synthesize(self, kind: str, body: Dict[str, Any]) -> str:
+        """Детерминированный ответ: одинаковый запрос - одинаковый текст"""
+        prompt = self._prompt_text(kind, body)
+        if "JSON" in prompt:
+            now = datetime.now()
+            return json.dumps({
+                "date": now.strftime("%Y-%m-%d"), "time": now.strftime("%H:%M"),
+                "duration": 15, "rating": 8, "comment": "Спокойная практика",
+                "confidence": True, "clarification_needed": None,
+            }, ensure_ascii=False)
+        digest = int(hashlib.sha256(prompt.encode()).hexdigest(), 16)
+        return REPLIES[digest % len(REPLIES)]
+    
+    @staticmethod
+    def _completion(kind: str, model: str, text: str, prompt_tokens: int) -> Dict[str, Any]:
+        completion_tokens = max(1, len(text) // 4)
+        if kind == ANTHROPIC:
+            return {
+                "id": f"msg_mock_{int(time.time() * 1000)}",
+                "type": "message",
+                "role": "assistant",
+                "model": model,
+                "content": [{"type": "text", "text": text}],
+                "stop_reason": "end_turn",
+                "usage": {"input_tokens": prompt_tokens, "output_tokens": completion_tokens},
+            }
+        return {
+            "id": f"chatcmpl-mock-{int(time.time() * 1000)}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+    
+    @staticmethod
+    def _completion_text(kind: str, response: Dict[str, Any]) -> str:
+        if kind == ANTHROPIC:
+            return "".join(block.get("text", "") for block in response.get("content", []))
+        return response["choices"][0]["message"]["content"]
+    
+    @staticmethod
+    def _error(kind: str, status: int) -> web.Response:
+        message = {429: "Rate limit exceeded", 529: "Overloaded"}.get(status, "Internal server error")
+        if kind == ANTHROPIC:
+            error_type = {429: "rate_limit_error", 529: "overloaded_error"}.get(status, "api_error")
+            body = {"type": "error", "error": {"type": error_type, "message": message}}
+        else:
+            body = {"error": {"message": message, "type": "server_error", "code": status}}
+        headers = {"retry-after": "1"} if status == 429 else None
+        return web.json_response(body, status=status, headers=headers)
+    
+    # HTTP
+    
+    async def handle_openai(self, request: web.Request) -> web.StreamResponse:
+        return await self._handle(OPENAI, request)
+    
+    async def handle_anthropic(self, request: web.Request) -> web.StreamResponse:
+        return await self._handle(ANTHROPIC, request)
+    
+    async def _handle(self, kind: str, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        key = request_key(kind, body)
+        self.stats[f"{kind}_requests"] += 1
+        
+        fixture = self.fixtures.get(key)
+        if fixture:
+            self.stats["replayed"] += 1
+        elif self.record and self.upstream:
+            fixture = await self._record(kind, request, body, key)
+            if fixture["status"] != 200:
+                return web.json_response(fixture["response"], status=fixture["status"])
+        elif self.strict:
+            self.stats["missing_fixture"] += 1
+            return web.json_response({"error": {"message": f"No fixture for request {key}"}}, status=404)
+        
+        # Ошибки и задержка применяются и к воспроизведенным ответам
+        if self.error_rate and self.rng.random() < self.error_rate:
+            status = self.rng.choice(ERROR_STATUSES[kind])
+            self.stats[f"error_{status}"] += 1
+            await asyncio.sleep(self._latency() / 4)
+            return self._error(kind, status)
+        
+        if fixture:
+            response = fixture["response"]
+        else:
+            self.stats["synthesized"] += 1
+            prompt_tokens = max(1, len(self._prompt_text(kind, body)) // 4)
+            response = self._completion(kind, body.get("model", "mock"), self._synthesize(kind, body), prompt_tokens)
+        
+        await asyncio.sleep(self._latency())
+        if body.get("stream"):
+            return await self._stream(kind, request, response)
+        return web.json_response(response)
+    
+    async def _record(self, kind: str, request: web.Request, body: Dict[str, Any], key: str) -> Dict[str, Any]:
+        """Проксирование запроса к настоящему API с сохранением ответа"""
+        headers = {name: request.headers[name] for name in FORWARDED_HEADERS if name in request.headers}
+        path = "messages" if kind == ANTHROPIC else "chat/completions"
+        upstream_body = {k: v for k, v in body.items() if k != "stream"}
+        
+        async with aiohttp.ClientSession() as session:
+            async with session.post(f"{self.upstream}/{path}", headers=headers, json=upstream_body) as response:
+                data = await response.json(content_type=None)
+                fixture = {"key": key, "format": kind, "status": response.status,
+                           "request": upstream_body, "response": data}
+        
+        # Ошибки не сохраняем - их воспроизводит error_rate
+        if fixture["status"] == 200:
+            self._save_fixture(fixture)
+            self.stats["recorded"] += 1
+        else:
+            self.stats["upstream_errors"] += 1
+        return fixture
+    
+    async def _stream(self, kind: str, request: web.Request, response: Dict[str, Any]) -> web.StreamResponse:
+        """Потоковый ответ (SSE) в формате провайдера"""
+        stream = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await stream.prepare(request)
+        
+        async def send(data: Dict[str, Any], event: Optional[str] = None):
+            prefix = f"event: {event}\n" if event else ""
+            await stream.write(f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n".encode())
+        
+        text = self._completion_text(kind, response)
+        words = text.split(" ")
+        delay = 1 / self.tokens_per_second if self.tokens_per_second else 0
+        
+        if kind == ANTHROPIC:
+            start = {**response, "content": [], "stop_reason": None,
+                     "usage": {**response.get("usage", {}), "output_tokens": 0}}
+            await send({"type": "message_start", "message": start}, "message_start")
+            await send({"type": "content_block_start", "index": 0,
+                        "content_block": {"type": "text", "text": ""}}, "content_block_start")
+            for i, word in enumerate(words):
+                chunk = word if i == 0 else f" {word}"
+                await send({"type": "content_block_delta", "index": 0,
+                            "delta": {"type": "text_delta", "text": chunk}}, "content_block_delta")
+                await asyncio.sleep(delay)
+            await send({"type": "content_block_stop", "index": 0}, "content_block_stop")
+            await send({"type": "message_delta", "delta": {"stop_reason": "end_turn"},
+                        "usage": {"output_tokens": response.get("usage", {}).get("output_tokens", 0)}}, "message_delta")
+            await send({"type": "message_stop"}, "message_stop")
+        else:
+            base = {"id": response.get("id"), "object": "chat.completion.chunk",
+                    "created": response.get("created"), "model": response.get("model")}
+            for i, word in enumerate(words):
+                chunk = word if i == 0 else f" {word}"
+                await send({**base, "choices": [{"index": 0, "delta": {"content": chunk}, "finish_reason": None}]})
+                await asyncio.sleep(delay)
+            await send({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                        "usage": response.get("usage")})
+            await stream.write(b"data: [DONE]\n\n")
+        
+        await stream.write_eof()
+        return stream
+    
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(dict(self.stats))
+    
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        # Префикс пути любой: /v1, /api/v1 (OpenRouter) и т.д.
+        app.router.add_post(r"/{prefix:.*}chat/completions", self.handle_openai)
+        app.router.add_post(r"/{prefix:.*}messages", self.handle_anthropic)
+        app.router.add_get("/stats", self.handle_stats)
+        return app
+
+async def start_server(llm: MockLLM, host: str, port: int) -> web.AppRunner:
+    runner = web.AppRunner(llm.create_app())
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+async def main():
+    parser = argparse.ArgumentParser(description="Заглушка LLM API (OpenAI/OpenRouter и Anthropic)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8082)
+    parser.add_argument("--latency-ms", type=float, default=0, help="Медиана задержки ответа")
+    parser.add_argument("--latency-sigma", type=float, default=0.0, help="Разброс (логнормальный, 0 - фиксированная)")
+    parser.add_argument("--tokens-per-second", type=float, default=50, help="Скорость потоковой выдачи")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Доля ответов 429/5xx")
+    parser.add_argument("--fixtures", help="Файл фикстур JSONL")
+    parser.add_argument("--record", action="store_true", help="Записывать ответы настоящего API в фикстуры")
+    parser.add_argument("--upstream", help="Базовый адрес настоящего API для записи")
+    parser.add_argument("--strict", action="store_true", help="404 на запросы без фикстуры вместо синтеза")
+    parser.add_argument("--seed", type=int, help="Зерно для задержек и ошибок")
+    args = parser.parse_args()
+    
+    if args.record and not (args.fixtures and args.upstream):
+        parser.error("--record requires --fixtures and --upstream")
+    
+    logging.basicConfig(level=logging.INFO)
+    llm = MockLLM(
+        latency_ms=args.latency_ms, latency_sigma=args.latency_sigma,
+        tokens_per_second=args.tokens_per_second, error_rate=args.error_rate,
+        fixtures=args.fixtures, record=args.record, upstream=args.upstream,
+        strict=args.strict, seed=args.seed
+    )
+    runner = await start_server(llm, args.host, args.port)
+    print(f"Mock LLM API: http://{args.host}:{args.port}/v1")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+if __name__ == "__main__":
+    asyncio.run(main())
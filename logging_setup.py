@@ -0,0 +1,127 @@
+# logging_setup.py
+"""Неблокирующее логирование.
+
+Записи из цикла событий кладутся в очередь (QueueHandler), форматирование
+и вывод выполняет фоновый поток (QueueListener). Формат - JSON с контекстом
+обновления (update_id, user_id, handler) или обычный текст. Частые записи
+отдельных логгеров прореживаются SamplingFilter до постановки в очередь.
+"""
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+# Контекст текущего обновления: update_id, user_id, handler
+log_context: contextvars.ContextVar = contextvars.ContextVar("log_context", default={})
+
+# Стандартные атрибуты LogRecord; остальные (из extra=...) попадают в JSON
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "context"}
+
+def bind_log_context(**values) -> contextvars.Token:
+    """Дополнить контекст логов текущей задачи"""
+    return log_context.set({**log_context.get(), **values})
+
+class ContextQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler без форматирования в вызывающем потоке.
+    
+    Стандартный prepare() форматирует сообщение до постановки в очередь, то
+    есть в цикле событий. Здесь запоминается только контекст (он привязан
+    к задаче asyncio и недоступен из потока), остальное делает слушатель.
+    """
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.context = log_context.get()
+        return record
+
+class SamplingFilter(logging.Filter):
+    """Пропускает долю rate записей логгера (и его потомков) ниже WARNING.
+    
+    rates: {"aiogram.event": 0.1} - каждая десятая запись в среднем.
+    Предупреждения и ошибки проходят всегда.
+    """
+    
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        # Более длинные префиксы проверяются первыми
+        self.rates = sorted(rates.items(), key=lambda item: len(item[0]), reverse=True)
+        self.dropped = 0
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        
+        for prefix, rate in self.rates:
+            if record.name == prefix or record.name.startswith(prefix + "."):
+                if rate >= 1 or random.random() < rate:
+                    return True
+                self.dropped += 1
+                return False
+        return True
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись: время, уровень, логгер, сообщение, контекст и extra"""
+    
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        entry.update(getattr(record, "context", None) or {})
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class ContextTextFormatter(logging.Formatter):
+    """Обычный текстовый формат с контекстом обновления в конце строки"""
+    
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        context = getattr(record, "context", None)
+        if context:
+            text += " [" + " ".join(f"{key}={value}" for key, value in context.items()) + "]"
+        return text
+
+def parse_sampling(spec: str) -> Dict[str, float]:
+    """'aiogram.event=0.1,bot.updates=0.5' -> {'aiogram.event': 0.1, 'bot.updates': 0.5}"""
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, rate = item.partition("=")
+        rates[name.strip()] = float(rate)
+    return rates
+
+def setup_logging(level: str = "INFO", fmt: str = "json",
+                  sampling: Optional[Dict[str, float]] = None) -> logging.handlers.QueueListener:
+    """Настроить корневой логгер на очередь и запустить поток вывода.
+    
+    Возвращает QueueListener; listener.stop() дописывает очередь.
+    """
+    output = logging.StreamHandler(sys.stderr)
+    if fmt == "json":
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(ContextTextFormatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    handler = ContextQueueHandler(log_queue)
+    if sampling:
+        handler.addFilter(SamplingFilter(sampling))
+    
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level.upper())
+    
+    listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    listener.start()
+    return listener
@@ -0,0 +1,203 @@
+# metrics.py
+"""Метрики в текстовом формате Prometheus.
+
+Счетчики и гистограммы с метками без внешних зависимостей и HTTP-эндпоинт
+/metrics. Время вызовов БД и ИИ помечается именем обработчика, в котором
+они выполнялись (current_handler), чтобы было видно, куда уходит время
+каждого обработчика.
+"""
+import contextvars
+import functools
+import inspect
+import logging
+import math
+import time
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+AI_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 10.0, 20.0, 30.0, 60.0)
+
+# Обработчик текущего обновления; фоновые задачи остаются с "background"
+current_handler: contextvars.ContextVar = contextvars.ContextVar("current_handler", default="background")
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _format_labels(names: Sequence[str], values: Sequence, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple, float] = {}
+    
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        self._values[key] = self._values.get(key, 0) + amount
+    
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for key, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # Метки -> [счетчики по корзинам, сумма, количество]
+        self._values: Dict[Tuple, list] = {}
+    
+    def observe(self, value: float, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        state = self._values.get(key)
+        if state is None:
+            state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+        
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                state[0][i] += 1
+                break
+        state[1] += value
+        state[2] += 1
+    
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+class Registry:
+    """Набор метрик и сборщиков (функций, возвращающих готовые строки, например gauge)"""
+    
+    def __init__(self):
+        self._metrics: List = []
+        self._collectors: List[Callable[[], Iterable[str]]] = []
+    
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+    
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+    
+    def add_collector(self, collector: Callable[[], Iterable[str]]):
+        self._collectors.append(collector)
+    
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            try:
+                lines.extend(collector())
+            except Exception as e:
+                logger.error("Error collecting metrics: %s", e)
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+HANDLER_SECONDS = REGISTRY.histogram(
+    "bot_handler_duration_seconds", "Handler execution time", ("handler", "event")
+)
+HANDLER_ERRORS = REGISTRY.counter(
+    "bot_handler_errors_total", "Unhandled handler exceptions", ("handler", "error")
+)
+BOT_API_SECONDS = REGISTRY.histogram(
+    "bot_api_request_duration_seconds", "Telegram Bot API request time", ("method", "status")
+)
+DB_SECONDS = REGISTRY.histogram(
+    "db_call_duration_seconds", "Database method time", ("handler", "method", "status")
+)
+AI_SECONDS = REGISTRY.histogram(
+    "ai_call_duration_seconds", "AIService method time", ("handler", "method", "status"), AI_BUCKETS
+)
+
+def instrument(obj, histogram: Histogram, exclude: Iterable[str] = ()):
+    """Замер времени публичных async-методов объекта (обертки ставятся на экземпляр)"""
+    exclude = set(exclude)
+    for name, method in inspect.getmembers(obj, inspect.iscoroutinefunction):
+        if not name.startswith("_") and name not in exclude:
+            setattr(obj, name, _timed(method, histogram, name))
+
+def _timed(method, histogram: Histogram, name: str):
+    @functools.wraps(method)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        status = "ok"
+        try:
+            return await method(*args, **kwargs)
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            histogram.observe(
+                time.perf_counter() - started,
+                handler=current_handler.get(), method=name, status=status
+            )
+    return wrapper
+
+def pool_collector(db) -> Callable[[], List[str]]:
+    """Gauge-метрики пулов соединений Database"""
+    def collect() -> List[str]:
+        stats = db.get_pool_stats()
+        pools = [("primary", stats)]
+        if "replica" in stats:
+            pools.append(("replica", stats["replica"]))
+        
+        lines = []
+        for metric, key, kind in (
+            ("db_pool_size", "size", "gauge"),
+            ("db_pool_idle", "idle", "gauge"),
+            ("db_pool_waiting", "waiting", "gauge"),
+            ("db_pool_acquire_timeouts_total", "timeouts", "counter"),
+        ):
+            lines.append(f"# TYPE {metric} {kind}")
+            for pool_name, pool_stats in pools:
+                lines.append(f'{metric}{{pool="{pool_name}"}} {pool_stats[key]}')
+        return lines
+    return collect
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(
+        body=REGISTRY.render().encode(),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+    )
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    """Отдельный HTTP-сервер с /metrics (по умолчанию только на localhost)"""
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Metrics available at http://%s:%s/metrics", host, port)
+    return runner
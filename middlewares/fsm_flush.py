@@ -0,0 +1,27 @@
+# middlewares/fsm_flush.py
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+class FSMFlushMiddleware(BaseMiddleware):
+    """Записывает изменения FSM в БД, как только обработчик закончил работу.
+    
+    PostgresStorage копит изменения одного обновления в памяти, а здесь они
+    уходят в БД одним пакетом - до ответа на следующее обновление, поэтому
+    другой процесс не прочитает устаревшее состояние.
+    """
+    
+    def __init__(self, storage):
+        self.storage = storage
+    
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        try:
+            return await handler(event, data)
+        finally:
+            await self.storage.flush()
@@ -0,0 +1,47 @@
+# middlewares/logging_context.py
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from logging_setup import bind_log_context, log_context
+
+# Отдельный логгер, чтобы строки об обработке прореживались через LOG_SAMPLING
+updates_logger = logging.getLogger("bot.updates")
+
+class LogContextMiddleware(BaseMiddleware):
+    """Контекст логов обновления.
+    
+    Как outer middleware на dp.update добавляет update_id и user_id, как inner
+    middleware на наблюдателях событий - имя обработчика, и по завершении
+    пишет строку с временем обработки в логгер bot.updates.
+    """
+    
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        if isinstance(event, Update):
+            user = data.get("event_from_user")
+            token = bind_log_context(update_id=event.update_id, user_id=user.id if user else None)
+            try:
+                return await handler(event, data)
+            finally:
+                log_context.reset(token)
+        
+        handler_object = data.get("handler")
+        name = handler_object.callback.__name__ if handler_object else "unknown"
+        token = bind_log_context(handler=name)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            updates_logger.info(
+                "Update handled by %s", name,
+                extra={"latency_ms": round((time.perf_counter() - started) * 1000, 1)}
+            )
+            log_context.reset(token)
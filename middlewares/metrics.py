@@ -0,0 +1,80 @@
+# middlewares/metrics.py
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import (TelegramAPIError, TelegramBadRequest, TelegramConflictError,
+                                TelegramEntityTooLarge, TelegramForbiddenError, TelegramNetworkError,
+                                TelegramNotFound, TelegramRetryAfter, TelegramServerError,
+                                TelegramUnauthorizedError)
+from aiogram.methods import TelegramMethod
+from aiogram.types import TelegramObject
+
+from metrics import BOT_API_SECONDS, HANDLER_ERRORS, HANDLER_SECONDS, current_handler
+
+# Коды ответа Bot API по классам исключений aiogram
+ERROR_STATUSES = (
+    (TelegramRetryAfter, "429"),
+    (TelegramBadRequest, "400"),
+    (TelegramUnauthorizedError, "401"),
+    (TelegramForbiddenError, "403"),
+    (TelegramNotFound, "404"),
+    (TelegramConflictError, "409"),
+    (TelegramEntityTooLarge, "413"),
+    (TelegramServerError, "5xx"),
+    (TelegramNetworkError, "network"),
+)
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Время и ошибки обработчиков.
+    
+    Регистрируется как inner middleware (после троттлинга), чтобы знать
+    выбранный обработчик и не учитывать отброшенные обновления. На время
+    обработчика выставляет metrics.current_handler для меток БД и ИИ.
+    """
+    
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        handler_object = data.get("handler")
+        name = handler_object.callback.__name__ if handler_object else "unknown"
+        event_type = type(event).__name__
+        
+        token = current_handler.set(name)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            HANDLER_ERRORS.inc(handler=name, error=type(e).__name__)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, handler=name, event=event_type)
+            current_handler.reset(token)
+
+class BotAPIMetricsMiddleware(BaseRequestMiddleware):
+    """Время и коды ответа запросов к Bot API (регистрируется на bot.session)"""
+    
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType,
+        bot: Bot,
+        method: TelegramMethod
+    ):
+        started = time.perf_counter()
+        status = "200"
+        try:
+            return await make_request(bot, method)
+        except TelegramAPIError as e:
+            status = next((code for cls, code in ERROR_STATUSES if isinstance(e, cls)), "error")
+            raise
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            BOT_API_SECONDS.observe(
+                time.perf_counter() - started, method=method.__api_method__, status=status
+            )
@@ -0,0 +1,106 @@
+# middlewares/ordering.py
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import AsyncGenerator, Dict
+
+from aiogram.fsm.storage.base import BaseEventIsolation, StorageKey
+from aiogram.types import ErrorEvent
+
+logger = logging.getLogger(__name__)
+
+class UpdateDropped(Exception):
+    """Обновление отброшено: очередь пользователя или общая очередь заполнена"""
+    
+    def __init__(self, user_id: int, pending: int, total: int):
+        super().__init__(f"update from user {user_id} dropped")
+        self.user_id = user_id
+        self.pending = pending
+        self.total = total
+
+class _UserQueue:
+    """Очередь обновлений одного пользователя"""
+    
+    __slots__ = ("lock", "pending")
+    
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.pending = 0
+
+class UserEventIsolation(BaseEventIsolation):
+    """Обработка обновлений параллельно между пользователями и по порядку внутри одного.
+    
+    Передается в Dispatcher(events_isolation=...). FSMContextMiddleware берет
+    блокировку до чтения состояния, поэтому следующее обновление пользователя
+    читает состояние уже после того, как предыдущее его записало. Обновления
+    пользователя ждут в порядке поступления (asyncio.Lock выдает блокировку
+    в порядке ожидания), обновления разных пользователей не ждут друг друга.
+    
+    Перегрузка:
+    - у пользователя не больше max_pending обновлений в очереди;
+    - одновременно выполняется не больше max_concurrent обновлений, всего в
+      ожидании не больше max_total.
+    Сверх этого lock() бросает UpdateDropped, его обрабатывает drop_update,
+    зарегистрированный в dp.errors.
+    """
+    
+    def __init__(self, *, max_concurrent: int = 100,
+                 max_pending: int = 5,
+                 max_total: int = 1000):
+        self.max_pending = max_pending
+        self.max_total = max_total
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._queues: Dict[int, _UserQueue] = {}
+        self._total = 0
+        self.processed = 0
+        self.shed = 0
+    
+    @asynccontextmanager
+    async def lock(self, key: StorageKey) -> AsyncGenerator[None, None]:
+        # Порядок нужен по пользователю, а не по чату (ключ FSM включает оба)
+        user_id = key.user_id
+        queue = self._queues.get(user_id)
+        if queue is None:
+            queue = self._queues[user_id] = _UserQueue()
+        
+        if queue.pending >= self.max_pending or self._total >= self.max_total:
+            self.shed += 1
+            if queue.pending == 0:
+                self._queues.pop(user_id, None)
+            raise UpdateDropped(user_id, queue.pending, self._total)
+        
+        queue.pending += 1
+        self._total += 1
+        try:
+            async with queue.lock, self._semaphore:
+                yield
+            self.processed += 1
+        finally:
+            queue.pending -= 1
+            self._total -= 1
+            if queue.pending == 0:
+                self._queues.pop(user_id, None)
+    
+    async def close(self) -> None:
+        self._queues.clear()
+    
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            "users": len(self._queues),
+            "in_flight": self._total,
+            "processed": self.processed,
+            "shed": self.shed
+        }
+
+async def drop_update(event: ErrorEvent) -> None:
+    """Обработчик UpdateDropped: записать в лог и снять "часики" с кнопки"""
+    error = event.exception
+    logger.warning(
+        "Dropping update %s from user %s: %d pending for user, %d in total",
+        event.update.update_id, error.user_id, error.pending, error.total
+    )
+    if event.update.callback_query:
+        try:
+            await event.update.callback_query.answer("Слишком много запросов, попробуйте позже")
+        except Exception:
+            pass
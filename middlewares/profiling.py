@@ -0,0 +1,52 @@
+# middlewares/profiling.py
+import logging
+from typing import Any, Awaitable, Callable, Dict, Set
+
+from aiogram import BaseMiddleware
+from aiogram.types import BufferedInputFile, TelegramObject
+
+from profiling import profile_call
+
+logger = logging.getLogger(__name__)
+
+class UpdateProfilingMiddleware(BaseMiddleware):
+    """cProfile следующего обновления пользователя, включенный через arm().
+    
+    Регистрируется как outer middleware на dp.update после остальных, чтобы
+    профиль покрывал фильтры, inner middleware и обработчик. Цифры включают
+    и другие задачи цикла событий, работавшие в это время. Отчет
+    отправляется пользователю файлом; если в этот момент снимается другой
+    профиль, профилируется следующее обновление пользователя.
+    """
+    
+    def __init__(self):
+        self.armed: Set[int] = set()
+    
+    def arm(self, user_id: int):
+        self.armed.add(user_id)
+    
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is None or user.id not in self.armed:
+            return await handler(event, data)
+        
+        self.armed.discard(user.id)
+        result, report = await profile_call(lambda: handler(event, data))
+        if report is None:
+            self.armed.add(user.id)
+            return result
+        
+        try:
+            await data["bot"].send_document(
+                user.id,
+                BufferedInputFile(report.encode(), filename=f"update_{event.update_id}.txt"),
+                caption="🔬 Профиль обновления (cProfile)"
+            )
+        except Exception as e:
+            logger.error("Error sending update profile to %s: %s", user.id, e)
+        return result
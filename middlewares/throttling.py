@@ -0,0 +1,141 @@
+# middlewares/throttling.py
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, NamedTuple, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import CallbackQuery, Message, TelegramObject
+
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Классы обработчиков задаются флагом throttling при регистрации:
+# @dp.message(..., flags={"throttling": "llm"})
+DEFAULT_BUCKET = "navigation"
+
+# Не чаще одного предупреждения на пользователя и класс за это время (сек)
+WARNING_INTERVAL = 10
+
+# Пополнение и списание токена одним запросом: строка обновляется, только если
+# после пополнения есть хотя бы один токен. Пустой результат - лимит исчерпан
+TAKE_TOKEN_SQL = '''
+    INSERT INTO throttle_buckets AS b (user_id, bucket, tokens, updated_at)
+    VALUES ($1, $2, $3::float8 - 1, CURRENT_TIMESTAMP)
+    ON CONFLICT (user_id, bucket) DO UPDATE SET
+        tokens = LEAST($3::float8, b.tokens + EXTRACT(EPOCH FROM CURRENT_TIMESTAMP - b.updated_at) * $4::float8) - 1,
+        updated_at = CURRENT_TIMESTAMP
+    WHERE LEAST($3::float8, b.tokens + EXTRACT(EPOCH FROM CURRENT_TIMESTAMP - b.updated_at) * $4::float8) >= 1
+    RETURNING tokens
+'''
+
+class BucketLimit(NamedTuple):
+    """Лимит класса обработчиков: rate токенов в секунду, не больше burst подряд"""
+    rate: float
+    burst: int
+    
+    @classmethod
+    def per_minute(cls, per_minute: float, burst: int) -> "BucketLimit":
+        return cls(per_minute / 60, burst)
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Ограничение частоты запросов пользователя по классам обработчиков (token bucket).
+    
+    Регистрируется как inner middleware на dp.message и dp.callback_query,
+    чтобы видеть флаги обработчика. Счетчики хранятся в памяти процесса; при
+    shared=True - в таблице throttle_buckets, общей для всех процессов. Если
+    БД недоступна, запрос пропускается.
+    """
+    
+    def __init__(self, limits: Dict[str, BucketLimit], *,
+                 db=None,
+                 shared: bool = False,
+                 exempt_ids: Optional[list] = None):
+        if shared and db is None:
+            raise ValueError("Shared throttling requires a database")
+        
+        self.limits = limits
+        self.db = db
+        self.shared = shared
+        self.exempt_ids = set(exempt_ids or ())
+        self._buckets = TTLCache(maxsize=100000)
+        self._warned = TTLCache(maxsize=10000, ttl=WARNING_INTERVAL)
+        self.throttled = 0
+    
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = data.get("event_from_user")
+        bucket = get_flag(data, "throttling", default=DEFAULT_BUCKET)
+        limit = self.limits.get(bucket)
+        
+        if user is None or limit is None or user.id in self.exempt_ids:
+            return await handler(event, data)
+        
+        if self.shared:
+            allowed = await self._take_shared(user.id, bucket, limit)
+        else:
+            allowed = self._take_local(user.id, bucket, limit)
+        
+        if allowed:
+            return await handler(event, data)
+        
+        self.throttled += 1
+        await self._answer_throttled(event, user.id, bucket)
+        return None
+    
+    def _take_local(self, user_id: int, bucket: str, limit: BucketLimit) -> bool:
+        """Списать токен из корзины в памяти процесса"""
+        key = (user_id, bucket)
+        now = time.monotonic()
+        tokens, updated_at = self._buckets.get(key, (limit.burst, now))
+        tokens = min(limit.burst, tokens + (now - updated_at) * limit.rate)
+        
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        
+        # Полная корзина ничем не отличается от отсутствующей
+        self._buckets.set(key, (tokens, now), ttl=(limit.burst - tokens) / limit.rate)
+        return allowed
+    
+    async def _take_shared(self, user_id: int, bucket: str, limit: BucketLimit) -> bool:
+        """Списать токен из общей корзины в PostgreSQL"""
+        try:
+            async with self.db.acquire('throttling.take_shared') as conn:
+                tokens = await conn.fetchval(
+                    TAKE_TOKEN_SQL, user_id, bucket, float(limit.burst), limit.rate
+                )
+        except Exception as e:
+            logger.error("Shared throttling unavailable, allowing request: %s", e)
+            return True
+        return tokens is not None
+    
+    async def _answer_throttled(self, event: TelegramObject, user_id: int, bucket: str):
+        """Вежливо сообщить о лимите, не отвечая на каждое лишнее нажатие"""
+        text = "⏳ Слишком много запросов. Пожалуйста, подождите немного и попробуйте снова."
+        
+        if isinstance(event, CallbackQuery):
+            # Ответ на callback обязателен, иначе кнопка "висит"
+            await event.answer(text)
+            return
+        
+        if self._warned.get((user_id, bucket)):
+            return
+        self._warned.set((user_id, bucket), True)
+        
+        if isinstance(event, Message):
+            await event.answer(text)
+    
+    async def purge_shared(self, idle_seconds: float = 3600) -> int:
+        """Удалить давно не использованные общие корзины"""
+        async with self.db.acquire('throttling.purge_shared') as conn:
+            result = await conn.execute('''
+                DELETE FROM throttle_buckets
+                WHERE updated_at < CURRENT_TIMESTAMP - make_interval(secs => $1)
+            ''', float(idle_seconds))
+        return int(result.split()[-1])
@@ -0,0 +1,33 @@
+# middlewares/users.py
+import logging
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+logger = logging.getLogger(__name__)
+
+class UserRegistrationMiddleware(BaseMiddleware):
+    """Гарантирует строку в users для отправителя любого обновления.
+    
+    Database.create_user помнит уже записанных пользователей, поэтому для
+    знакомого пользователя с неизменным профилем запрос к БД не выполняется.
+    """
+    
+    def __init__(self, db):
+        self.db = db
+    
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is not None and not user.is_bot:
+            try:
+                await self.db.create_user(user.id, user.username, user.first_name, user.last_name)
+            except Exception as e:
+                logger.error("Error registering user %s: %s", user.id, e)
+        
+        return await handler(event, data)
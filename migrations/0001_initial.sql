@@ -0,0 +1,31 @@
+-- Базовые таблицы. IF NOT EXISTS - чтобы существующие установки
+-- без schema_version приняли эту версию без изменений.
+
+-- Пользователи
+CREATE TABLE IF NOT EXISTS users (
+    user_id BIGINT PRIMARY KEY,
+    username VARCHAR(255),
+    first_name VARCHAR(255),
+    last_name VARCHAR(255),
+    joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    timezone VARCHAR(50) DEFAULT 'UTC'
+);
+
+-- Марафоны
+CREATE TABLE IF NOT EXISTS marathons (
+    marathon_id SERIAL PRIMARY KEY,
+    title VARCHAR(255) NOT NULL,
+    description TEXT,
+    start_date DATE NOT NULL,
+    end_date DATE NOT NULL,
+    daily_goal INTEGER NOT NULL DEFAULT 1,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Участники марафонов
+CREATE TABLE IF NOT EXISTS marathon_participants (
+    user_id BIGINT REFERENCES users(user_id),
+    marathon_id INTEGER REFERENCES marathons(marathon_id),
+    joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, marathon_id)
+);
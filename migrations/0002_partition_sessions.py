@@ -0,0 +1,68 @@
+# migrations/0002_partition_sessions.py
+"""Сессии медитаций: годовые партиции по start_time и архив старых лет"""
+from datetime import date
+
+from migrations import create_partitioned_table
+
+SESSIONS_DDL = '''
+    CREATE TABLE sessions (
+        session_id INTEGER NOT NULL DEFAULT nextval('sessions_session_id_seq'),
+        user_id BIGINT REFERENCES users(user_id),
+        start_time TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        end_time TIMESTAMP,
+        duration INTEGER,
+        comment TEXT,
+        rating INTEGER CHECK (rating >= 1 AND rating <= 10),
+        marathon_id INTEGER,
+        PRIMARY KEY (session_id, start_time)
+    ) PARTITION BY RANGE (start_time)
+'''
+
+async def _create_partitions(conn, first_day: date):
+    """Годовые партиции с года first_day до следующего года"""
+    for year in range(first_day.year, date.today().year + 2):
+        await conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS sessions_y{year}
+            PARTITION OF sessions
+            FOR VALUES FROM ('{year}-01-01') TO ('{year + 1}-01-01')
+        ''')
+
+async def upgrade(conn):
+    # Старая таблица sessions (если есть) переносится в партиции
+    await create_partitioned_table(
+        conn, 'sessions', SESSIONS_DDL, 'sessions_session_id_seq',
+        id_column='session_id', key_column='start_time',
+        columns='session_id, user_id, start_time, end_time, duration, '
+                'comment, rating, marathon_id',
+        legacy_indexes=('idx_sessions_user_id', 'idx_sessions_marathon_id'),
+        create_partitions=_create_partitions
+    )
+    
+    # Архив старых сессий: сводка по пользователю, дню и марафону
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS sessions_archive (
+            user_id BIGINT REFERENCES users(user_id),
+            day DATE NOT NULL,
+            marathon_id INTEGER,
+            sessions_count INTEGER NOT NULL,
+            total_duration INTEGER NOT NULL,
+            rating_sum INTEGER NOT NULL,
+            rating_count INTEGER NOT NULL,
+            max_rating INTEGER
+        )
+    ''')
+    
+    await conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_sessions_user_start 
+        ON sessions(user_id, start_time)
+    ''')
+    
+    await conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_sessions_marathon_id 
+        ON sessions(marathon_id)
+    ''')
+    
+    await conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_sessions_archive_user_day 
+        ON sessions_archive(user_id, day)
+    ''')
@@ -0,0 +1,50 @@
+# migrations/0003_partition_dialogue_history.py
+"""История диалогов с AI: помесячные партиции по created_at"""
+from datetime import date
+
+from migrations import create_partitioned_table
+
+DIALOGUE_HISTORY_DDL = '''
+    CREATE TABLE dialogue_history (
+        id INTEGER NOT NULL DEFAULT nextval('dialogue_history_id_seq'),
+        user_id BIGINT REFERENCES users(user_id),
+        content TEXT NOT NULL,
+        is_user BOOLEAN NOT NULL,
+        created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (id, created_at)
+    ) PARTITION BY RANGE (created_at)
+'''
+
+def _add_months(month: date, months: int) -> date:
+    """Сдвиг первого числа месяца на заданное количество месяцев"""
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+async def _create_partitions(conn, first_day: date):
+    """Помесячные партиции с месяца до first_day до текущего месяца + 2"""
+    month = _add_months(first_day.replace(day=1), -1)
+    last_month = _add_months(date.today().replace(day=1), 2)
+    
+    while month <= last_month:
+        next_month = _add_months(month, 1)
+        await conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS dialogue_history_{month:%Y_%m}
+            PARTITION OF dialogue_history
+            FOR VALUES FROM ('{month}') TO ('{next_month}')
+        ''')
+        month = next_month
+
+async def upgrade(conn):
+    # Старая таблица dialogue_history (если есть) переносится в партиции
+    await create_partitioned_table(
+        conn, 'dialogue_history', DIALOGUE_HISTORY_DDL, 'dialogue_history_id_seq',
+        id_column='id', key_column='created_at',
+        columns='id, user_id, content, is_user, created_at',
+        legacy_indexes=('idx_dialogue_user_id',),
+        create_partitions=_create_partitions
+    )
+    
+    await conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_dialogue_user_id 
+        ON dialogue_history(user_id, created_at DESC)
+    ''')
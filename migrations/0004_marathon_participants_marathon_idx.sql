@@ -0,0 +1,5 @@
+-- migration: no-transaction
+-- Отчеты и напоминания выбирают участников по marathon_id,
+-- а первичный ключ (user_id, marathon_id) для этого не подходит.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_marathon_participants_marathon
+ON marathon_participants(marathon_id);
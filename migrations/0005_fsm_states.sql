@@ -0,0 +1,16 @@
+-- Состояния FSM aiogram (PostgresStorage): переживают перезапуск бота
+-- и общие для всех процессов. thread_id = 0 означает чат без тем.
+CREATE TABLE IF NOT EXISTS fsm_states (
+    bot_id BIGINT NOT NULL,
+    chat_id BIGINT NOT NULL,
+    user_id BIGINT NOT NULL,
+    thread_id BIGINT NOT NULL DEFAULT 0,
+    destiny VARCHAR(64) NOT NULL DEFAULT 'default',
+    state VARCHAR(255),
+    data JSONB NOT NULL DEFAULT '{}',
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (bot_id, chat_id, user_id, thread_id, destiny)
+);
+
+-- Очистка устаревших состояний
+CREATE INDEX IF NOT EXISTS idx_fsm_states_updated_at ON fsm_states(updated_at);
@@ -0,0 +1,9 @@
+-- Общие для всех процессов счетчики ограничения частоты запросов
+-- (ThrottlingMiddleware в режиме THROTTLE_SHARED)
+CREATE TABLE IF NOT EXISTS throttle_buckets (
+    user_id BIGINT NOT NULL,
+    bucket VARCHAR(32) NOT NULL,
+    tokens DOUBLE PRECISION NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, bucket)
+);
@@ -0,0 +1,43 @@
+# migrations/0007_active_sessions.py
+"""Не больше одной незавершенной сессии на пользователя и пометка автозакрытых сессий"""
+from migrations import create_index_concurrently
+
+# Индексы строятся конкурентно, без блокировки записи в партиции
+TRANSACTIONAL = False
+
+async def upgrade(conn):
+    await conn.execute('''
+        ALTER TABLE sessions ADD COLUMN IF NOT EXISTS auto_closed BOOLEAN NOT NULL DEFAULT FALSE
+    ''')
+    
+    # Лишние незавершенные сессии (остается самая поздняя) закрываем
+    # так же, как это делает очистка зависших сессий
+    await conn.execute('''
+        UPDATE sessions s
+        SET end_time = s.start_time,
+            duration = 0,
+            auto_closed = TRUE
+        WHERE s.end_time IS NULL
+            AND EXISTS (
+                SELECT 1 FROM sessions n
+                WHERE n.user_id = s.user_id
+                    AND n.end_time IS NULL
+                    AND (n.start_time, n.session_id) > (s.start_time, s.session_id)
+            )
+    ''')
+    
+    # Частичный уникальный индекс на каждой годовой партиции sessions_yYYYY
+    partitions = await conn.fetch('''
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'sessions'::regclass
+        ORDER BY c.relname
+    ''')
+    for row in partitions:
+        partition = row['relname']
+        if partition.startswith('sessions_y'):
+            await create_index_concurrently(
+                conn, f"{partition}_active_user", partition,
+                'user_id', where='end_time IS NULL', unique=True
+            )
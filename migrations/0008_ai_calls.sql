@@ -0,0 +1,17 @@
+-- Журнал вызовов ИИ (AICallLedger): токены, задержка и статус каждого
+-- запроса по функции бота, провайдеру и модели
+CREATE TABLE IF NOT EXISTS ai_calls (
+    call_id BIGSERIAL PRIMARY KEY,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    feature VARCHAR(32) NOT NULL,
+    provider VARCHAR(32) NOT NULL,
+    model VARCHAR(128),
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER,
+    latency_ms INTEGER NOT NULL,
+    status VARCHAR(32) NOT NULL,
+    cache_hit BOOLEAN NOT NULL DEFAULT FALSE
+);
+
+-- Отчет по дням
+CREATE INDEX IF NOT EXISTS idx_ai_calls_created_at ON ai_calls(created_at);
@@ -0,0 +1,49 @@
+-- Не больше одной незавершенной сессии на пользователя во всей таблице.
+-- Частичный уникальный индекс из 0007 действует только внутри годовой
+-- партиции, поэтому сессии, начатые 31 декабря и 1 января, его обходят.
+-- Незавершенные сессии дублируются в несекционированной active_sessions,
+-- а ее первичный ключ не дает начать вторую. Таблицу ведет триггер, так что
+-- ограничение действует для любого пути записи в sessions.
+CREATE TABLE IF NOT EXISTS active_sessions (
+    user_id BIGINT PRIMARY KEY,
+    session_id INTEGER NOT NULL,
+    start_time TIMESTAMP NOT NULL
+);
+
+-- Лишние незавершенные сессии из разных партиций (остается самая поздняя)
+-- закрываем так же, как это делает очистка зависших сессий
+UPDATE sessions s
+SET end_time = s.start_time,
+    duration = 0,
+    auto_closed = TRUE
+WHERE s.end_time IS NULL
+    AND EXISTS (
+        SELECT 1 FROM sessions n
+        WHERE n.user_id = s.user_id
+            AND n.end_time IS NULL
+            AND (n.start_time, n.session_id) > (s.start_time, s.session_id)
+    );
+
+INSERT INTO active_sessions (user_id, session_id, start_time)
+SELECT user_id, session_id, start_time FROM sessions WHERE end_time IS NULL
+ON CONFLICT (user_id) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION sessions_track_active() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.end_time IS NULL THEN
+        DELETE FROM active_sessions
+        WHERE user_id = OLD.user_id AND session_id = OLD.session_id;
+    END IF;
+    -- Вторая незавершенная сессия пользователя: unique_violation
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.end_time IS NULL THEN
+        INSERT INTO active_sessions (user_id, session_id, start_time)
+        VALUES (NEW.user_id, NEW.session_id, NEW.start_time);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS sessions_track_active ON sessions;
+CREATE TRIGGER sessions_track_active
+AFTER INSERT OR UPDATE OF end_time, user_id, start_time OR DELETE ON sessions
+FOR EACH ROW EXECUTE FUNCTION sessions_track_active();
@@ -0,0 +1,295 @@
+# migrations/__init__.py
+"""
+Версионированные миграции схемы БД.
+
+Файлы миграций лежат в этой папке и называются NNNN_описание.sql или
+NNNN_описание.py. Номер - версия схемы, миграции применяются по возрастанию
+и записываются в таблицу schema_version.
+
+- .sql файл выполняется целиком в одной транзакции. Если первая строка файла
+  "-- migration: no-transaction", операторы выполняются по одному вне
+  транзакции (нужно для CREATE INDEX CONCURRENTLY). Такие файлы должны быть
+  идемпотентными (IF NOT EXISTS) и не содержать DO-блоков.
+- .py файл должен определять async def upgrade(conn) и по умолчанию
+  выполняется в транзакции. Переменная TRANSACTIONAL = False отключает ее.
+
+Пока один экземпляр применяет миграции, остальные ждут advisory-блокировку
+опросом pg_try_advisory_lock, а не в блокирующем pg_advisory_lock: ожидающий
+запрос держит снимок, и CREATE INDEX CONCURRENTLY ждал бы его бесконечно.
+
+Миграции не импортируют database: вспомогательные функции DDL лежат здесь
+или в самом файле миграции, чтобы изменения приложения не меняли уже
+примененные миграции.
+"""
+import asyncio
+import importlib.util
+import logging
+import os
+import re
+from datetime import date
+from typing import List, NamedTuple, Optional
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = os.path.dirname(os.path.abspath(__file__))
+MIGRATION_FILE_RE = re.compile(r"^(\d{4})_([a-z0-9_]+)\.(sql|py)$")
+NO_TRANSACTION_MARKER = "-- migration: no-transaction"
+
+# Ключ pg_advisory_lock: миграции выполняет только один экземпляр бота
+MIGRATION_LOCK_KEY = 0x6D656469  # "medi"
+MIGRATION_LOCK_POLL_INTERVAL = 0.5  # секунд между попытками взять блокировку
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    path: str
+    kind: str
+
+def discover_migrations(directory: str = MIGRATIONS_DIR) -> List[Migration]:
+    """Список файлов миграций, отсортированный по версии"""
+    migrations = []
+    for filename in os.listdir(directory):
+        match = MIGRATION_FILE_RE.match(filename)
+        if match:
+            migrations.append(Migration(
+                version=int(match.group(1)),
+                name=match.group(2),
+                path=os.path.join(directory, filename),
+                kind=match.group(3)
+            ))
+    
+    migrations.sort(key=lambda m: m.version)
+    versions = [m.version for m in migrations]
+    if len(versions) != len(set(versions)):
+        raise RuntimeError(f"Duplicate migration versions in {directory}")
+    return migrations
+
+async def get_schema_version(conn) -> int:
+    """Текущая версия схемы (0, если миграции еще не применялись)"""
+    try:
+        return await conn.fetchval('SELECT COALESCE(MAX(version), 0) FROM schema_version')
+    except asyncpg.UndefinedTableError:
+        return 0
+
+async def apply_migrations(pool, directory: str = MIGRATIONS_DIR) -> int:
+    """Применить недостающие миграции. Возвращает итоговую версию схемы.
+    
+    При актуальной схеме выполняется один запрос версии.
+    """
+    migrations = discover_migrations(directory)
+    latest = migrations[-1].version if migrations else 0
+    
+    async with pool.acquire() as conn:
+        if await get_schema_version(conn) >= latest:
+            return latest
+        
+        await _acquire_migration_lock(conn)
+        try:
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    name VARCHAR(255) NOT NULL,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            
+            # Другой экземпляр мог применить миграции, пока мы ждали блокировку
+            current = await get_schema_version(conn)
+            for migration in migrations:
+                if migration.version <= current:
+                    continue
+                
+                logger.info("Applying migration %04d_%s", migration.version, migration.name)
+                await _apply_migration(conn, migration)
+                current = migration.version
+        finally:
+            await conn.execute('SELECT pg_advisory_unlock($1)', MIGRATION_LOCK_KEY)
+    
+    return latest
+
+async def _acquire_migration_lock(conn):
+    """Взять блокировку миграций, не держа снимок во время ожидания"""
+    while not await conn.fetchval('SELECT pg_try_advisory_lock($1)', MIGRATION_LOCK_KEY):
+        await asyncio.sleep(MIGRATION_LOCK_POLL_INTERVAL)
+
+async def drop_invalid_indexes(conn) -> List[str]:
+    """Удалить невалидные индексы, оставшиеся от прерванного CREATE INDEX CONCURRENTLY.
+    
+    Вызывается под блокировкой миграций, поэтому незавершенных построений
+    индексов в этот момент нет. IF NOT EXISTS при повторном запуске оставил бы
+    такой индекс как есть. Вызывать вне транзакции.
+    """
+    rows = await conn.fetch('''
+        SELECT format('%I.%I', n.nspname, c.relname) AS name, c.relkind
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE NOT i.indisvalid AND n.nspname = current_schema()
+        -- Индексы партиций удаляются вместе с родительским
+        ORDER BY c.relkind = 'I' DESC
+    ''')
+    
+    dropped = []
+    for row in rows:
+        # Секционированный индекс (relkind 'I') нельзя удалить конкурентно
+        concurrently = '' if row['relkind'] == 'I' else 'CONCURRENTLY '
+        await conn.execute(f"DROP INDEX {concurrently}IF EXISTS {row['name']}")
+        logger.warning("Dropped invalid index %s left by an interrupted migration", row['name'])
+        dropped.append(row['name'])
+    return dropped
+
+async def _apply_migration(conn, migration: Migration):
+    """Применение одной миграции и запись версии"""
+    record_sql = 'INSERT INTO schema_version (version, name) VALUES ($1, $2)'
+    
+    if migration.kind == 'sql':
+        with open(migration.path, encoding='utf-8') as f:
+            sql = f.read()
+        
+        if sql.startswith(NO_TRANSACTION_MARKER):
+            await drop_invalid_indexes(conn)
+            for statement in _split_statements(sql):
+                await conn.execute(statement)
+            await conn.execute(record_sql, migration.version, migration.name)
+        else:
+            async with conn.transaction():
+                await conn.execute(sql)
+                await conn.execute(record_sql, migration.version, migration.name)
+        return
+    
+    module = _load_python_migration(migration)
+    if getattr(module, 'TRANSACTIONAL', True):
+        async with conn.transaction():
+            await module.upgrade(conn)
+            await conn.execute(record_sql, migration.version, migration.name)
+    else:
+        await drop_invalid_indexes(conn)
+        await module.upgrade(conn)
+        await conn.execute(record_sql, migration.version, migration.name)
+
+def _load_python_migration(migration: Migration):
+    """Загрузка .py миграции (имя файла начинается с цифры, обычный import не подходит)"""
+    spec = importlib.util.spec_from_file_location(
+        f"migrations.m{migration.version:04d}_{migration.name}", migration.path
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def _split_statements(sql: str) -> List[str]:
+    """Разбиение SQL без DO-блоков на отдельные операторы"""
+    lines = [line for line in sql.splitlines() if not line.strip().startswith('--')]
+    return [stmt.strip() for stmt in '\n'.join(lines).split(';') if stmt.strip()]
+
+async def create_index_concurrently(conn, name: str, table: str, columns: str,
+                                    where: Optional[str] = None, unique: bool = False):
+    """Создание индекса без блокировки записи.
+    
+    Для секционированной таблицы CONCURRENTLY недоступен, поэтому индекс
+    создается на родителе через ON ONLY, затем конкурентно на каждой партиции
+    и присоединяется к родительскому. Вызывать вне транзакции.
+    """
+    unique_sql = 'UNIQUE ' if unique else ''
+    where_sql = f' WHERE {where}' if where else ''
+    
+    # Незавершенный CONCURRENTLY оставляет невалидный индекс - пересоздаем его
+    async def drop_invalid(index_name: str):
+        invalid = await conn.fetchval('''
+            SELECT NOT indisvalid FROM pg_index
+            WHERE indexrelid = to_regclass($1)
+        ''', index_name)
+        if invalid:
+            await conn.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {index_name}')
+    
+    relkind = await conn.fetchval(
+        'SELECT relkind FROM pg_class WHERE oid = to_regclass($1)', table
+    )
+    
+    if relkind != 'p':
+        await drop_invalid(name)
+        await conn.execute(
+            f'CREATE {unique_sql}INDEX CONCURRENTLY IF NOT EXISTS {name} '
+            f'ON {table} ({columns}){where_sql}'
+        )
+        return
+    
+    await conn.execute(
+        f'CREATE {unique_sql}INDEX IF NOT EXISTS {name} '
+        f'ON ONLY {table} ({columns}){where_sql}'
+    )
+    
+    partitions = await conn.fetch('''
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = $1::regclass
+    ''', table)
+    
+    for partition in partitions:
+        partition_index = f"{partition['relname']}_{name}"
+        await drop_invalid(partition_index)
+        await conn.execute(
+            f'CREATE {unique_sql}INDEX CONCURRENTLY IF NOT EXISTS {partition_index} '
+            f'ON {partition["relname"]} ({columns}){where_sql}'
+        )
+        
+        attached = await conn.fetchval('''
+            SELECT EXISTS(
+                SELECT 1 FROM pg_inherits
+                WHERE inhrelid = to_regclass($1) AND inhparent = to_regclass($2)
+            )
+        ''', partition_index, name)
+        if not attached:
+            await conn.execute(f'ALTER INDEX {name} ATTACH PARTITION {partition_index}')
+
+async def create_partitioned_table(conn, table: str, ddl: str, sequence: str, *,
+                                   id_column: str, key_column: str, columns: str,
+                                   legacy_indexes: tuple, create_partitions):
+    """Создание секционированной таблицы.
+    
+    Старая несекционированная таблица переносится в новую целиком.
+    create_partitions(conn, first_day) создает партиции начиная с first_day.
+    Используется уже примененными миграциями, поэтому не меняется.
+    """
+    await conn.execute(f'CREATE SEQUENCE IF NOT EXISTS {sequence}')
+    
+    relkind = await conn.fetchval('''
+        SELECT relkind FROM pg_class
+        WHERE oid = to_regclass($1)
+    ''', table)
+    
+    if relkind is None:
+        await conn.execute(ddl)
+        await conn.execute(f'ALTER SEQUENCE {sequence} OWNED BY {table}.{id_column}')
+        await create_partitions(conn, date.today())
+        return
+    
+    if relkind == 'p':
+        return
+    
+    # Обычная таблица из старой версии схемы - переносим данные в партиции
+    legacy = f'{table}_legacy'
+    await conn.execute(f'''
+        ALTER TABLE {table} RENAME TO {legacy};
+        ALTER TABLE {legacy} RENAME CONSTRAINT {table}_pkey TO {legacy}_pkey;
+        ALTER TABLE {legacy} ALTER COLUMN {id_column} DROP DEFAULT;
+    ''')
+    for index in legacy_indexes:
+        await conn.execute(f'DROP INDEX IF EXISTS {index}')
+    
+    await conn.execute(ddl)
+    await conn.execute(f'ALTER SEQUENCE {sequence} OWNED BY {table}.{id_column}')
+    
+    oldest = await conn.fetchval(f'SELECT MIN({key_column}) FROM {legacy}')
+    await create_partitions(conn, min(oldest.date(), date.today()) if oldest else date.today())
+    
+    await conn.execute(f'''
+        INSERT INTO {table} ({columns})
+        SELECT {columns.replace(key_column, f'COALESCE({key_column}, CURRENT_TIMESTAMP)')}
+        FROM {legacy}
+    ''')
+    await conn.execute(f'DROP TABLE {legacy}')
+    
+    logger.info("%s converted to partitioned table", table)
@@ -0,0 +1,106 @@
+# models.py
+"""Записи, которые возвращает Database.
+
+NamedTuple создаются прямо из asyncpg.Record без промежуточного dict,
+занимают меньше памяти и дают проверку имен полей в IDE и mypy.
+Поля, которых нет в выборке, получают значения по умолчанию.
+"""
+from datetime import date, datetime
+from decimal import Decimal
+from typing import List, NamedTuple, Optional, Union
+
+Number = Union[int, float, Decimal]
+
+def _from_record(cls, row):
+    """Экземпляр cls из записи БД; лишние колонки игнорируются"""
+    defaults = cls._field_defaults
+    return cls._make([row.get(name, defaults.get(name)) for name in cls._fields])
+
+class Session(NamedTuple):
+    """Сессия медитации или архивная сводка за день (session_id = None)"""
+    session_id: Optional[int]
+    user_id: int
+    start_time: datetime
+    end_time: Optional[datetime] = None
+    duration: Optional[int] = None
+    comment: Optional[str] = None
+    rating: Optional[int] = None
+    marathon_id: Optional[int] = None
+    sessions_count: int = 1
+    rating_count: int = 1  # оценок в rating (у архивной строки - за весь день)
+    rating_sum: Optional[int] = None  # сумма оценок; None - выборка без этой колонки
+    auto_closed: bool = False
+    
+    from_record = classmethod(_from_record)
+
+class StoppedSession(NamedTuple):
+    """Завершенная сессия, ожидающая комментария и оценки"""
+    session_id: int
+    end_time: datetime
+    duration: int
+
+class UserStats(NamedTuple):
+    total_sessions: int
+    total_duration: int
+    avg_rating: Number
+    
+    from_record = classmethod(_from_record)
+
+class MonthlyStats(NamedTuple):
+    sessions_count: int
+    total_duration: int
+    avg_rating: Number
+    active_days: int
+    
+    from_record = classmethod(_from_record)
+
+class DailyStats(NamedTuple):
+    sessions_count: int
+    total_duration: int
+    avg_rating: Number
+    max_rating: int
+    sessions: List[Session]
+
+class SessionHistory(NamedTuple):
+    """Вся история пользователя по колонкам в порядке start_time.
+    
+    start_ts - секунды от эпохи для локального времени начала (без часового
+    пояса), archived - признак архивной сводки за день.
+    """
+    start_ts: List[float]
+    durations: List[Optional[int]]
+    ratings: List[Optional[float]]
+    counts: List[int]
+    archived: List[bool]
+    
+    from_record = classmethod(_from_record)
+
+class Streaks(NamedTuple):
+    current_streak: int
+    longest_streak: int
+    active_days: int
+    consistency: float
+
+class Marathon(NamedTuple):
+    marathon_id: int
+    title: str
+    description: Optional[str]
+    start_date: date
+    end_date: date
+    daily_goal: int
+    created_at: Optional[datetime] = None
+    
+    from_record = classmethod(_from_record)
+
+class MarathonProgress(NamedTuple):
+    total_days: int
+    completed_days: int
+    sessions_count: int
+    daily_goal: int
+
+class DialogueMessage(NamedTuple):
+    content: str
+    is_user: bool
+    created_at: datetime
+    
+    from_record = classmethod(_from_record)
@@ -0,0 +1,200 @@
+# profiling.py
+"""Профилирование бота в работе без перезапуска.
+
+- SamplingProfiler: фоновый поток раз в interval снимает стек главного
+  потока (sys._current_frames). Работает только во время снятия профиля,
+  в остальное время затрат нет.
+- LoopLagMonitor: задержка цикла событий. Корутина-пульс отмечается каждые
+  interval секунд, поток-сторож при пропуске пульса дольше threshold
+  записывает в лог стек кода, который блокирует цикл.
+- profile_call: cProfile на время одного вызова (используется для профиля
+  одного обновления). Профилируется весь поток, то есть все задачи цикла
+  событий, а одновременно снимается не больше одного профиля.
+"""
+import asyncio
+import cProfile
+import io
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# cProfile ставит один профилировщик на поток: второй включенный профиль
+# отключил бы первый, поэтому профили не пересекаются
+_profile_active = False
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+def _stack(frame) -> Tuple[str, ...]:
+    """Стек от внешнего вызова к текущему"""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return tuple(reversed(labels))
+
+class SamplingProfiler:
+    """Семплирующий профилировщик главного потока"""
+    
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self._lock = asyncio.Lock()
+    
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+    
+    async def capture(self, seconds: float) -> str:
+        """Снять профиль за seconds секунд; возвращает текстовый отчет"""
+        async with self._lock:
+            samples: Counter = Counter()
+            stop = threading.Event()
+            thread_id = threading.get_ident()
+            
+            def sample():
+                while not stop.wait(self.interval):
+                    frame = sys._current_frames().get(thread_id)
+                    if frame is not None:
+                        samples[_stack(frame)] += 1
+            
+            sampler = threading.Thread(target=sample, name="sampling-profiler", daemon=True)
+            started = time.perf_counter()
+            sampler.start()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                stop.set()
+                await asyncio.to_thread(sampler.join)
+            
+            return self.format_report(samples, time.perf_counter() - started)
+    
+    def format_report(self, samples: Counter, elapsed: float, top: int = 40) -> str:
+        total = sum(samples.values())
+        own: Counter = Counter()
+        cumulative: Counter = Counter()
+        for stack, count in samples.items():
+            own[stack[-1]] += count
+            # Cumulative - по функции целиком, без номера строки
+            for label in {label.rsplit(':', 1)[0] + ')' for label in stack}:
+                cumulative[label] += count
+        
+        out = io.StringIO()
+        out.write(f"Sampling profile: {elapsed:.1f} s, {total} samples, interval {self.interval * 1000:.0f} ms\n")
+        out.write("Время ожидания в select/epoll - простой цикла событий, а не нагрузка.\n\n")
+        
+        for title, counter in (("Собственное время (self)", own), ("С вложенными вызовами (cumulative)", cumulative)):
+            out.write(f"{title}:\n")
+            for label, count in counter.most_common(top):
+                out.write(f"{count / total * 100 if total else 0:6.1f}% {count:7d}  {label}\n")
+            out.write("\n")
+        
+        # Свернутые стеки для flamegraph.pl / speedscope
+        out.write("Folded stacks:\n")
+        for stack, count in samples.most_common():
+            out.write(f"{';'.join(stack)} {count}\n")
+        return out.getvalue()
+
+class LoopLagMonitor:
+    """Задержка цикла событий и стеки блокирующего кода"""
+    
+    def __init__(self, threshold: float = 0.1, interval: float = 0.05, keep: int = 20):
+        self.threshold = threshold
+        self.interval = interval
+        self.max_lag = 0.0
+        self.total_lag = 0.0
+        self.beats = 0
+        self.stalls = 0
+        self.recent_stalls: deque = deque(maxlen=keep)
+        self._beat = time.monotonic()
+        self._thread_id: Optional[int] = None
+        self._stop = threading.Event()
+    
+    async def run(self):
+        """Пульс цикла событий; запускается через asyncio.create_task"""
+        self._thread_id = threading.get_ident()
+        watchdog = threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True)
+        watchdog.start()
+        try:
+            while True:
+                expected = time.monotonic() + self.interval
+                self._beat = time.monotonic()
+                await asyncio.sleep(self.interval)
+                lag = max(0.0, time.monotonic() - expected)
+                self.beats += 1
+                self.total_lag += lag
+                self.max_lag = max(self.max_lag, lag)
+        finally:
+            self._stop.set()
+    
+    def _watch(self):
+        """Поток-сторож: один снимок стека на каждое зависание"""
+        reported_beat = None
+        while not self._stop.wait(self.threshold / 2):
+            beat = self._beat
+            blocked = time.monotonic() - beat
+            if blocked < self.threshold + self.interval or beat == reported_beat:
+                continue
+            
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None:
+                continue
+            reported_beat = beat
+            self.stalls += 1
+            stack = "".join(traceback.format_stack(frame))
+            self.recent_stalls.append({'at': time.strftime('%H:%M:%S'), 'blocked_ms': blocked * 1000, 'stack': stack})
+            logger.warning("Event loop blocked for %.0f ms, stack:\n%s", blocked * 1000, stack)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'avg_lag_ms': self.total_lag / self.beats * 1000 if self.beats else 0.0,
+            'max_lag_ms': self.max_lag * 1000,
+            'stalls': self.stalls,
+            'recent_stalls': list(self.recent_stalls),
+        }
+    
+    def metrics_collector(self) -> Callable[[], List[str]]:
+        """Строки для metrics.REGISTRY"""
+        def collect() -> List[str]:
+            return [
+                "# TYPE event_loop_lag_max_seconds gauge",
+                f"event_loop_lag_max_seconds {self.max_lag}",
+                "# TYPE event_loop_stalls_total counter",
+                f"event_loop_stalls_total {self.stalls}",
+            ]
+        return collect
+
+async def profile_call(call: Callable[[], Awaitable[Any]], top: int = 40) -> Tuple[Any, Optional[str]]:
+    """cProfile на время одного await-вызова.
+    
+    Профиль включается для всего потока, поэтому цифры покрывают весь цикл
+    событий: пока вызов ждет, в них попадают и другие задачи и обновления.
+    Если профиль уже снимается, вызов выполняется без него, а вместо отчета
+    возвращается None.
+    """
+    global _profile_active
+    if _profile_active:
+        return await call(), None
+    
+    _profile_active = True
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        result = await call()
+    finally:
+        profile.disable()
+        _profile_active = False
+    
+    out = io.StringIO()
+    stats = pstats.Stats(profile, stream=out)
+    stats.sort_stats("cumulative").print_stats(top)
+    stats.sort_stats("tottime").print_stats(top)
+    return result, out.getvalue()
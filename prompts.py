@@ -77,14 +77,27 @@ MARATHON_SUMMARY_PROMPT = """Создай мотивирующий итогов
 Отчет должен быть позитивным, отмечать достижения и мотивировать на дальнейшую практику."""
 
 # Промпт для анализа прогресса
-PROGRESS_ANALYSIS_PROMPT = """Проанализируй прогресс пользователя в медитации:
-- Всего медитаций: {total_sessions}
+PROGRESS_ANALYSIS_PROMPT = """Проанализируй прогресс пользователя в медитации.
+
+Общие итоги:
+- Всего медитаций: {total_sessions}, дней с практикой: {active_days}
 - Общее время: {total_duration} минут
 - Средняя оценка: {avg_rating}/10
 - Медитаций за последний месяц: {month_sessions}
-- Тренд оценок: {rating_trend}
 
-Дай краткий анализ (3-4 предложения) и практические рекомендации для улучшения практики."""
+Динамика:
+- Средняя оценка последних 7 медитаций: {rolling_short} (предыдущих 7: {previous_short})
+- Средняя оценка последних 30 медитаций: {rolling_long}
+- Тренд оценок за последние 90 дней: {rating_trend}
+- Тренд длительности за последние 90 дней: {duration_trend}
+
+Закономерности:
+- Связь длительности и оценки: {duration_correlation}
+- По времени суток: {time_of_day}
+- По дням недели: {weekdays}
+- По длительности: {duration_buckets}
+
+Дай краткий анализ (3-4 предложения), опираясь на найденные закономерности, а не пересказывая цифры, и практические рекомендации для улучшения практики."""
 
 # Промпт для ежедневных напоминаний
 DAILY_REMINDER_PROMPT = """Создай дружелюбное напоминание о медитации для пользователя.
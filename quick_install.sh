@@ -52,7 +52,7 @@ source $VENV_DIR/bin/activate
 
 print_step "4. Обновление pip и установка зависимостей"
 pip install --upgrade pip
-pip install aiogram==3.3.0 asyncpg==0.29.0 aiohttp==3.9.1 python-dotenv==1.0.0 pytz==2024.1
+pip install aiogram==3.3.0 asyncpg==0.29.0 aiohttp==3.9.1 python-dotenv==1.0.0 pytz==2024.1 numpy==1.26.4 matplotlib==3.8.2
 
 print_step "5. Создание requirements.txt"
 cat > $BOT_DIR/requirements.txt << 'EOF'
@@ -61,6 +61,8 @@ asyncpg==0.29.0
 aiohttp==3.9.1
 python-dotenv==1.0.0
 pytz==2024.1
+numpy==1.26.4
+matplotlib==3.8.2
 EOF
 
 print_step "6. Настройка PostgreSQL"
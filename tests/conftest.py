@@ -0,0 +1,78 @@
+# tests/conftest.py
+"""Общие фикстуры тестов.
+
+Асинхронные тесты выполняются в собственном цикле событий (asyncio.run),
+отдельный плагин для этого не нужен. Тесты с настоящей БД используют
+фикстуру database: она создает временную схему в PostgreSQL из
+TEST_DATABASE_URL и удаляет ее после теста. Без этой переменной такие
+тесты пропускаются.
+"""
+import asyncio
+import inspect
+import os
+import uuid
+from contextlib import asynccontextmanager
+from urllib.parse import urlencode, urlsplit, urlunsplit
+
+import pytest
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_pyfunc_call(pyfuncitem):
+    if not inspect.iscoroutinefunction(pyfuncitem.obj):
+        return None
+    
+    arguments = {name: pyfuncitem.funcargs[name] for name in pyfuncitem._fixtureinfo.argnames}
+    asyncio.run(pyfuncitem.obj(**arguments))
+    return True
+
+def _with_search_path(url: str, schema: str) -> str:
+    """URL, в котором схема по умолчанию - schema (asyncpg передает параметр серверу)"""
+    parts = urlsplit(url)
+    query = "&".join(filter(None, [parts.query, urlencode({"search_path": schema})]))
+    return urlunsplit(parts._replace(query=query))
+
+@pytest.fixture
+def database():
+    """Фабрика Database на временной схеме: async with database() as db"""
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    
+    import asyncpg
+    from database import Database
+    
+    @asynccontextmanager
+    async def create(prepare=None):
+        schema = f"test_{uuid.uuid4().hex[:12]}"
+        admin = await asyncpg.connect(TEST_DATABASE_URL)
+        await admin.execute(f"CREATE SCHEMA {schema}")
+        try:
+            if prepare is not None:
+                # Состояние БД до миграций (например, таблицы старой версии)
+                conn = await asyncpg.connect(_with_search_path(TEST_DATABASE_URL, schema))
+                try:
+                    await prepare(conn)
+                finally:
+                    await conn.close()
+            
+            db = Database(_with_search_path(TEST_DATABASE_URL, schema), min_size=1, max_size=4)
+            await db.init()
+            try:
+                yield db
+            finally:
+                await db.close()
+        finally:
+            await admin.execute(f"DROP SCHEMA {schema} CASCADE")
+            await admin.close()
+    
+    return create
+
+class FakeUser:
+    def __init__(self, user_id: int):
+        self.id = user_id
+
+class FakeHandler:
+    """Обработчик aiogram с флагами (для get_flag)"""
+    def __init__(self, **flags):
+        self.flags = flags
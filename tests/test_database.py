@@ -0,0 +1,185 @@
+# tests/test_database.py
+"""Тесты Database на настоящем PostgreSQL (TEST_DATABASE_URL, см. conftest)"""
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from database import (ACTIVE_SESSION_SQL, ActiveSessionExists, create_active_session_index,
+                      create_sessions_partition, list_partitions)
+from utils import MarathonManager, average_rating
+
+# Схема до секционирования sessions: миграции должны перенести данные в партиции
+LEGACY_SCHEMA = '''
+    CREATE TABLE users (
+        user_id BIGINT PRIMARY KEY,
+        username VARCHAR(255),
+        first_name VARCHAR(255),
+        last_name VARCHAR(255),
+        joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        timezone VARCHAR(50) DEFAULT 'UTC'
+    );
+    CREATE TABLE sessions (
+        session_id SERIAL PRIMARY KEY,
+        user_id BIGINT REFERENCES users(user_id),
+        start_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        end_time TIMESTAMP,
+        duration INTEGER,
+        comment TEXT,
+        rating INTEGER,
+        marathon_id INTEGER
+    );
+    INSERT INTO users (user_id) VALUES (1);
+    INSERT INTO sessions (user_id, start_time, end_time, duration, rating) VALUES
+        (1, '2021-03-01 08:00', '2021-03-01 08:20', 20, 7),
+        (1, LOCALTIMESTAMP - INTERVAL '1 hour', LOCALTIMESTAMP - INTERVAL '30 minutes', 30, 9);
+'''
+
+async def _add_user(db, user_id: int):
+    await db.create_user(user_id, None, f"user{user_id}", None)
+
+async def test_legacy_sessions_move_into_yearly_partitions(database):
+    async def prepare(conn):
+        await conn.execute(LEGACY_SCHEMA)
+    
+    async with database(prepare) as db:
+        async with db.acquire('test') as conn:
+            relkind = await conn.fetchval("SELECT relkind FROM pg_class WHERE oid = 'sessions'::regclass")
+            partitions = await list_partitions(conn, 'sessions')
+            rows = await conn.fetch('SELECT session_id, duration FROM sessions ORDER BY start_time')
+        
+        assert relkind == 'p'
+        assert {'sessions_y2021', f'sessions_y{date.today().year}'} <= set(partitions)
+        assert [(row['session_id'], row['duration']) for row in rows] == [(1, 20), (2, 30)]
+        
+        # Новые сессии продолжают нумерацию старой таблицы
+        assert await db.create_session(1) == 3
+
+async def test_hot_statements_are_prepared_on_first_use(database):
+    async with database() as db:
+        await _add_user(db, 1)
+        # Соединения пула открыты до миграций, но запросы готовятся при первом вызове
+        async with db.acquire('test') as conn:
+            assert await conn.fetchrow(ACTIVE_SESSION_SQL, 1) is None
+            assert ACTIVE_SESSION_SQL in conn.hot_statements
+
+async def test_stop_then_finalize(database):
+    async with database() as db:
+        await _add_user(db, 1)
+        session_id = await db.create_session(1)
+        active = await db.get_active_session(1)
+        
+        stopped = await db.stop_session(active)
+        assert stopped.session_id == session_id
+        assert stopped.duration == 0
+        
+        # Длительность записана до опроса: очистка забытых сессий ее не тронет
+        saved = await db.get_session_by_id(session_id)
+        assert saved.end_time == stopped.end_time
+        assert saved.rating is None
+        assert await db.close_stale_sessions(0) == []
+        
+        # Повторная остановка (например, из другого процесса) ничего не меняет
+        assert await db.stop_session(active) is None
+        assert await db.get_active_session(1) is None
+        
+        assert await db.finalize_session(session_id, comment="спокойно", rating=8)
+        saved = await db.get_session_by_id(session_id)
+        assert (saved.comment, saved.rating, saved.duration) == ("спокойно", 8, 0)
+        
+        assert not await db.finalize_session(session_id + 1000, rating=5)
+
+async def test_second_open_session_in_another_partition_is_rejected(database):
+    async with database() as db:
+        await _add_user(db, 1)
+        last_year = date.today().year - 1
+        new_year_eve = datetime(last_year, 12, 31, 23, 50)
+        async with db.acquire('test') as conn:
+            await create_sessions_partition(conn, last_year)
+            await create_active_session_index(conn, f"sessions_y{last_year}")
+            await conn.execute('INSERT INTO sessions (user_id, start_time) VALUES ($1, $2)', 1, new_year_eve)
+        
+        # Частичный индекс партиции текущего года эту сессию не видит
+        with pytest.raises(ActiveSessionExists) as error:
+            await db.create_session(1)
+        assert error.value.session.start_time == new_year_eve
+        
+        assert await db.stop_session(error.value.session) is not None
+        session_id = await db.create_session(1)
+        assert (await db.get_active_session(1)).session_id == session_id
+
+async def test_archive_aggregates_finished_sessions_by_day(database):
+    async with database() as db:
+        await _add_user(db, 1)
+        year = date.today().year - 3
+        morning = datetime(year, 5, 10, 8, 0)
+        await db.create_manual_session(1, morning, 10, rating=6)
+        await db.create_manual_session(1, morning + timedelta(hours=2), 20, rating=9)
+        await db.create_manual_session(1, morning + timedelta(hours=4), 30)
+        await db.create_manual_session(1, morning + timedelta(days=1), 15)
+        
+        assert await db.archive_old_sessions(archive_after_days=365) == 1
+        
+        sessions = await db.get_sessions_by_month(1, year, 5)
+        assert [
+            (s.session_id, s.sessions_count, s.duration, s.rating, s.rating_sum, s.rating_count)
+            for s in sessions
+        ] == [
+            (None, 3, 60, 8, 15, 2),  # для показа средняя 7.5 округляется
+            (None, 1, 15, None, 0, 0),
+        ]
+        assert average_rating(sessions) == 7.5
+        
+        daily = await db.get_daily_stats(1, morning.date())
+        assert (daily.sessions_count, daily.total_duration, daily.avg_rating) == (3, 60, 7.5)
+        
+        stats = await db.get_user_stats(1)
+        assert stats.avg_rating == 7.5
+        
+        async with db.acquire('test') as conn:
+            assert f"sessions_y{year}" not in await list_partitions(conn, 'sessions')
+
+async def test_marathon_stats_include_archived_days(database):
+    async with database() as db:
+        await _add_user(db, 1)
+        year = date.today().year - 3
+        marathon_id = await db.create_marathon("Весна", "", date(year, 5, 1), date(year, 5, 31), 1)
+        morning = datetime(year, 5, 10, 8, 0)
+        await db.create_manual_session(1, morning, 10, rating=6)
+        await db.create_manual_session(1, morning + timedelta(days=1), 20, rating=9)
+        async with db.acquire('test') as conn:
+            await conn.execute('UPDATE sessions SET marathon_id = $1', marathon_id)
+        
+        assert await db.archive_old_sessions(archive_after_days=365) == 1
+        
+        manager = MarathonManager(db, ai_service=None, bot=None)
+        stats = await manager._get_marathon_user_stats(1, marathon_id)
+        assert (
+            stats['sessions_count'], stats['total_duration'], stats['avg_rating'], stats['unique_days']
+        ) == (2, 30, 7.5, 2)
+        
+        group = await manager._get_marathon_group_stats(marathon_id)
+        assert (group['active_participants'], group['total_sessions'], group['avg_duration']) == (1, 2, 15)
+
+async def test_archive_keeps_partition_with_unfinished_sessions(database):
+    async with database() as db:
+        await _add_user(db, 1)
+        await _add_user(db, 2)
+        year = date.today().year - 3
+        await db.create_manual_session(1, datetime(year, 5, 10, 8, 0), 10, rating=7)
+        async with db.acquire('test') as conn:
+            await conn.execute(
+                'INSERT INTO sessions (user_id, start_time) VALUES ($1, $2)', 2, datetime(year, 5, 11, 8, 0)
+            )
+        
+        assert await db.archive_old_sessions(archive_after_days=365) == 0
+        async with db.acquire('test') as conn:
+            assert await conn.fetchval('SELECT COUNT(*) FROM sessions') == 2
+            assert await conn.fetchval('SELECT COUNT(*) FROM sessions_archive') == 0
+        
+        # Когда забытую сессию закрывает очистка, партиция архивируется
+        closed = await db.close_stale_sessions(1)
+        assert [s.user_id for s in closed] == [2]
+        assert await db.archive_old_sessions(archive_after_days=365) == 1
+        
+        sessions = await db.get_sessions_by_month(2, year, 5)
+        assert [(s.sessions_count, s.duration, s.rating) for s in sessions] == [(1, 0, None)]
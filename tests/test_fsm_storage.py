@@ -0,0 +1,140 @@
+# tests/test_fsm_storage.py
+from contextlib import asynccontextmanager
+from datetime import date, datetime
+
+import pytest
+from aiogram.fsm.storage.base import StorageKey
+
+import fsm_storage
+from fsm_storage import LOAD_STATE_SQL, UPSERT_STATE_SQL, PostgresStorage
+from middlewares.fsm_flush import FSMFlushMiddleware
+
+KEY = StorageKey(bot_id=1, chat_id=10, user_id=10)
+
+class FakeConnection:
+    def __init__(self, db):
+        self.db = db
+    
+    @asynccontextmanager
+    async def transaction(self):
+        yield
+    
+    async def fetchrow(self, query, *args):
+        assert query == LOAD_STATE_SQL
+        self.db.loads += 1
+        return self.db.rows.get(args[:5])
+    
+    async def executemany(self, query, rows):
+        if self.db.fail:
+            self.db.fail -= 1
+            raise ConnectionError("database is down")
+        for row in rows:
+            if query == UPSERT_STATE_SQL:
+                self.db.rows[row[:5]] = {'state': row[5], 'data': row[6]}
+            else:
+                self.db.rows.pop(row[:5], None)
+
+class FakeDatabase:
+    """Таблица fsm_states в памяти, общая для нескольких PostgresStorage"""
+    
+    def __init__(self):
+        self.rows = {}
+        self.loads = 0
+        self.fail = 0
+    
+    @asynccontextmanager
+    async def acquire(self, method, **kwargs):
+        yield FakeConnection(self)
+
+async def test_changes_are_written_only_on_flush():
+    db = FakeDatabase()
+    storage = PostgresStorage(db)
+    
+    await storage.set_state(KEY, "MeditationStates:waiting_for_rating")
+    await storage.set_data(KEY, {'session_id': 5})
+    assert db.rows == {}
+    assert await storage.get_data(KEY) == {'session_id': 5}
+    
+    await storage.flush()
+    assert db.rows[(1, 10, 10, 0, 'default')]['state'] == "MeditationStates:waiting_for_rating"
+
+async def test_other_process_sees_flushed_state():
+    db = FakeDatabase()
+    first, second = PostgresStorage(db), PostgresStorage(db)
+    
+    await first.set_state(KEY, "A")
+    await first.flush()
+    assert await second.get_state(KEY) == "A"
+    
+    # Без кэша второй процесс не держит устаревшее состояние
+    await first.set_state(KEY, "B")
+    await first.flush()
+    assert await second.get_state(KEY) == "B"
+
+async def test_cache_is_opt_in():
+    db = FakeDatabase()
+    storage = PostgresStorage(db, cache_ttl=60)
+    
+    await storage.get_state(KEY)
+    await storage.get_state(KEY)
+    assert db.loads == 1
+    assert PostgresStorage(db).cache_ttl == 0
+
+async def test_empty_record_is_deleted():
+    db = FakeDatabase()
+    storage = PostgresStorage(db)
+    await storage.set_state(KEY, "A")
+    await storage.flush()
+    
+    await storage.set_state(KEY, None)
+    await storage.flush()
+    assert db.rows == {}
+
+async def test_failed_flush_keeps_newer_changes(monkeypatch):
+    monkeypatch.setattr(fsm_storage, "FLUSH_RETRY_DELAY", 3600)
+    db = FakeDatabase()
+    storage = PostgresStorage(db)
+    
+    await storage.set_state(KEY, "A")
+    db.fail = 1
+    await storage.flush()
+    assert db.rows == {}
+    
+    # Изменение после неудачной записи не затирается повтором старого пакета
+    await storage.set_state(KEY, "B")
+    await storage.close()
+    assert db.rows[(1, 10, 10, 0, 'default')]['state'] == "B"
+
+async def test_dates_round_trip():
+    db = FakeDatabase()
+    storage = PostgresStorage(db)
+    data = {'day': date(2024, 2, 29), 'at': datetime(2024, 2, 29, 7, 30)}
+    await storage.set_data(KEY, data)
+    await storage.flush()
+    
+    assert await PostgresStorage(db).get_data(KEY) == data
+
+async def test_middleware_flushes_before_returning():
+    db = FakeDatabase()
+    storage = PostgresStorage(db)
+    middleware = FSMFlushMiddleware(storage)
+    
+    async def handler(event, data):
+        await storage.set_state(KEY, "A")
+        return "handled"
+    
+    assert await middleware(handler, object(), {}) == "handled"
+    assert db.rows[(1, 10, 10, 0, 'default')]['state'] == "A"
+
+async def test_middleware_flushes_when_handler_fails():
+    db = FakeDatabase()
+    storage = PostgresStorage(db)
+    middleware = FSMFlushMiddleware(storage)
+    
+    async def handler(event, data):
+        await storage.set_state(KEY, "A")
+        raise RuntimeError("handler failed")
+    
+    with pytest.raises(RuntimeError):
+        await middleware(handler, object(), {})
+    assert db.rows[(1, 10, 10, 0, 'default')]['state'] == "A"
@@ -0,0 +1,45 @@
+# tests/test_logging_setup.py
+import logging
+
+from logging_setup import SamplingFilter, parse_sampling
+
+def _record(name: str, level: int = logging.INFO) -> logging.LogRecord:
+    return logging.LogRecord(name, level, __file__, 1, "message", (), None)
+
+def test_parse_sampling():
+    assert parse_sampling("") == {}
+    assert parse_sampling(" aiogram.event=0.1, bot.updates=1 ,") == {
+        'aiogram.event': 0.1, 'bot.updates': 1.0
+    }
+
+def test_empty_sampling_keeps_everything():
+    sampling = SamplingFilter(parse_sampling(""))
+    assert sampling.filter(_record("aiogram.event"))
+    assert sampling.dropped == 0
+
+def test_zero_rate_drops_info_of_logger_and_children():
+    sampling = SamplingFilter({"aiogram.event": 0})
+    
+    assert not sampling.filter(_record("aiogram.event"))
+    assert not sampling.filter(_record("aiogram.event.child"))
+    assert sampling.filter(_record("aiogram.events"))
+    assert sampling.filter(_record("aiogram"))
+    assert sampling.dropped == 2
+
+def test_warnings_are_never_dropped():
+    sampling = SamplingFilter({"aiogram.event": 0})
+    assert sampling.filter(_record("aiogram.event", logging.WARNING))
+    assert sampling.filter(_record("aiogram.event", logging.ERROR))
+
+def test_longest_prefix_wins():
+    sampling = SamplingFilter({"bot": 0, "bot.updates": 1})
+    assert sampling.filter(_record("bot.updates"))
+    assert not sampling.filter(_record("bot.other"))
+
+def test_partial_rate(monkeypatch):
+    values = iter([0.05, 0.5])
+    monkeypatch.setattr("logging_setup.random.random", lambda: next(values))
+    sampling = SamplingFilter({"bot.updates": 0.1})
+    
+    assert sampling.filter(_record("bot.updates"))
+    assert not sampling.filter(_record("bot.updates"))
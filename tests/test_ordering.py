@@ -0,0 +1,151 @@
+# tests/test_ordering.py
+import asyncio
+from datetime import datetime
+
+from aiogram import Bot, Dispatcher
+from aiogram.filters import ExceptionTypeFilter
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import Chat, Message, Update, User
+
+from middlewares.ordering import UpdateDropped, UserEventIsolation, drop_update
+
+def _key(user_id: int) -> StorageKey:
+    return StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+
+def _message_update(update_id: int, user_id: int, text: str) -> Update:
+    return Update(update_id=update_id, message=Message(
+        message_id=update_id,
+        date=datetime.now(),
+        chat=Chat(id=user_id, type="private"),
+        from_user=User(id=user_id, is_bot=False, first_name="test"),
+        text=text
+    ))
+
+class SlowStorage(MemoryStorage):
+    """Хранилище с задержкой чтения, как у состояния из БД"""
+    
+    async def get_state(self, key):
+        await asyncio.sleep(0.01)
+        return await super().get_state(key)
+
+async def test_updates_of_one_user_run_in_order():
+    isolation = UserEventIsolation()
+    log = []
+    
+    async def handle(event):
+        async with isolation.lock(_key(1)):
+            log.append(("start", event))
+            await asyncio.sleep(0.01 if event == 1 else 0)
+            log.append(("end", event))
+    
+    await asyncio.gather(*(handle(event) for event in (1, 2, 3)))
+    assert log == [("start", 1), ("end", 1), ("start", 2), ("end", 2), ("start", 3), ("end", 3)]
+    assert isolation.get_stats() == {"users": 0, "in_flight": 0, "processed": 3, "shed": 0}
+
+async def test_different_users_do_not_wait_for_each_other():
+    isolation = UserEventIsolation()
+    release = asyncio.Event()
+    
+    async def handle(event, user_id):
+        async with isolation.lock(_key(user_id)):
+            if event == "slow":
+                await release.wait()
+            else:
+                release.set()
+            return event
+    
+    results = await asyncio.wait_for(asyncio.gather(
+        handle("slow", 1),
+        handle("fast", 2),
+    ), timeout=1)
+    assert results == ["slow", "fast"]
+
+async def test_excess_updates_of_one_user_are_dropped():
+    isolation = UserEventIsolation(max_pending=2)
+    release = asyncio.Event()
+    handled = []
+    
+    async def handle(event):
+        try:
+            async with isolation.lock(_key(1)):
+                await release.wait()
+                handled.append(event)
+                return event
+        except UpdateDropped:
+            return None
+    
+    tasks = [asyncio.create_task(handle(event)) for event in range(4)]
+    await asyncio.sleep(0)
+    release.set()
+    
+    assert await asyncio.gather(*tasks) == [0, 1, None, None]
+    assert handled == [0, 1]
+    assert isolation.shed == 2
+
+async def test_total_limit_drops_updates_of_other_users():
+    isolation = UserEventIsolation(max_total=1)
+    release = asyncio.Event()
+    
+    async def hold():
+        async with isolation.lock(_key(1)):
+            await release.wait()
+    
+    first = asyncio.create_task(hold())
+    await asyncio.sleep(0)
+    try:
+        async with isolation.lock(_key(2)):
+            raise AssertionError("update should be dropped")
+    except UpdateDropped as error:
+        assert (error.user_id, error.pending, error.total) == (2, 0, 1)
+    
+    release.set()
+    await first
+    assert isolation.get_stats()["users"] == 0
+
+async def test_next_update_reads_state_written_by_previous():
+    isolation = UserEventIsolation()
+    dp = Dispatcher(storage=SlowStorage(), events_isolation=isolation)
+    dp.errors.register(drop_update, ExceptionTypeFilter(UpdateDropped))
+    bot = Bot("42:TEST")
+    seen = []
+    
+    @dp.message()
+    async def handle(message: Message, state: FSMContext, raw_state):
+        seen.append((message.text, raw_state))
+        if message.text == "/start":
+            await asyncio.sleep(0.01)
+            await state.set_state("waiting_comment")
+    
+    await asyncio.gather(
+        dp.feed_update(bot, _message_update(1, 7, "/start")),
+        dp.feed_update(bot, _message_update(2, 7, "comment")),
+    )
+    assert seen == [("/start", None), ("comment", "waiting_comment")]
+    assert isolation.get_stats()["processed"] == 2
+    await bot.session.close()
+
+async def test_dropped_update_is_handled_by_dispatcher():
+    isolation = UserEventIsolation(max_pending=1)
+    dp = Dispatcher(storage=MemoryStorage(), events_isolation=isolation)
+    dp.errors.register(drop_update, ExceptionTypeFilter(UpdateDropped))
+    bot = Bot("42:TEST")
+    release = asyncio.Event()
+    seen = []
+    
+    @dp.message()
+    async def handle(message: Message):
+        seen.append(message.text)
+        await release.wait()
+    
+    first = asyncio.create_task(dp.feed_update(bot, _message_update(1, 7, "first")))
+    await asyncio.sleep(0.01)
+    # Ошибка не доходит до цикла опроса: ее обрабатывает drop_update
+    await dp.feed_update(bot, _message_update(2, 7, "second"))
+    release.set()
+    await first
+    
+    assert seen == ["first"]
+    assert isolation.shed == 1
+    await bot.session.close()
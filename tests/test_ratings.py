@@ -0,0 +1,42 @@
+# tests/test_ratings.py
+from datetime import datetime
+
+from models import Session
+from utils import average_rating, format_rating
+
+def _session(rating, rating_count=1, sessions_count=1, archived=False, rating_sum=None):
+    return Session(
+        session_id=None if archived else 1, user_id=1, start_time=datetime(2024, 1, 1),
+        duration=10, rating=rating, sessions_count=sessions_count, rating_count=rating_count,
+        rating_sum=rating * rating_count if rating_sum is None and rating is not None else rating_sum
+    )
+
+def test_unrated_sessions_are_skipped():
+    sessions = [_session(8), _session(None, rating_count=0), _session(6)]
+    assert average_rating(sessions) == 7
+
+def test_archived_day_is_weighted_by_rating_count():
+    # День из архива: 3 оценки со средней 4, и одна горячая сессия с оценкой 8
+    sessions = [_session(4, rating_count=3, sessions_count=5, archived=True), _session(8)]
+    assert average_rating(sessions) == 5
+
+def test_archived_day_uses_exact_sum_not_rounded_rating():
+    # Оценки 6 и 9: для показа день округлен до 8, средняя остается 7.5
+    sessions = [_session(8, rating_count=2, sessions_count=3, archived=True, rating_sum=15)]
+    assert average_rating(sessions) == 7.5
+
+def test_archived_day_without_ratings_is_skipped():
+    sessions = [_session(None, rating_count=0, sessions_count=2, archived=True), _session(9)]
+    assert average_rating(sessions) == 9
+
+def test_no_ratings():
+    assert average_rating([_session(None, rating_count=0)]) is None
+    assert average_rating([]) is None
+    assert format_rating(None) == "нет оценок"
+    assert format_rating(7.25) == "7.2/10"
+
+def test_session_without_rating_count_column_counts_once():
+    row = {'session_id': 1, 'user_id': 1, 'start_time': datetime(2024, 1, 1), 'rating': 6}
+    session = Session.from_record(row)
+    assert session.rating_count == 1
+    assert average_rating([session]) == 6
@@ -0,0 +1,86 @@
+# tests/test_throttling.py
+from contextlib import asynccontextmanager
+
+import pytest
+
+from conftest import FakeHandler, FakeUser
+from middlewares import throttling
+from middlewares.throttling import BucketLimit, ThrottlingMiddleware
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+    
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(throttling.time, "monotonic", clock)
+    return clock
+
+async def _handler(event, data):
+    return "handled"
+
+def _data(user_id=1, bucket=None):
+    data = {"event_from_user": FakeUser(user_id)}
+    if bucket:
+        data["handler"] = FakeHandler(throttling=bucket)
+    return data
+
+async def test_burst_then_refill(clock):
+    middleware = ThrottlingMiddleware({"navigation": BucketLimit.per_minute(60, 2)})
+    
+    assert await middleware(_handler, object(), _data()) == "handled"
+    assert await middleware(_handler, object(), _data()) == "handled"
+    assert await middleware(_handler, object(), _data()) is None
+    assert middleware.throttled == 1
+    
+    # Один токен в секунду
+    clock.now += 1
+    assert await middleware(_handler, object(), _data()) == "handled"
+    assert await middleware(_handler, object(), _data()) is None
+
+async def test_buckets_are_separate_per_class_and_user(clock):
+    middleware = ThrottlingMiddleware({
+        "navigation": BucketLimit.per_minute(60, 1),
+        "llm": BucketLimit.per_minute(1, 1),
+    })
+    
+    assert await middleware(_handler, object(), _data(bucket="llm")) == "handled"
+    assert await middleware(_handler, object(), _data(bucket="llm")) is None
+    assert await middleware(_handler, object(), _data()) == "handled"
+    assert await middleware(_handler, object(), _data(user_id=2, bucket="llm")) == "handled"
+
+async def test_refill_is_capped_by_burst(clock):
+    middleware = ThrottlingMiddleware({"navigation": BucketLimit.per_minute(60, 2)})
+    await middleware(_handler, object(), _data())
+    
+    clock.now += 3600
+    results = [await middleware(_handler, object(), _data()) for _ in range(3)]
+    assert results == ["handled", "handled", None]
+
+async def test_exempt_users_and_unknown_classes(clock):
+    middleware = ThrottlingMiddleware({"navigation": BucketLimit.per_minute(1, 1)}, exempt_ids=[42])
+    
+    for _ in range(3):
+        assert await middleware(_handler, object(), _data(user_id=42)) == "handled"
+        assert await middleware(_handler, object(), _data(bucket="unlimited")) == "handled"
+
+async def test_shared_buckets_allow_requests_when_database_fails():
+    class BrokenDatabase:
+        @asynccontextmanager
+        async def acquire(self, method, **kwargs):
+            raise ConnectionError("database is down")
+            yield
+    
+    middleware = ThrottlingMiddleware(
+        {"navigation": BucketLimit.per_minute(1, 1)}, db=BrokenDatabase(), shared=True
+    )
+    assert await middleware(_handler, object(), _data()) == "handled"
+    assert await middleware(_handler, object(), _data()) == "handled"
+
+def test_shared_buckets_require_database():
+    with pytest.raises(ValueError):
+        ThrottlingMiddleware({}, shared=True)
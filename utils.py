@@ -1,11 +1,28 @@
 # utils.py
 from datetime import datetime, timedelta
-from typing import Dict, List, Any
+from typing import Dict, Any, Iterable, Optional
 import asyncio
 import logging
 
+from models import Marathon, Session
+
 logger = logging.getLogger(__name__)
 
+# Завершенные сессии марафона вместе с архивными сводками по дням.
+# Строка сессии - это день с одной сессией, поэтому агрегаты считаются
+# по sessions_count, total_duration и rating_sum / rating_count.
+MARATHON_SESSIONS_SQL = '''
+    SELECT user_id, DATE(start_time) AS day, 1 AS sessions_count,
+           duration AS total_duration, rating AS rating_sum,
+           (rating IS NOT NULL)::integer AS rating_count
+    FROM sessions
+    WHERE marathon_id = $1 AND end_time IS NOT NULL
+    UNION ALL
+    SELECT user_id, day, sessions_count, total_duration, rating_sum, rating_count
+    FROM sessions_archive
+    WHERE marathon_id = $1
+'''
+
 class MarathonManager:
     """Менеджер для работы с марафонами"""
     
@@ -21,27 +38,27 @@ class MarathonManager:
                 # Получаем марафоны, которые завершились вчера
                 yesterday = (datetime.now() - timedelta(days=1)).date()
                 
-                async with self.db.pool.acquire() as conn:
+                async with self.db.acquire('utils.check_marathon_completions') as conn:
                     marathons = await conn.fetch('''
                         SELECT * FROM marathons
                         WHERE end_date = $1
                     ''', yesterday)
-                    
-                    for marathon in marathons:
-                        await self._process_marathon_completion(dict(marathon))
+                
+                for marathon in marathons:
+                    await self._process_marathon_completion(Marathon.from_record(marathon))
                 
             except Exception as e:
-                logger.error(f"Error in marathon completion check: {e}")
+                logger.error("Error in marathon completion check: %s", e)
             
             # Проверяем раз в день в 10:00
             await asyncio.sleep(86400)  # 24 часа
     
-    async def _process_marathon_completion(self, marathon: Dict[str, Any]):
+    async def _process_marathon_completion(self, marathon: Marathon):
         """Обработка завершения марафона"""
-        marathon_id = marathon['marathon_id']
+        marathon_id = marathon.marathon_id
         
         # Получаем всех участников
-        async with self.db.pool.acquire() as conn:
+        async with self.db.acquire('utils.process_marathon_completion', replica=True) as conn:
             participants = await conn.fetch('''
                 SELECT user_id FROM marathon_participants
                 WHERE marathon_id = $1
@@ -61,7 +78,7 @@ class MarathonManager:
             try:
                 await self.bot.send_message(user_id, report, parse_mode="Markdown")
             except Exception as e:
-                logger.error(f"Failed to send report to user {user_id}: {e}")
+                logger.error("Failed to send report to user %s: %s", user_id, e)
         
         # Генерируем и отправляем общую статистику
         group_stats = await self._get_marathon_group_stats(marathon_id)
@@ -69,32 +86,32 @@ class MarathonManager:
     
     async def _get_marathon_user_stats(self, user_id: int, marathon_id: int) -> Dict[str, Any]:
         """Получение статистики пользователя в марафоне"""
-        async with self.db.pool.acquire() as conn:
-            stats = await conn.fetchrow('''
+        async with self.db.acquire('utils.get_marathon_user_stats', replica=True) as conn:
+            stats = await conn.fetchrow(f'''
                 SELECT 
-                    COUNT(*) as sessions_count,
-                    COALESCE(SUM(duration), 0) as total_duration,
-                    COALESCE(AVG(rating), 0) as avg_rating,
-                    COUNT(DISTINCT DATE(start_time)) as unique_days
-                FROM sessions
-                WHERE user_id = $1 AND marathon_id = $2 AND end_time IS NOT NULL
-            ''', user_id, marathon_id)
-            
-            marathon_info = await self.db.get_marathon(marathon_id)
-            progress = await self.db.get_marathon_progress(user_id, marathon_id)
-            
-            return {
-                **dict(stats),
-                **progress,
-                'marathon_info': marathon_info
-            }
+                    COALESCE(SUM(sessions_count), 0) as sessions_count,
+                    COALESCE(SUM(total_duration), 0) as total_duration,
+                    COALESCE(SUM(rating_sum)::numeric / NULLIF(SUM(rating_count), 0), 0) as avg_rating,
+                    COUNT(DISTINCT day) as unique_days
+                FROM ({MARATHON_SESSIONS_SQL}) marathon_sessions
+                WHERE user_id = $2
+            ''', marathon_id, user_id)
+        
+        marathon_info = await self.db.get_marathon(marathon_id)
+        progress = await self.db.get_marathon_progress(user_id, marathon_id)
+        
+        return {
+            **dict(stats),
+            **progress._asdict(),
+            'marathon_info': marathon_info
+        }
     
-    async def _generate_personal_report(self, stats: Dict[str, Any], marathon: Dict[str, Any]) -> str:
+    async def _generate_personal_report(self, stats: Dict[str, Any], marathon: Marathon) -> str:
         """Генерация персонального отчета"""
         # Генерируем сводку от ИИ
         ai_summary = await self.ai.generate_marathon_summary(stats, marathon)
         
-        report = f"""🏆 **Марафон "{marathon['title']}" завершен!**
+        report = f"""🏆 **Марафон "{marathon.title}" завершен!**
 
 📊 **Ваши результаты:**
 • Выполнено дней: {stats['completed_days']}/{stats['total_days']}
@@ -111,7 +128,10 @@ class MarathonManager:
     
     async def _get_marathon_group_stats(self, marathon_id: int) -> Dict[str, Any]:
         """Получение групповой статистики марафона"""
-        async with self.db.pool.acquire() as conn:
+        marathon_info = await self.db.get_marathon(marathon_id)
+        
+        # Тяжелые агрегаты по всему марафону читаем с реплики
+        async with self.db.acquire('utils.get_marathon_group_stats', replica=True) as conn:
             # Общее количество участников
             total_participants = await conn.fetchval('''
                 SELECT COUNT(*) FROM marathon_participants
@@ -119,36 +139,32 @@ class MarathonManager:
             ''', marathon_id)
             
             # Участники, выполнившие хотя бы одну медитацию
-            active_participants = await conn.fetchval('''
-                SELECT COUNT(DISTINCT user_id) FROM sessions
-                WHERE marathon_id = $1 AND end_time IS NOT NULL
+            active_participants = await conn.fetchval(f'''
+                SELECT COUNT(DISTINCT user_id) FROM ({MARATHON_SESSIONS_SQL}) marathon_sessions
             ''', marathon_id)
             
             # Участники, достигшие цели
-            marathon_info = await self.db.get_marathon(marathon_id)
-            goal_achievers = await conn.fetchval('''
+            goal_achievers = await conn.fetchval(f'''
                 WITH user_days AS (
                     SELECT 
                         user_id,
-                        COUNT(DISTINCT DATE(start_time)) as days_completed
-                    FROM sessions
-                    WHERE marathon_id = $1 AND end_time IS NOT NULL
+                        COUNT(DISTINCT day) as days_completed
+                    FROM ({MARATHON_SESSIONS_SQL}) marathon_sessions
                     GROUP BY user_id
                 )
                 SELECT COUNT(*) FROM user_days
                 WHERE days_completed >= $2
             ''', marathon_id, 
-            (marathon_info['end_date'] - marathon_info['start_date']).days * 0.8)  # 80% дней
+            (marathon_info.end_date - marathon_info.start_date).days * 0.8)  # 80% дней
             
             # Общая статистика
-            total_stats = await conn.fetchrow('''
+            total_stats = await conn.fetchrow(f'''
                 SELECT 
-                    COUNT(*) as total_sessions,
-                    COALESCE(SUM(duration), 0) as total_duration,
-                    COALESCE(AVG(duration), 0) as avg_duration,
-                    COALESCE(AVG(rating), 0) as avg_rating
-                FROM sessions
-                WHERE marathon_id = $1 AND end_time IS NOT NULL
+                    COALESCE(SUM(sessions_count), 0) as total_sessions,
+                    COALESCE(SUM(total_duration), 0) as total_duration,
+                    COALESCE(SUM(total_duration)::numeric / NULLIF(SUM(sessions_count), 0), 0) as avg_duration,
+                    COALESCE(SUM(rating_sum)::numeric / NULLIF(SUM(rating_count), 0), 0) as avg_rating
+                FROM ({MARATHON_SESSIONS_SQL}) marathon_sessions
             ''', marathon_id)
             
             return {
@@ -158,12 +174,12 @@ class MarathonManager:
                 **dict(total_stats)
             }
     
-    async def _send_group_statistics(self, marathon: Dict[str, Any], stats: Dict[str, Any]):
+    async def _send_group_statistics(self, marathon: Marathon, stats: Dict[str, Any]):
         """Отправка групповой статистики администраторам"""
         # Здесь можно отправить статистику в специальный канал или администраторам
         completion_rate = (stats['active_participants'] / stats['total_participants'] * 100) if stats['total_participants'] > 0 else 0
         
-        report = f"""📊 **Итоги марафона "{marathon['title']}"**
+        report = f"""📊 **Итоги марафона "{marathon.title}"**
 
 👥 **Участники:**
 • Всего зарегистрировано: {stats['total_participants']}
@@ -185,7 +201,26 @@ class MarathonManager:
             try:
                 await self.bot.send_message(admin_id, report, parse_mode="Markdown")
             except Exception as e:
-                logger.error(f"Failed to send group stats to admin {admin_id}: {e}")
+                logger.error("Failed to send group stats to admin %s: %s", admin_id, e)
+
+def average_rating(sessions: Iterable[Session]) -> Optional[float]:
+    """Средняя оценка сессий и архивных дней.
+    
+    Сессии без оценки пропускаются, архивный день учитывается суммой своих
+    оценок rating_sum (rating у него округлен). None - если оценок нет.
+    """
+    total = weight = 0
+    for session in sessions:
+        if session.rating is not None and session.rating_count:
+            total += session.rating if session.rating_sum is None else session.rating_sum
+            weight += session.rating_count
+    return total / weight if weight else None
+
+def format_rating(rating: Optional[float]) -> str:
+    """Форматирование средней оценки"""
+    if rating is None:
+        return "нет оценок"
+    return f"{rating:.1f}/10"
 
 def format_duration(minutes: int) -> str:
     """Форматирование продолжительности"""
@@ -197,21 +232,80 @@ def format_duration(minutes: int) -> str:
     else:
         return f"{mins} мин"
 
-def get_meditation_streak(sessions: List[Dict[str, Any]]) -> int:
-    """Подсчет текущей серии медитаций (дней подряд)"""
-    if not sessions:
-        return 0
-    
-    dates = sorted([s['start_time'].date() for s in sessions], reverse=True)
-    streak = 1
-    
-    for i in range(1, len(dates)):
-        if dates[i] == dates[i-1] - timedelta(days=1):
-            streak += 1
-        else:
-            break
-    
-    return streak
+async def maintain_dialogue_history(db, config):
+    """Обслуживание партиций истории диалогов: новые месяцы и удаление истекших"""
+    while True:
+        try:
+            await db.ensure_dialogue_partitions(config.DIALOGUE_PARTITIONS_AHEAD)
+            await db.clear_old_dialogue_history(config.DIALOGUE_RETENTION_DAYS)
+        except Exception as e:
+            logger.error("Error in dialogue history maintenance: %s", e)
+        
+        # Проверяем раз в сутки
+        await asyncio.sleep(86400)
+
+async def maintain_sessions_archive(db, config):
+    """Обслуживание партиций сессий: следующий год и архивирование старых лет"""
+    while True:
+        try:
+            await db.ensure_sessions_partitions()
+            await db.archive_old_sessions(config.SESSIONS_ARCHIVE_AFTER_DAYS)
+        except Exception as e:
+            logger.error("Error in sessions archive maintenance: %s", e)
+        
+        # Проверяем раз в сутки
+        await asyncio.sleep(86400)
+
+async def maintain_fsm_storage(storage):
+    """Удаление устаревших состояний FSM из БД"""
+    while True:
+        try:
+            removed = await storage.purge_expired()
+            if removed:
+                logger.info("Removed %s expired FSM states", removed)
+        except Exception as e:
+            logger.error("Error in FSM storage maintenance: %s", e)
+        
+        # Проверяем раз в час
+        await asyncio.sleep(3600)
+
+async def maintain_throttle_buckets(throttling):
+    """Удаление неиспользуемых общих счетчиков ограничения частоты"""
+    while True:
+        try:
+            await throttling.purge_shared()
+        except Exception as e:
+            logger.error("Error in throttle buckets maintenance: %s", e)
+        
+        # Проверяем раз в час
+        await asyncio.sleep(3600)
+
+async def sweep_stale_sessions(bot, db, config):
+    """Закрытие забытых медитаций и сверка реестра с БД"""
+    while True:
+        try:
+            closed = await db.close_stale_sessions(config.STALE_SESSION_HOURS)
+            for session in closed:
+                try:
+                    await bot.send_message(
+                        session.user_id,
+                        f"⏰ Медитация, начатая {session.start_time.strftime('%d.%m %H:%M')}, "
+                        f"не была завершена и закрыта автоматически.\n"
+                        f"Если вы медитировали, запишите практику через «📝 Записать медитацию»."
+                    )
+                except Exception as e:
+                    logger.error("Failed to notify user %s about auto-closed session: %s", session.user_id, e)
+            
+            if closed:
+                logger.info("Auto-closed %s stale sessions", len(closed))
+            
+            # Сессии могли начать или завершить другие процессы
+            await db.reload_active_sessions()
+        except Exception as e:
+            logger.error("Error in stale sessions sweep: %s", e)
+        
+        # Проверяем раз в минуту
+        await asyncio.sleep(60)
 
 async def send_daily_reminder(bot, db):
     """Отправка ежедневных напоминаний участникам марафонов"""
@@ -221,7 +315,7 @@ async def send_daily_reminder(bot, db):
             
             # Отправляем напоминания в 9:00
             if current_time.hour == 9 and current_time.minute == 0:
-                async with db.pool.acquire() as conn:
+                async with db.acquire('utils.send_daily_reminder') as conn:
                     # Получаем участников активных марафонов
                     participants = await conn.fetch('''
                         SELECT DISTINCT mp.user_id, m.title, m.daily_goal
@@ -254,11 +348,11 @@ async def send_daily_reminder(bot, db):
                                     message
                                 )
                             except Exception as e:
-                                logger.error(f"Failed to send reminder: {e}")
+                                logger.error("Failed to send reminder: %s", e)
             
             # Ждем минуту перед следующей проверкой
             await asyncio.sleep(60)
             
         except Exception as e:
-            logger.error(f"Error in daily reminder: {e}")
+            logger.error("Error in daily reminder: %s", e)
             await asyncio.sleep(60)
@@ -0,0 +1,88 @@
+# webhook.py
+import asyncio
+import logging
+from typing import Any
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+class LimitedRequestHandler(SimpleRequestHandler):
+    """Обработчик вебхука с ограничением числа одновременно обрабатываемых обновлений.
+    
+    Обновление подтверждается Telegram сразу и обрабатывается в фоне. Когда
+    занято max_in_flight слотов, ответ на запрос задерживается до освобождения
+    слота - Telegram не шлет больше max_connections запросов одновременно,
+    поэтому очередь не растет бесконечно.
+    """
+    
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, *,
+                 max_in_flight: int = 100,
+                 shutdown_timeout: float = 10,
+                 **kwargs: Any):
+        super().__init__(dispatcher, bot, handle_in_background=True, **kwargs)
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+        self.shutdown_timeout = shutdown_timeout
+    
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        update = await request.json(loads=bot.session.json_loads)
+        await self._in_flight.acquire()
+        
+        task = asyncio.create_task(self._background_feed_update(bot=bot, update=update))
+        self._background_feed_update_tasks.add(task)
+        task.add_done_callback(self._background_feed_update_tasks.discard)
+        task.add_done_callback(lambda _: self._in_flight.release())
+        return web.json_response({}, dumps=bot.session.json_dumps)
+    
+    async def close(self) -> None:
+        """Дождаться обработки принятых обновлений и закрыть сессию бота"""
+        if self._background_feed_update_tasks:
+            _, pending = await asyncio.wait(
+                set(self._background_feed_update_tasks), timeout=self.shutdown_timeout
+            )
+            if pending:
+                logger.warning("%d updates still in progress on shutdown", len(pending))
+        await super().close()
+
+def create_webhook_app(dp: Dispatcher, bot: Bot, config, **data: Any) -> web.Application:
+    """aiohttp-приложение с обработчиком вебхука на config.WEBHOOK_PATH"""
+    app = web.Application()
+    handler = LimitedRequestHandler(
+        dp, bot,
+        max_in_flight=config.WEBHOOK_MAX_IN_FLIGHT,
+        secret_token=config.WEBHOOK_SECRET or None,
+        **data
+    )
+    handler.register(app, path=config.WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot, **data)
+    return app
+
+async def run_webhook(dp: Dispatcher, bot: Bot, config, **data: Any):
+    """Запуск бота в режиме вебхука.
+    
+    Если задан WEBHOOK_URL, вебхук регистрируется в Telegram при старте.
+    Без него сервер только принимает запросы (вебхук настроен снаружи или
+    обновления отправляются вручную для проверки).
+    """
+    app = create_webhook_app(dp, bot, config, **data)
+    
+    if config.WEBHOOK_URL:
+        await bot.set_webhook(
+            url=config.WEBHOOK_URL.rstrip("/") + config.WEBHOOK_PATH,
+            secret_token=config.WEBHOOK_SECRET or None,
+            max_connections=config.WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=dp.resolve_used_update_types()
+        )
+    
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, config.WEBHOOK_HOST, config.WEBHOOK_PORT)
+    await site.start()
+    logger.info("Webhook server listening on %s:%s%s", config.WEBHOOK_HOST, config.WEBHOOK_PORT, config.WEBHOOK_PATH)
+    
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()